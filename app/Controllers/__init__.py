@@ -4,6 +4,8 @@ from app.controllers.auth_controller import auth
 from app.controllers.questions_controller import questions
 from app.controllers.answers_controller import answers
 from app.controllers.categories_controller import categories
+from app.controllers.search_controller import search
+from app.controllers.locations_controller import locations
 
 registerable_controllers = [
     index,
@@ -11,5 +13,7 @@ registerable_controllers = [
     auth,
     questions,
     answers,
-    categories
+    categories,
+    search,
+    locations
 ]
\ No newline at end of file
@@ -1,39 +1,153 @@
+import hashlib
 from flask import Blueprint, request
 from flask_jwt_extended import jwt_required
 from marshmallow import ValidationError
-from app import db
+from sqlalchemy import literal, select
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+from app import db, cache, votes
+from app.conditional import conditional
 from app.models.answer import Answer
+from app.models.question import Question, touch_questions
 from app.models.recommendation import Recommendation
+from app.models.user import update_user_stats
+from app.models.vote_event import pending_votes
 from app.schemas.answer_schema import (
-    answer_schema, answer_details_schema, answers_schema)
+    answer_schema, answer_details_schema, answers_schema,
+    answers_details_schema, answers_schema_options)
 from app.utils import (
-    duplicate_exists, record_not_found, get_logged_in_user, unauthorised_editor)
+    insert_unless_exists, record_not_found, get_logged_in_user,
+    unauthorised_editor, paginate, show_page, post_cache_tags, wants_stream,
+    stream_records, get_id_list, show_records_by_id)
 
 
 answers = Blueprint("answers", __name__, url_prefix="/answers")
 
 
+def load_reply_trees(answers_list, max_depth=None) -> list:
+    """ Load the replies to the given answers, down to max_depth levels,
+    with a single recursive query, attach them to each answer and return
+    all of the replies loaded """
+    if max_depth == 0:
+        for answer in answers_list:
+            set_committed_value(answer, "replies", [])
+        return []
+
+    # Start from the direct replies to the given answers (depth 1)
+    tree = select(Answer.answer_id, literal(1).label("depth")).where(
+        Answer.parent_id.in_(
+            [answer.answer_id for answer in answers_list])
+    ).cte("reply_tree", recursive=True)
+    # Then repeatedly add the replies to the answers already found
+    replies_step = select(Answer.answer_id, tree.c.depth + 1).where(
+        Answer.parent_id == tree.c.answer_id)
+    if max_depth is not None:
+        replies_step = replies_step.where(tree.c.depth < max_depth)
+    tree = tree.union_all(replies_step)
+
+    replies_list = Answer.query.join(
+        tree, Answer.answer_id == tree.c.answer_id
+    ).options(joinedload(Answer.author)).order_by(Answer.answer_id).all()
+
+    # Group the replies by parent and assign them in memory, so that
+    # serialising the tree doesn't lazy load any further replies
+    replies_by_parent = {}
+    for reply in replies_list:
+        replies_by_parent.setdefault(reply.parent_id, []).append(reply)
+    for answer in answers_list + replies_list:
+        set_committed_value(
+            answer, "replies", replies_by_parent.get(answer.answer_id, []))
+    return replies_list
+
+
+def get_max_depth():
+    """ Return the max_depth query argument as an integer, or None """
+    max_depth = request.args.get("max_depth")
+    if max_depth is None:
+        return None
+    if not max_depth.isdigit():
+        raise ValidationError(
+            {"max_depth": ["The max_depth must be a positive integer."]})
+    return int(max_depth)
+
+
 @answers.get("/")
 def get_answers():
-    """ Get all answers posted to all questions """
-    # Get all answers from the database
-    answers_list = Answer.query.all()
+    """ Get all answers posted to all questions, or the answers with the
+    given ids """
+    # Get the answers with the given ids, in order, with their reply trees
+    ids = get_id_list()
+    if ids is not None:
+        answers_list = Answer.query.options(
+            *answers_schema_options, joinedload(Answer.question)).filter(
+            Answer.answer_id.in_(ids)).all()
+        if answers_list:
+            load_reply_trees(answers_list, get_max_depth())
+        return show_records_by_id(
+            ids, answers_list, Answer.answer_id, answers_details_schema.dump)
+
+    # Stream every answer if the client asked for a stream
+    if wants_stream():
+        return stream_records(
+            Answer.query.options(*answers_schema_options),
+            Answer.date_time, Answer.answer_id, answers_schema)
 
-    # Return a list of all answers
+    # Get a page of answers from the database
+    answers_list, next_page = paginate(
+        Answer.query.options(*answers_schema_options),
+        Answer.date_time, Answer.answer_id)
+
+    # Return a page of answers
     if answers_list:
-        return answers_schema.dump(answers_list)
+        return show_page(answers_schema.dump(answers_list), next_page)
     else:
         return {"message": "There are no answers posted yet."}
 
 
+def answer_version(id) -> tuple | None:
+    """ Return the ETag and last modified time of an answer by id, or None
+    if it isn't found. Replies can be posted to other questions, so an
+    answer's version combines the versions of every question in its reply
+    tree, which are bumped by any change to their answers or votes. """
+    # Find the questions of the answer and of all of its replies
+    tree = select(Answer.answer_id, Answer.question_id).where(
+        Answer.answer_id == id).cte("version_tree", recursive=True)
+    tree = tree.union_all(select(Answer.answer_id, Answer.question_id).where(
+        Answer.parent_id == tree.c.answer_id))
+    versions = db.session.execute(
+        select(Question.question_id, Question.revision, Question.updated_at,
+               pending_votes(Question.question_id)).where(
+            Question.question_id.in_(select(tree.c.question_id))
+        ).order_by(Question.question_id)).all()
+    if not versions:
+        return None
+
+    # Combine the question versions into one short tag
+    stamps = []
+    for version in versions:
+        stamps.append(f"{version.question_id}.{version.revision}")
+        if version.pending_votes is not None:
+            stamps[-1] += f".{version.pending_votes}"
+    digest = hashlib.sha256(",".join(stamps).encode("utf-8")).hexdigest()
+    etag = f"answer-{id}-{digest[:16]}"
+    return etag, max((version.updated_at for version in versions
+                      if version.updated_at is not None), default=None)
+
+
 @answers.get("/<int:id>")
+@conditional(answer_version)
+@cache.cached()
 def get_answer(id):
     """ Get an answer by answer_id """
+    max_depth = get_max_depth()
     # Get the answer from the databse by id
     answer = Answer.query.get(id)
 
     # Check if answer exists
     if answer:
+        # Fetch the whole reply tree in one query before serialising it
+        replies_list = load_reply_trees([answer], max_depth)
+        cache.tag(*post_cache_tags(answers=[answer] + replies_list))
         return answer_details_schema.dump(answer)
     else:
         return record_not_found("answer")
@@ -61,6 +175,7 @@ def edit_answer(id):
             answer.body = answer_fields["answer"]
             db.session.add(answer)
             db.session.commit()
+            cache.invalidate(f"question:{answer.question_id}")
             return {"success": "Your answer was edited. View it here: "
                     f"/answers/{answer.answer_id}"}
     else:
@@ -84,6 +199,7 @@ def delete_question(id):
         # Delete the answer from the database and commit
         db.session.delete(answer)
         db.session.commit()
+        cache.invalidate(f"question:{answer.question_id}")
         return {"success": f"Answer {answer.answer_id} was deleted "
                 f"from Question {answer.question_id}. View the question: "
                 f"/questions/{answer.question_id}"}
@@ -95,6 +211,17 @@ def delete_question(id):
 @jwt_required()
 def recommend_answer(id, vote_action):
     """ Vote for an answer as the recommended answer to a question """
+    # With write-behind votes, record the vote to be applied with the next
+    # batch in one statement. Answer counts include it straight away.
+    if votes.enabled and vote_action in ["vote", "remove-vote"]:
+        if not votes.record(id, get_logged_in_user(), vote_action == "vote"):
+            return record_not_found("answer")
+        if vote_action == "vote":
+            return {"success": f"Your recommendation of Answer {id} was "
+                    f"recorded: /answers/{id}"}, 202
+        return {"success": f"The removal of your recommendation of Answer "
+                f"{id} was recorded: /answers/{id}"}, 202
+
     # Get the answer from the database by id
     answer = Answer.query.get(id)
 
@@ -102,26 +229,23 @@ def recommend_answer(id, vote_action):
     if not answer:
         return record_not_found("answer")
 
-    # Get recommendation from database if it exists (in case removing a vote)
-    vote = Recommendation.query.filter(
-        Recommendation.answer_id == answer.answer_id,
-        Recommendation.user_id == get_logged_in_user()
-    ).first()
-
     # The user is adding a new recommendation to an answer
     if vote_action == "vote":
-        # Construct the new recommendation
-        new_vote = Recommendation(
-            answer_id=answer.answer_id,
-            user_id=get_logged_in_user()
-        )
-        # Check if user has recommended this answer already
-        if duplicate_exists(new_vote, Recommendation, ["vote_id"]):
+        # Add the recommendation unless the user has recommended this
+        # answer already, in one statement that can't double-insert
+        if not insert_unless_exists(Recommendation, {
+            "answer_id": answer.answer_id,
+            "user_id": get_logged_in_user()
+        }, ["answer_id", "user_id"]):
             return {"message": "You have already recommended this answer."}
         else:
-            # Add the recommendation to the database and commit
-            db.session.add(new_vote)
+            # Count the vote and bump the question's revision like the ORM
+            # insert events would, and commit
+            update_user_stats(
+                db.session.connection(), get_logged_in_user(), votes_count=1)
+            touch_questions(db.session.connection(), [answer.question_id])
             db.session.commit()
+            cache.invalidate(f"question:{answer.question_id}")
             return {"success": f"You recommended Answer {answer.answer_id} "
                     f"'{answer.body}': "
                     f"/answers/{answer.answer_id} "
@@ -130,6 +254,12 @@ def recommend_answer(id, vote_action):
 
     # The user is removing their recommendation from an answer
     elif vote_action == "remove-vote":
+        # Get the user's recommendation from the database if it exists
+        vote = Recommendation.query.filter(
+            Recommendation.answer_id == answer.answer_id,
+            Recommendation.user_id == get_logged_in_user()
+        ).first()
+
         # Check if user has recommended this answer
         # (can't remove nonexistant vote)
         if not vote:
@@ -142,6 +272,7 @@ def recommend_answer(id, vote_action):
                 # Delete the recommendation from database and commmit
                 db.session.delete(vote)
                 db.session.commit()
+                cache.invalidate(f"question:{answer.question_id}")
                 return {"success": f"You removed your recommendation from "
                         f"Answer {answer.answer_id} '{answer.body}': "
                         f"/answers/{answer.answer_id} "
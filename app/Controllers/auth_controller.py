@@ -1,10 +1,11 @@
 from flask import Blueprint, request
 from marshmallow import ValidationError
 from sqlalchemy import or_
-from app import db, bcrypt
+from app import db, passwords
 from flask_jwt_extended import create_access_token
 from datetime import timedelta
 from app.models.user import User
+from app.passwords import PasswordHasherBusy
 from app.schemas.user_schema import user_schema
 
 
@@ -36,8 +37,7 @@ def register_user():
     new_user = User(
         username=user_fields["username"],
         email=user_fields["email"],
-        password=(bcrypt.generate_password_hash(
-            user_fields["password"]).decode("utf-8"))
+        password=passwords.generate(user_fields["password"])
     )
 
     # Add the user to the database and commit
@@ -70,9 +70,18 @@ def login_user():
     # Check provided password
     if not password:
         return {"error": "You must enter a password"}
-    if not bcrypt.check_password_hash(user.password, password):
+    if not passwords.check(user.password, password):
         return {"error": "The password is incorrect."}, 401
 
+    # Upgrade the stored hash if the configured bcrypt cost has changed,
+    # unless the hashing queue is too busy to do it now
+    if passwords.needs_rehash(user.password):
+        try:
+            user.password = passwords.generate(password)
+            db.session.commit()
+        except PasswordHasherBusy:
+            pass
+
     # If user exists and password is correct, issue an access token
     access_token = create_access_token(
         identity=str(user.user_id),
@@ -85,3 +94,10 @@ def login_user():
 @auth.errorhandler(ValidationError)
 def register_validation_error(error):
     return error.messages, 400
+
+
+# Turn requests away while the password hashing queue is full
+@auth.errorhandler(PasswordHasherBusy)
+def register_password_hasher_busy(error):
+    return ({"error": "The server is busy. Please try again shortly."},
+            503, {"Retry-After": "1"})
@@ -1,39 +1,47 @@
 from flask import Blueprint, jsonify
 from marshmallow import ValidationError
-from app.models.category import Category
+from app import cache
 from app.models.question import Question
 from app.controllers.questions_controller import show_questions_list
+from app.reference_data import reference_data, reference_version
 from app.schemas.category_schema import categories_schema
 
 categories = Blueprint("categories", __name__, url_prefix="/categories")
 
 
 @categories.get("/")
+@cache.cached(vary=reference_version)
 def get_categories():
     """ Get a list of all available categories """
-    # Get all categoires form the database
-    categories = Category.query.all()
+    cache.tag("categories")
+    # Get all categories from the worker's reference data
+    categories = reference_data.get().categories
     # Return the list of all categories
     return jsonify(categories_schema.dump(categories))
 
 
 @categories.get("/<id>")
+@cache.cached(vary=reference_version)
 def get_questions_by_category(id):
     """ Return all questions for a given category name or id """
-    # Get all questions from the specified category by category_id
+    # Look up the category_id of a category_name without a join
     if id.isdigit():
-        questions_list = Question.query.filter(
-            Question.category_id == id,
-        ).all()
-
-    # Get all questions from the specified category by category_name
+        category_id = int(id)
     else:
-        questions_list = Question.query.join(
-            Question.category).filter_by(
-                category_name=id.title()
-        ).all()
-    # Return the list of questions for the category
-    return show_questions_list(questions_list)
+        category = reference_data.get().category(category_name=id)
+        if not category:
+            return {"message": "No matching questions were found."}, 404
+        category_id = category.category_id
+
+    # New questions in the category invalidate the cached pages
+    cache.tag(f"category:{category_id}")
+
+    # Get all questions from the specified category by category_id
+    questions_query = Question.query.filter(
+        Question.category_id == category_id,
+    )
+    # Return a page of questions for the category
+    return show_questions_list(questions_query)
 
 
 # Return any other validation errors that are raised
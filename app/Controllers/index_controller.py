@@ -1,4 +1,5 @@
-from flask import Blueprint, send_file
+from flask import Blueprint, Response, send_file
+from app import cache, metrics
 
 index = Blueprint("index", __name__)
 
@@ -20,3 +21,16 @@ def get_help():
         return {"error": "The help file 'README.md' could not be found."}
     except Exception as error:
         return {"error": str(error)}
+
+
+@index.get("/cache/stats")
+def get_cache_stats():
+    """ Return the response cache hit and miss counts, for sizing it """
+    return cache.stats()
+
+
+@index.get("/metrics")
+def get_metrics():
+    """ Return request and database pool metrics for Prometheus """
+    return Response(metrics.render(),
+                    content_type="text/plain; version=0.0.4; charset=utf-8")
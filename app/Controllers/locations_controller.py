@@ -0,0 +1,33 @@
+from flask import Blueprint, request
+from app.location_index import location_index
+
+
+locations = Blueprint("locations", __name__, url_prefix="/locations")
+
+# Number of suggestions returned by default, and the most allowed
+SUGGEST_LIMIT_DEFAULT = 10
+SUGGEST_LIMIT_MAX = 50
+
+
+@locations.get("/suggest")
+def suggest_locations():
+    """ Return the locations whose suburb name or postcode starts with the
+    given text, to find the location_id to post a question with """
+    # Make sure there is something to match
+    prefix = request.args.get("q", "").strip()
+    if not prefix:
+        return {"error": "You must provide the start of a suburb name or "
+                "postcode using the q query string argument (e.g., "
+                "/locations/suggest?q=surry)."}, 400
+
+    limit = request.args.get("limit", str(SUGGEST_LIMIT_DEFAULT))
+    if not limit.isdigit() or not 0 < int(limit) <= SUGGEST_LIMIT_MAX:
+        return {"error": "The limit must be an integer between 1 and "
+                f"{SUGGEST_LIMIT_MAX}."}, 400
+
+    # Look the prefix up in this worker's in-memory location index
+    suggestions = location_index.get().suggest(prefix, int(limit))
+    if not suggestions:
+        return {"message": "No matching locations were found."}, 404
+    return {"results": [
+        suggestion._asdict() for suggestion in suggestions]}
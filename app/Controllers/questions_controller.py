@@ -1,37 +1,67 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app as app, jsonify, request
 from flask_jwt_extended import jwt_required
 from marshmallow import ValidationError
+from sqlalchemy import select, tuple_
 from app.utils import (
-    duplicate_exists, current_datetime, record_not_found,
-    unauthorised_editor, get_logged_in_user)
-from app import db
+    dialect_insert, reserve_ids, content_hash,
+    insert_or_get_id, current_datetime, record_not_found,
+    unauthorised_editor, get_logged_in_user, paginate, show_page,
+    post_cache_tags, wants_stream, stream_records, get_page_limit,
+    get_id_list, show_records_by_id,
+    next_page_url, encode_cursor, decode_cursor)
+from app import db, cache
+from app.conditional import conditional
+from app.geo import nearby_questions
+from app.location_index import LocationRecord, location_index
 from app.models.question import Question
-from app.models.country import Country
 from app.models.location import Location
 from app.models.category import Category
-from app.models.user import User
+from app.models.user import User, update_user_stats
 from app.models.answer import Answer
+from app.models.vote_event import pending_votes
 from app.schemas.question_schema import (
-    question_details_schema,
-    question_update_schema, questions_schema, question_post_schema)
+    question_details_schema, question_update_schema, questions_schema,
+    question_post_schema, questions_schema_options,
+    questions_details_schema, questions_details_schema_options)
 from app.schemas.answer_schema import answer_schema
+from app.reference_data import reference_data
 
 
 questions = Blueprint("questions", __name__, url_prefix="/questions")
 
 
-def show_questions_list(questions_list):
-    """ Returns a list of questions from a given query object if any
-    exist, otherwise returns an error message """
+def show_questions_list(questions_query):
+    """ Returns a page of questions from a given query object if any
+    exist, otherwise returns an error message. Streams every question
+    instead if the client asked for a stream. """
+    if wants_stream():
+        return stream_records(
+            questions_query.options(*questions_schema_options),
+            Question.date_time, Question.question_id, questions_schema)
+    questions_list, next_page = paginate(
+        questions_query.options(*questions_schema_options),
+        Question.date_time, Question.question_id)
     if questions_list:
-        return jsonify(questions_schema.dump(questions_list))
+        cache.tag(*post_cache_tags(questions=questions_list))
+        return jsonify(show_page(
+            questions_schema.dump(questions_list), next_page))
     else:
         return {"message": "No matching questions were found."}, 404
 
 
 @questions.get("/")
 def get_questions():
-    """ Return a list of all questions matching filters """
+    """ Return a list of all questions matching filters, or the questions
+    with the given ids """
+    # Get the questions with the given ids, in order, with one query
+    ids = get_id_list()
+    if ids is not None:
+        return show_records_by_id(
+            ids,
+            Question.query.options(*questions_details_schema_options).filter(
+                Question.question_id.in_(ids)).all(),
+            Question.question_id, questions_details_schema.dump)
+
     filterable_attributes = [
         "user_id",
         "username",
@@ -58,6 +88,10 @@ def get_questions():
             "country": {}
         }
 
+        # Pagination and streaming arguments are not filters
+        for key in ["limit", "cursor", "stream"]:
+            filter_list.pop(key, None)
+
         # Check if supplied filter attributes can be used
         valid_filters = True
         for key, value in filter_list.items():
@@ -82,7 +116,7 @@ def get_questions():
 
         # Filter questions list using request arguments
         if valid_filters:
-            questions_list = Question.query.filter_by(
+            questions_query = Question.query.filter_by(
                 **join_filters["question"]).join(
                 User.query.filter_by(**join_filters["user"])).join(
                     Location.query.filter_by(
@@ -90,10 +124,10 @@ def get_questions():
                     Category.query.filter_by(
                         **join_filters["category"])).join(
                             Location.country
-            ).all()
+            )
 
             # Query ran successfully
-            return show_questions_list(questions_list)
+            return show_questions_list(questions_query)
 
         # One or more filters passed as URL query arguments were invalid
         else:
@@ -105,157 +139,424 @@ def get_questions():
                     "for Australia)."}, 400
     else:
         # If there are no query filters, get all questions and show them
-        questions_list = Question.query.all()
-        return show_questions_list(questions_list)
+        return show_questions_list(Question.query)
+
+
+def get_number_arg(name: str, minimum: float, maximum: float,
+                   default: float | None = None) -> float:
+    """ Return a number from the query string, checked against a range """
+    value = request.args.get(name)
+    if value is None and default is not None:
+        return default
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        number = None
+    if number is None or not (minimum <= number <= maximum):
+        raise ValidationError({name: [
+            f"The {name} must be a number between {minimum:g} and "
+            f"{maximum:g}."]})
+    return number
+
+
+@questions.get("/nearby")
+def get_nearby_questions():
+    """ Return the questions asked at locations within radius_km of a
+    point (lat and lon), nearest first """
+    latitude = get_number_arg("lat", -90, 90)
+    longitude = get_number_arg("lon", -180, 180)
+    radius_km = get_number_arg(
+        "radius_km", 0, app.config["GEO_MAX_RADIUS_KM"],
+        app.config["GEO_DEFAULT_RADIUS_KM"])
+
+    # Get a page of questions, plus one to find out if there is a next page
+    limit = get_page_limit()
+    cursor = request.args.get("cursor")
+    keys = nearby_questions(
+        latitude, longitude, radius_km, limit + 1,
+        decode_cursor(cursor, float, int, int) if cursor else None)
+    if not keys:
+        return {"message": "No questions were found within "
+                f"{radius_km:g} km."}, 404
+
+    next_page = None
+    if len(keys) > limit:
+        keys = keys[:limit]
+        next_page = next_page_url(limit, encode_cursor(keys[-1]))
+
+    # Load the page of questions and put them back in order of distance
+    questions_by_id = {
+        question.question_id: question for question in
+        Question.query.options(*questions_schema_options).filter(
+            Question.question_id.in_(
+                [question_id for _, _, question_id in keys]))}
+    # (skipping any deleted since their ids were found)
+    keys = [key for key in keys if key[2] in questions_by_id]
+    results = questions_schema.dump(
+        [questions_by_id[question_id] for _, _, question_id in keys])
+    for result, (distance, _, _) in zip(results, keys):
+        result["distance_km"] = round(distance, 2)
+    return jsonify(show_page(results, next_page))
+
+
+def question_version(id) -> tuple | None:
+    """ Return the ETag and last modified time of a question by id, or
+    None if it isn't found """
+    if not id.isdigit():
+        return None
+    version = db.session.execute(
+        select(Question.revision, Question.updated_at,
+               pending_votes(Question.question_id)).where(
+            Question.question_id == int(id))).first()
+    if not version:
+        return None
+    etag = f"question-{id}-{version.revision}"
+    if version.pending_votes is not None:
+        etag += f"-{version.pending_votes}"
+    return etag, version.updated_at
 
 
 @questions.get("/<id>")
+@conditional(question_version)
+@cache.cached()
 def get_question(id):
     """ Return a specific question by id with all of its answers """
     # Make sure id is an integer, else return custom error message
     if not id.isdigit():
         return {"error": "The question_id must be an integer. "}, 400
 
-    # Get the question form the database by id
-    question = Question.query.get(id)
+    # Get the question form the database by id, with its answers
+    question = Question.query.options(
+        *questions_details_schema_options).get(id)
 
     # If a matching question is found, return it
     if question:
+        cache.tag(*post_cache_tags([question], question.answers))
         return jsonify(question_details_schema.dump(question))
     else:
         return {"error": "A question with that id was not found."}, 404
 
 
-@questions.post("/")
-@jwt_required()
-def post_question():
-    """ Post a new question """
-    # Get the question post fields
-    question_fields = question_post_schema.load(request.json, partial=True)
+# Fields that describe a new location instead of a location_id
+LOCATION_FIELDS = ["country_code", "state", "postcode", "suburb"]
 
+
+def check_question_fields(question_fields: dict, references) -> tuple:
+    """ Check the fields of a new question that don't need the database,
+    and return its category and None, or None and an error response """
     # Make sure the post has a location
     # Check for either a location_id or fields for a new location
     if ("location_id" not in question_fields.keys() and not all(
-            field in question_fields.keys()
-            for field in ["country_code", "state", "postcode", "suburb"])
-            ):
-        return {"error": "You must provide a location_id (integer) "
-                "OR a country_code (ISO 3166-1, alpha-2 format), "
-                "and the state, postcode, and suburb names as strings."}, 400
+            field in question_fields.keys() for field in LOCATION_FIELDS)):
+        return None, ({"error": "You must provide a location_id (integer) "
+                       "OR a country_code (ISO 3166-1, alpha-2 format), "
+                       "and the state, postcode, and suburb names as "
+                       "strings."}, 400)
 
     # If location_id is provided, don't accept other location fields
     if ("location_id" in question_fields.keys() and
-        any(field in ["country_code", "state", "postcode", "suburb"]
-            for field in question_fields.keys())):
-        return {"error": "When providing an existing location_id, "
-                "don't include any other location fields."}, 400
+            any(field in LOCATION_FIELDS for field in question_fields.keys())):
+        return None, ({"error": "When providing an existing location_id, "
+                       "don't include any other location fields."}, 400)
+
+    # Check that the country of a new location exists
+    if ("location_id" not in question_fields.keys()
+            and not references.country(question_fields["country_code"])):
+        return None, ({"error": "The country code "
+                       f"'{question_fields['country_code'].upper()}' "
+                       "could not be found. Check /countries for a "
+                       "list of valid country codes."}, 404)
+
+    # Make sure the post has an existing category_id or category_name
+    if (not any(field in ["category_id", "category_name"]
+                for field in question_fields.keys()) or
+            all(field in question_fields.keys()
+                for field in ["category_id", "category_name"])):
+        return None, ({"error": "You must provide a category_id "
+                       "OR category_name, but not both. Visit the "
+                       "/categories endpoint for a list of valid "
+                       "categories."}, 400)
+
+    # If searching by category_id, look up the category by id
+    if "category_id" in question_fields.keys():
+        category = references.category(
+            category_id=question_fields["category_id"])
+        if not category:
+            return None, ({"error": "The given category_id was not found. "
+                           "Visit the /categories endpoint for a list of "
+                           "valid categories"}, 404)
+
+    # If searching by category_name, look up the category by name
+    else:
+        category = references.category(
+            category_name=question_fields["category_name"])
+        if not category:
+            return None, ({"error": "The given category_name was not found. "
+                           "Visit the /categories endpoint for a list of "
+                           "valid categories"}, 404)
+
+    # Make sure the post has a question body
+    if "question" not in question_fields.keys():
+        return None, ({"error": "The new question must have a question "
+                       "field."}, 400)
+    # Question body must be at least 20 characters long
+    if len(question_fields["question"]) < 20:
+        return None, ({"error": "Your question must be at "
+                       "least 20 characters."}, 400)
+    return category, None
+
+
+def new_location_fields(question_fields: dict) -> dict:
+    """ Return the location fields of a question in the form they're
+    stored in """
+    return {
+        "country_code": question_fields["country_code"].upper(),
+        "state": question_fields["state"].title(),
+        "postcode": question_fields["postcode"].title(),
+        "suburb": question_fields["suburb"].title()
+    }
+
+
+@questions.post("/")
+@jwt_required()
+def post_question():
+    """ Post a new question """
+    # Get the question post fields
+    question_fields = question_post_schema.load(request.json, partial=True)
+    # Categories and countries are validated without querying the database
+    references = reference_data.get()
+    category, error = check_question_fields(question_fields, references)
+    if error:
+        return error
 
     # Set the location to provided location_id or add a new location
+    new_location = None
     if "location_id" in question_fields.keys():
         # Check if location_id is in database
         if Location.query.get(question_fields["location_id"]):
-            found_location = True
-            found_location_id = question_fields["location_id"]
+            location_id = question_fields["location_id"]
         else:
             return record_not_found("location")
 
-    # Construct a new Location instance
+    # Find or add the location from the given fields
     else:
-        # Check that the country exists
-        if not Country.query.get(question_fields["country_code"].upper()):
-            return {"error": "The country code "
-                    f"'{question_fields['country_code'].upper()}' "
-                    "could not be found. Check /countries for a "
-                    "list of valid country codes."}, 404
-
-        new_location = Location(
-            country_code=question_fields["country_code"].upper(),
-            state=question_fields["state"].title(),
-            postcode=question_fields["postcode"].title(),
-            suburb=question_fields["suburb"].title()
-        )
-
-        # Prevent duplicate locations
-        # Check if the provided location fields match an existing location
-        found_location = duplicate_exists(
-            new_location, Location, ["location_id"])
-        # Add the new location if it doesn't exist (outside AU)
-        if not found_location:
-            if question_fields["country_code"].upper() != "AU":
-                db.session.add(new_location)
-                db.session.commit()
-                new_location_id = new_location.location_id
-            else:
-                return record_not_found("location")
+        location_fields = new_location_fields(question_fields)
 
-        # Assign the found location_id to the new question
-        else:
-            found_location_id = found_location.location_id
+        # Locations in AU must match an existing location
+        if location_fields["country_code"] == "AU":
+            location_id = db.session.scalar(select(
+                Location.location_id).filter_by(**location_fields))
+            if not location_id:
+                return record_not_found("location")
 
-    # Make sure the post has an existing category_id or category_name
-    if (not any(field in ["category_id", "category_name"]
-                    for field in question_fields.keys()) or
-                all(field in question_fields.keys()
-                    for field in ["category_id", "category_name"])
-            ):
-        return {"error": "You must provide a category_id "
-                "OR category_name, but not both. Visit the /categories "
-                "endpoint for a list of valid categories."}, 400
-
-    # If searching by category_id, search by primary key
-    if "category_id" in question_fields.keys():
-        if Category.query.get(question_fields["category_id"]):
-            found_category_id = question_fields["category_id"]
-        else:
-            return {"error": "The given category_id was not found. "
-                    "Visit the /categories endpoint for a list of "
-                    "valid categories"}, 404
-
-    # If searching by category_name, filter by category_name
-    elif "category_name" in question_fields.keys():
-        category = Category.query.filter_by(
-            category_name=question_fields["category_name"].title()).first()
-        if category:
-            found_category_id = category.category_id
+        # Add locations elsewhere, or reuse the matching location, in one
+        # statement that relies on the locations unique constraint
         else:
-            return {"error": "The given category_name was not found. "
-                    "Visit the /categories endpoint for a list of "
-                    "valid categories"}, 404
-
-    # Make sure the post has a question body
-    if "question" not in question_fields.keys():
-        return {"error": "The new question must have a question field."}, 400
-    # Question body must be at least 20 characters long
-    if len(question_fields["question"]) < 20:
-        return {"error": "Your question must be at "
-                "least 20 characters."}, 400
+            location_id = insert_or_get_id(
+                Location, location_fields, list(location_fields))
+            new_location = LocationRecord(location_id, **location_fields)
 
     # Construct the question object from fields and add it to the database
     new_question = Question(
         user_id=get_logged_in_user(),
-        location_id=found_location_id if found_location else new_location_id,
-        category_id=found_category_id,
+        location_id=location_id,
+        category_id=category.category_id,
         date_time=current_datetime(),
         body=question_fields["question"]
     )
+    # Prevent duplicate questions, found by the indexed hash of their body
+    existing_question = Question.query.filter_by(
+        user_id=new_question.user_id,
+        location_id=new_question.location_id,
+        category_id=new_question.category_id,
+        content_hash=new_question.content_hash
+    ).first()
+    if existing_question:
+        return {"message": "You have already posted this question. "
+                "View it here: "
+                f"/questions/{existing_question.question_id}"}
     db.session.add(new_question)
     db.session.commit()
+    cache.invalidate(f"category:{new_question.category_id}")
+    # Suggest a location added by the question from now on
+    if new_location:
+        location_index.add(new_location)
 
-    # Add a snippet of the new question to the response
+    # Add a snippet of the new question and its country to the response
+    country = references.country(new_question.location.country_code)
     question_snippet = (new_question.body[0:30] if len(new_question.body) > 30
                         else new_question.body)
 
     # Return a success message with the path to the new question
     return {"success": f"Your question '{question_snippet}...' was posted under "
-            f"the {new_question.category.category_name} category for "
+            f"the {category.category_name} category for "
             f"{new_question.location.suburb} "
             f"({new_question.location.postcode}), "
             f"{new_question.location.state}, "
-            f"{new_question.location.country.country}. "
+            f"{country.country}. "
             f"View it at: /questions/{new_question.question_id}",
             "question_id": new_question.question_id}, 201
 
 
+def resolve_locations(location_ids: set, location_keys: set) -> tuple:
+    """ Return the given location_ids that exist, and the location_id of
+    each (country_code, state, postcode, suburb) key, adding the locations
+    outside Australia that don't exist yet, in a few statements """
+    existing_ids = set(db.session.scalars(select(Location.location_id).where(
+        Location.location_id.in_(location_ids)))) if location_ids else set()
+
+    def find_keys(keys) -> dict:
+        key_columns = [getattr(Location, field) for field in LOCATION_FIELDS]
+        return {tuple(row[:-1]): row[-1] for row in db.session.execute(
+            select(*key_columns, Location.location_id).where(
+                tuple_(*key_columns).in_(list(keys))))} if keys else {}
+
+    ids_by_key = find_keys(location_keys)
+    # Locations in AU must match an existing location, while locations
+    # elsewhere are added, or reused if another request just added them
+    new_keys = [key for key in location_keys
+                if key not in ids_by_key and key[0] != "AU"]
+    if new_keys:
+        db.session.execute(
+            dialect_insert(Location).on_conflict_do_nothing(
+                index_elements=LOCATION_FIELDS),
+            [dict(zip(LOCATION_FIELDS, key)) for key in new_keys])
+        ids_by_key.update(find_keys(new_keys))
+    return existing_ids, ids_by_key
+
+
+@questions.post("/batch")
+@jwt_required()
+def post_questions_batch():
+    """ Post a list of new questions at once. Each question is checked
+    like a single post, the locations and duplicates of them all are looked
+    up together, and the valid questions are added with one insert, in one
+    transaction. Returns a result for each question in the list. """
+    question_list = request.json
+    max_questions = app.config["QUESTION_BATCH_MAX"]
+    if not isinstance(question_list, list) or not question_list:
+        return {"error": "You must provide a list of questions, each with "
+                "the fields of a single question post."}, 400
+    if len(question_list) > max_questions:
+        return {"error": "You can post at most "
+                f"{max_questions} questions at once."}, 400
+    user_id = get_logged_in_user()
+    references = reference_data.get()
+    results = [None] * len(question_list)
+
+    # Check each question's fields without querying the database
+    checked = []
+    for index, question_item in enumerate(question_list):
+        try:
+            question_fields = question_post_schema.load(
+                question_item, partial=True)
+        except ValidationError as error:
+            results[index] = {"index": index, "status": 400,
+                              "error": error.messages}
+            continue
+        category, error = check_question_fields(question_fields, references)
+        if error:
+            results[index] = {"index": index, "status": error[1], **error[0]}
+            continue
+        checked.append((index, question_fields, category))
+
+    # Find (or add) every location with a few set-based queries
+    location_keys = {
+        index: tuple(new_location_fields(question_fields).values())
+        for index, question_fields, _ in checked
+        if "location_id" not in question_fields}
+    existing_ids, ids_by_key = resolve_locations(
+        {question_fields["location_id"] for _, question_fields, _ in checked
+         if "location_id" in question_fields},
+        set(location_keys.values()))
+
+    # Build the rows of the questions with locations
+    now = current_datetime()
+    rows = {}
+    for index, question_fields, category in checked:
+        if "location_id" in question_fields:
+            location_id = question_fields["location_id"]
+            if location_id not in existing_ids:
+                location_id = None
+        else:
+            location_id = ids_by_key.get(location_keys[index])
+        if location_id is None:
+            results[index] = {"index": index, "status": 404,
+                              **record_not_found("location")[0]}
+            continue
+        rows[index] = {
+            "user_id": user_id,
+            "location_id": location_id,
+            "category_id": category.category_id,
+            "date_time": now,
+            "body": question_fields["question"],
+            "content_hash": content_hash(question_fields["question"]),
+        }
+
+    # Prevent duplicate questions, whether posted before or earlier in the
+    # list, found by the indexed hash of their body
+    def duplicate_key(row: dict) -> tuple:
+        return row["location_id"], row["category_id"], row["content_hash"]
+    posted_ids = {
+        tuple(row[1:]): row[0] for row in db.session.execute(select(
+            Question.question_id, Question.location_id, Question.category_id,
+            Question.content_hash
+        ).where(Question.user_id == user_id, Question.content_hash.in_(
+            {row["content_hash"] for row in rows.values()})))} if rows else {}
+    first_indexes = {}
+    duplicates = {}
+    for index, row in list(rows.items()):
+        key = duplicate_key(row)
+        if key in posted_ids or key in first_indexes:
+            duplicates[index] = key
+            del rows[index]
+        else:
+            first_indexes[key] = index
+
+    # Add the new questions with one executemany, counting them towards the
+    # user's stats once, and commit everything together
+    if rows:
+        update_user_stats(
+            db.session.connection(), user_id, questions_count=len(rows))
+        for row, question_id in zip(
+                rows.values(), reserve_ids(Question, len(rows))):
+            row["question_id"] = question_id
+        db.session.execute(Question.__table__.insert(), list(rows.values()))
+    db.session.commit()
+    cache.invalidate(*{
+        f"category:{row['category_id']}" for row in rows.values()})
+    # Suggest the locations added by the questions from now on
+    location_index.add(*[
+        LocationRecord(location_id, *key)
+        for key, location_id in ids_by_key.items() if key[0] != "AU"])
+
+    for index, row in rows.items():
+        results[index] = {
+            "index": index, "status": 201,
+            "question_id": row["question_id"],
+            "url": f"/questions/{row['question_id']}"}
+    for index, key in duplicates.items():
+        question_id = posted_ids.get(key) or rows[first_indexes[key]][
+            "question_id"]
+        results[index] = {
+            "index": index, "status": 200,
+            "message": "You have already posted this question.",
+            "question_id": question_id,
+            "url": f"/questions/{question_id}"}
+
+    # Report the questions added, the duplicates and the failures, with
+    # 207 Multi-Status when only some of the questions could be posted
+    failed = sum(result["status"] >= 400 for result in results)
+    if failed == len(results):
+        status = 400
+    elif failed:
+        status = 207
+    else:
+        status = 201 if rows else 200
+    return {"created": len(rows), "duplicates": len(duplicates),
+            "failed": failed, "results": results}, status
+
+
 @questions.put("/<int:question_id>/edit")
 @jwt_required()
 def edit_question(question_id):
@@ -282,6 +583,7 @@ def edit_question(question_id):
                 question.body = question_fields["question"]
                 db.session.add(question)
                 db.session.commit()
+                cache.invalidate(f"question:{question_id}")
                 return {"success": "Your question was edited. View it here: "
                         f"/questions/{question_id}"}
         else:
@@ -301,8 +603,10 @@ def post_answer(question_id):
         return record_not_found("question")
 
     # If the answer is a reply to another answer, check if parent exists
+    parent = None
     if "parent_id" in answer_fields:
-        if not Answer.query.get(answer_fields["parent_id"]):
+        parent = Answer.query.get(answer_fields["parent_id"])
+        if not parent:
             return {"error": "The answer you are attempting to repy to "
                     "could not be found"}, 404
 
@@ -316,12 +620,19 @@ def post_answer(question_id):
         date_time=current_datetime(),
         body=answer_fields["answer"]
     )
-    # Prevent duplicate answers
-    existing_answer = duplicate_exists(
-        new_answer, Answer, ["answer_id", "date_time"])
+    # Prevent duplicate answers, found by the indexed hash of their body
+    existing_answer = Answer.query.filter_by(
+        user_id=new_answer.user_id,
+        question_id=new_answer.question_id,
+        parent_id=new_answer.parent_id,
+        content_hash=new_answer.content_hash
+    ).first()
     if not existing_answer:
         db.session.add(new_answer)
         db.session.commit()
+        # A reply also changes the reply tree of its parent answer
+        cache.invalidate(f"question:{new_answer.question_id}", *(
+            [f"question:{parent.question_id}"] if parent else []))
     else:
         return {"message": "This answer has already been "
                 "posted for this question. View it here: "
@@ -353,6 +664,7 @@ def delete_question(question_id):
         # Delete the question from the database
         db.session.delete(question)
         db.session.commit()
+        cache.invalidate(f"question:{question_id}")
         return {"success": f"Question {question.question_id} was deleted."}
     else:
         return unauthorised_editor("question")
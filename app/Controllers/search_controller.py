@@ -0,0 +1,87 @@
+from flask import Blueprint, request
+from marshmallow import ValidationError
+from app.search import search_posts
+from app.utils import (
+    get_page_limit, decode_cursor, encode_cursor,
+    next_page_url, show_page)
+
+
+search = Blueprint("search", __name__, url_prefix="/search")
+
+
+@search.get("/")
+def search_questions_and_answers():
+    """ Return the questions and answers best matching a search query,
+    optionally filtered by location and category """
+    filterable_attributes = [
+        "location_id",
+        "country_code",
+        "state",
+        "postcode",
+        "suburb",
+        "category_id",
+        "category_name",
+    ]
+
+    # Make sure there is something to search for
+    terms = request.args.get("q", "").strip()
+    if not terms:
+        return {"error": "You must provide search terms using the q "
+                "query string argument (e.g., /search?q=coffee)."}, 400
+
+    # Get the filters from the query string, ignoring search and page args
+    filter_list = request.args.to_dict()
+    for key in ["q", "limit", "cursor"]:
+        filter_list.pop(key, None)
+
+    # Check if supplied filter attributes can be used
+    for key, value in filter_list.items():
+        if key not in filterable_attributes:
+            return {"error": "You can only filter search results using "
+                    "the following attributes in your query string: "
+                    f"{filterable_attributes}."}, 400
+        # Convert inputs to match database keys
+        if key in ["location_id", "category_id"]:
+            if not value.isdigit():
+                return {"error": f"The {key} must be an integer."}, 400
+            filter_list[key] = int(value)
+        elif key == "country_code":
+            filter_list[key] = value.upper()
+        elif key in ["category_name", "state", "suburb"]:
+            filter_list[key] = value.title()
+
+    # Get a page of results, plus one to find out if there is a next page
+    limit = get_page_limit()
+    cursor = request.args.get("cursor")
+    offset = max(decode_cursor(cursor, int)[0], 0) if cursor else 0
+    results, approximate = search_posts(
+        terms, filter_list, limit + 1, offset)
+
+    if not results:
+        return {"message": "No matching questions or answers "
+                "were found."}, 404
+
+    next_page = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_page = next_page_url(limit, encode_cursor([offset + limit]))
+
+    page = show_page([{
+        "post_type": result.post_type,
+        "question_id": result.question_id,
+        "answer_id": (
+            result.post_id if result.post_type == "answer" else None),
+        "snippet": result.snippet,
+        "url": (f"/answers/{result.post_id}" if result.post_type == "answer"
+                else f"/questions/{result.post_id}")
+    } for result in results], next_page)
+    # Very common terms match more posts than are ranked, in which case
+    # only the newest matches are ranked
+    page["approximate"] = approximate
+    return page
+
+
+# Return any other validation errors that are raised
+@search.errorhandler(ValidationError)
+def register_validation_error(error):
+    return error.messages, 400
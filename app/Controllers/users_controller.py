@@ -1,15 +1,23 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required
 from marshmallow import ValidationError
-from app import db, bcrypt
+from sqlalchemy import select
+from app import db, cache, passwords
+from app.conditional import conditional
 from app.models.user import User
+from app.passwords import PasswordHasherBusy
 from app.models.question import Question
 from app.models.answer import Answer
+from app.models.recommendation import Recommendation
 from app.schemas.user_schema import (
     user_details_schema, user_private_schema, user_update_schema, users_schema)
-from app.schemas.question_schema import questions_schema, questions_details_schema
-from app.schemas.answer_schema import answers_schema
-from app.utils import get_logged_in_user
+from app.schemas.question_schema import (
+    questions_schema, questions_details_schema, questions_schema_options,
+    questions_details_schema_options)
+from app.schemas.answer_schema import answers_schema, answers_schema_options
+from app.utils import (
+    get_logged_in_user, paginate, show_page, wants_stream, stream_records,
+    get_id_list, show_records_by_id)
 
 
 users = Blueprint("users", __name__, url_prefix="/users")
@@ -42,14 +50,42 @@ def unauthorised_action():
 @users.get("/")
 @jwt_required()
 def get_users():
-    """ Return a list of all users """
+    """ Return a list of all users, or the users with the given ids """
+    # Get the users with the given ids, in order, with one query. Users
+    # see more of their own account, as with /users/<id>.
+    ids = get_id_list()
+    if ids is not None:
+        return show_records_by_id(
+            ids, User.query.filter(User.user_id.in_(ids)).all(),
+            User.user_id, lambda users_list: [
+                user_private_schema.dump(user)
+                if user.user_id == get_logged_in_user()
+                else user_details_schema.dump(user) for user in users_list])
+
     # Get a list of all users
     users_list = User.query.all()
     return jsonify(users_schema.dump(users_list))
 
 
+def user_version(id) -> tuple | None:
+    """ Return the ETag and last modified time of a user by user_id or
+    username, or None if the user isn't found. Users see more of their own
+    account, so it has a separate ETag. """
+    user_filter = (User.user_id == int(id) if id.isdigit()
+                   else User.username == id)
+    version = db.session.execute(
+        select(User.user_id, User.revision, User.updated_at).where(
+            user_filter)).first()
+    if not version:
+        return None
+    view = "private" if get_logged_in_user() == version.user_id else "public"
+    return (f"user-{version.user_id}-{version.revision}-{view}",
+            version.updated_at)
+
+
 @users.get("/<id>")
 @jwt_required()
+@conditional(user_version, private=True)
 def get_user(id):
     """ Return a specific user by user_id or username """
     user = find_user(id)
@@ -91,7 +127,7 @@ def update_user(id):
             if not password:
                 return ({"error": "You must enter your password "
                         "to modify account details."}), 403
-            if not bcrypt.check_password_hash(user.password, password):
+            if not passwords.check(user.password, password):
                 return {"error": "The password is incorrect."}, 401
 
             # Check if any account details have changed
@@ -100,7 +136,7 @@ def update_user(id):
                     if user_fields[field] != getattr(user, field):
                         changes = True
                 elif field == "new_password":
-                    if not bcrypt.check_password_hash(user.password, user_fields[field]):
+                    if not passwords.check(user.password, user_fields[field]):
                         changes = True
                 else:
                     pass
@@ -111,8 +147,8 @@ def update_user(id):
             for field in user_fields:
                 # Hash new password if password is being changed
                 if field == "new_password":
-                    user.password = (bcrypt.generate_password_hash(
-                        user_fields["new_password"]).decode("utf-8"))
+                    user.password = passwords.generate(
+                        user_fields["new_password"])
                 # Prevent changing password back to old password
                 if field == "password":
                     pass
@@ -122,6 +158,8 @@ def update_user(id):
 
             db.session.add(user)
             db.session.commit()
+            # Cached posts show the author's username
+            cache.invalidate(f"user:{user.user_id}")
 
             # Return success message and update details
             updated_user_fields = user_private_schema.dump(user)
@@ -150,8 +188,18 @@ def delete_user(id):
     if user:
         # Make sure user is editing their own account
         if get_logged_in_user() == user.user_id:
+            # Removing the user's recommendations changes the counts shown
+            # on other users' answers, as well as the user's own posts
+            voted_question_ids = db.session.scalars(
+                select(Answer.question_id).join(
+                    Answer.recommendations).filter(
+                        Recommendation.user_id == user.user_id).distinct()
+            ).all()
             db.session.delete(user)
             db.session.commit()
+            cache.invalidate(f"user:{user.user_id}", *(
+                f"question:{question_id}"
+                for question_id in voted_question_ids))
 
             return {"success": f"Your account {user.username} was removed."}
 
@@ -167,35 +215,47 @@ def get_user_questions(id, post_type):
     """ Return all questions posted by a given user """
     user = find_user(id)
 
-    if user:
-        # Get all the user's questions, answers, and recommendations
-        # from the database
-        questions_list = Question.query.filter_by(user_id=user.user_id).all()
-        answers_list = Answer.query.filter_by(user_id=user.user_id).all()
-        recommendations_list = Answer.query.join(
-            Answer.recommendations).filter_by(user_id=user.user_id).all()
-    else:
+    if not user:
         return user_not_found()
 
-    # Return all questions/answers posted by user
+    # Return a page of questions/answers posted by user
     # depending on post_type parameter
-    if post_type == "questions":
+    if post_type in ["questions", "q&a"]:
+        # The q&a listing also includes the answers to each question
+        if post_type == "questions":
+            schema, options = questions_schema, questions_schema_options
+        else:
+            schema, options = (
+                questions_details_schema, questions_details_schema_options)
+        questions_query = Question.query.filter_by(
+            user_id=user.user_id).options(*options)
+        if wants_stream():
+            return stream_records(questions_query, Question.date_time,
+                                  Question.question_id, schema)
+        questions_list, next_page = paginate(
+            questions_query, Question.date_time, Question.question_id)
         if questions_list:
-            return questions_schema.dump(questions_list)
+            return show_page(schema.dump(questions_list), next_page)
         return {"message": f"{user.username} has not posted any "
                 "questions yet."}
-    elif post_type == "answers":
+    elif post_type in ["answers", "recommendations"]:
+        # Recommendations are the answers the user has voted for
+        if post_type == "answers":
+            answers_query = Answer.query.filter_by(user_id=user.user_id)
+        else:
+            answers_query = Answer.query.join(
+                Answer.recommendations).filter_by(user_id=user.user_id)
+        answers_query = answers_query.options(*answers_schema_options)
+        if wants_stream():
+            return stream_records(answers_query, Answer.date_time,
+                                  Answer.answer_id, answers_schema)
+        answers_list, next_page = paginate(
+            answers_query, Answer.date_time, Answer.answer_id)
         if answers_list:
-            return answers_schema.dump(answers_list)
-        return {"message": f"{user.username} has not posted any answers yet."}
-    elif post_type == "q&a":
-        if questions_list:
-            return questions_details_schema.dump(questions_list)
-        return {"message": f"{user.username} has not posted any "
-                "questions yet."}
-    elif post_type == "recommendations":
-        if recommendations_list:
-            return answers_schema.dump(recommendations_list)
+            return show_page(answers_schema.dump(answers_list), next_page)
+        if post_type == "answers":
+            return {"message": f"{user.username} has not posted any "
+                    "answers yet."}
         return {"message": f"{user.username} has not given any "
                 "recommendations yet."}
     else:
@@ -211,3 +271,10 @@ def get_user_questions(id, post_type):
 @users.errorhandler(ValidationError)
 def register_validation_error(error):
     return error.messages, 400
+
+
+# Turn requests away while the password hashing queue is full
+@users.errorhandler(PasswordHasherBusy)
+def register_password_hasher_busy(error):
+    return ({"error": "The server is busy. Please try again shortly."},
+            503, {"Retry-After": "1"})
@@ -1,8 +1,30 @@
+from sqlalchemy import case, event, func, inspect, select
+from sqlalchemy.orm import column_property, object_session
 from app import db
+from app.models.question import Question, touch_questions
+from app.models.recommendation import Recommendation
+from app.models.user import User, update_user_stats
+from app.models.vote_event import VoteEvent
+from app.utils import content_hash
+
+
+# A vote event followed by a later one for the same user and answer
+later_vote = VoteEvent.__table__.alias("later_vote")
 
 
 class Answer(db.Model):
     __tablename__ = "answers"
+    __table_args__ = (
+        # Keyset pagination orders and seeks on (date_time, answer_id)
+        db.Index("ix_answers_date_time_answer_id", "date_time", "answer_id"),
+        db.Index("ix_answers_user_id_date_time",
+                 "user_id", "date_time", "answer_id"),
+        # Answers are looked up by question, and replies by parent
+        db.Index("ix_answers_question_id", "question_id"),
+        db.Index("ix_answers_parent_id", "parent_id"),
+        # Duplicate answers are found by the hash of their content
+        db.Index("ix_answers_content_hash", "content_hash"),
+    )
 
     answer_id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey(
@@ -14,6 +36,29 @@ class Answer(db.Model):
     date_time = db.Column(db.DateTime, nullable=False)
     # time = can be derived from DateTime value of date?
     body = db.Column(db.Text, nullable=False)
+    # Hash of the normalised body, updated whenever the body is set
+    content_hash = db.Column(db.String(64))
+    # Number of recommendations, counted by the database on load, with
+    # the votes waiting in vote_events merged in. Only the (small) events
+    # table is searched for corrections: the last pending vote of each user
+    # adds one if it's a recommendation and takes away the user's current
+    # recommendation, if any.
+    recommendation_count = column_property(
+        select(func.count(Recommendation.vote_id)).where(
+            Recommendation.answer_id == answer_id
+        ).correlate_except(Recommendation).scalar_subquery()
+        + select(func.coalesce(func.sum(
+            case((VoteEvent.voted, 1), else_=0)
+            - case((select(Recommendation.vote_id).where(
+                Recommendation.answer_id == VoteEvent.answer_id,
+                Recommendation.user_id == VoteEvent.user_id
+            ).exists(), 1), else_=0)), 0)).where(
+            VoteEvent.answer_id == answer_id,
+            ~select(later_vote.c.event_id).where(
+                later_vote.c.answer_id == VoteEvent.answer_id,
+                later_vote.c.user_id == VoteEvent.user_id,
+                later_vote.c.event_id > VoteEvent.event_id).exists()
+        ).correlate_except(VoteEvent).scalar_subquery())
 
     # Relationships
     replies = db.relationship(
@@ -22,3 +67,65 @@ class Answer(db.Model):
         "Recommendation", backref="answer", cascade="all, delete")
     author = db.relationship("User", back_populates="answers")
     question = db.relationship("Question", back_populates="answers")
+
+
+@event.listens_for(Answer.body, "set")
+def hash_answer_body(target, value, oldvalue, initiator):
+    target.content_hash = content_hash(value)
+
+
+@event.listens_for(Answer, "after_insert")
+def count_new_answer(mapper, connection, target):
+    update_user_stats(connection, target.user_id, answers_count=1)
+
+
+@event.listens_for(Answer, "after_delete")
+def count_deleted_answer(mapper, connection, target):
+    update_user_stats(connection, target.user_id, answers_count=-1)
+
+
+def touch_answer_questions(connection, answer) -> None:
+    """ Bump the revision of the question an answer was posted to, and of
+    the question of the answer it replies to, whose reply tree shows it """
+    touch_questions(connection, [answer.question_id])
+    if answer.parent_id is not None:
+        touch_questions(connection, select(Answer.question_id).where(
+            Answer.answer_id == answer.parent_id,
+            Answer.question_id != answer.question_id))
+
+
+@event.listens_for(Answer, "after_insert")
+def touch_new_answer_questions(mapper, connection, target):
+    touch_answer_questions(connection, target)
+
+
+@event.listens_for(Answer, "after_delete")
+def touch_deleted_answer_questions(mapper, connection, target):
+    touch_answer_questions(connection, target)
+
+
+@event.listens_for(Answer, "before_update")
+def touch_edited_answer_questions(mapper, connection, target):
+    if object_session(target).is_modified(
+            target, include_collections=False):
+        touch_answer_questions(connection, target)
+
+
+# Listeners for the other tables shown with answers are registered here,
+# where all of the models they touch can be imported
+
+@event.listens_for(Recommendation, "after_insert")
+@event.listens_for(Recommendation, "after_delete")
+def touch_voted_question(mapper, connection, target):
+    touch_questions(connection, select(Answer.question_id).where(
+        Answer.answer_id == target.answer_id))
+
+
+@event.listens_for(User, "before_update")
+def touch_authored_questions(mapper, connection, target):
+    # Posts show their author's username
+    if inspect(target).attrs.username.history.has_changes():
+        touch_questions(connection, select(Question.question_id).where(
+            Question.user_id == target.user_id
+        ).union(select(Answer.question_id).where(
+            Answer.user_id == target.user_id)))
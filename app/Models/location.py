@@ -3,6 +3,19 @@ from app import db
 
 class Location(db.Model):
     __tablename__ = "locations"
+    __table_args__ = (
+        # Each location is stored once; its unique index also serves
+        # questions filtered by any of the location fields
+        db.UniqueConstraint(
+            "country_code", "state", "postcode", "suburb",
+            name="uq_locations_country_code_state_postcode_suburb"),
+        db.Index("ix_locations_state", "state"),
+        db.Index("ix_locations_postcode", "postcode"),
+        db.Index("ix_locations_suburb", "suburb"),
+        # Nearby questions read the locations in the grid cells around a
+        # point (see app/geo.py)
+        db.Index("ix_locations_grid_cell", "grid_cell"),
+    )
 
     location_id = db.Column(db.Integer, primary_key=True)
     country_code = db.Column(db.String(2), db.ForeignKey(
@@ -10,6 +23,10 @@ class Location(db.Model):
     state = db.Column(db.String(), nullable=False)
     postcode = db.Column(db.String(), nullable=False)
     suburb = db.Column(db.String(), nullable=False)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    # Number of the latitude/longitude grid cell the location is in
+    grid_cell = db.Column(db.Integer)
 
     # Relationships
     country = db.relationship("Country", back_populates="locations")
@@ -1,8 +1,26 @@
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
 from app import db
+from app.models.user import update_user_stats
+from app.utils import content_hash, current_datetime
 
 
 class Question(db.Model):
     __tablename__ = "questions"
+    __table_args__ = (
+        # Keyset pagination orders and seeks on (date_time, question_id)
+        db.Index("ix_questions_date_time_question_id",
+                 "date_time", "question_id"),
+        # Filtered lists seek on a foreign key, then page in the same order
+        db.Index("ix_questions_user_id_date_time",
+                 "user_id", "date_time", "question_id"),
+        db.Index("ix_questions_category_id_date_time",
+                 "category_id", "date_time", "question_id"),
+        db.Index("ix_questions_location_id_date_time",
+                 "location_id", "date_time", "question_id"),
+        # Duplicate questions are found by the hash of their content
+        db.Index("ix_questions_content_hash", "content_hash"),
+    )
 
     question_id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.user_id"),
@@ -14,6 +32,13 @@ class Question(db.Model):
     date_time = db.Column(db.DateTime, nullable=False)
     # time = can be derived from DateTime value of date?
     body = db.Column(db.Text, nullable=False)
+    # Hash of the normalised body, updated whenever the body is set
+    content_hash = db.Column(db.String(64))
+    # Version stamp for conditional GETs, bumped whenever the question, its
+    # answers, their votes or their authors' usernames change
+    revision = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0")
+    updated_at = db.Column(db.DateTime, default=current_datetime)
 
     # Relationships
     author = db.relationship("User", back_populates="questions")
@@ -21,3 +46,39 @@ class Question(db.Model):
         "Answer", back_populates="question", cascade="all, delete")
     category = db.relationship("Category", back_populates="questions")
     location = db.relationship("Location", back_populates="questions")
+
+
+@event.listens_for(Question.body, "set")
+def hash_question_body(target, value, oldvalue, initiator):
+    target.content_hash = content_hash(value)
+
+
+@event.listens_for(Question, "after_insert")
+def count_new_question(mapper, connection, target):
+    update_user_stats(connection, target.user_id, questions_count=1)
+
+
+@event.listens_for(Question, "after_delete")
+def count_deleted_question(mapper, connection, target):
+    update_user_stats(connection, target.user_id, questions_count=-1)
+
+
+@event.listens_for(Question, "before_update")
+def bump_question_revision(mapper, connection, target):
+    if object_session(target).is_modified(
+            target, include_collections=False):
+        target.revision = Question.revision + 1
+        target.updated_at = current_datetime()
+
+
+def touch_questions(connection, question_ids) -> None:
+    """ Bump the revision of the given questions (a list or select of
+    question ids), using the connection of the flush so it happens in the
+    same transaction """
+    questions_table = Question.__table__
+    connection.execute(
+        questions_table.update().where(
+            questions_table.c.question_id.in_(question_ids)
+        ).values(
+            revision=questions_table.c.revision + 1,
+            updated_at=current_datetime()))
@@ -1,8 +1,18 @@
+from sqlalchemy import event
 from app import db
+from app.models.user import update_user_stats
 
 
 class Recommendation(db.Model):
     __tablename__ = "recommendations"
+    __table_args__ = (
+        # Users can recommend each answer once. Votes are looked up by
+        # (answer_id, user_id), counted by answer and listed by user.
+        db.UniqueConstraint(
+            "answer_id", "user_id",
+            name="uq_recommendations_answer_id_user_id"),
+        db.Index("ix_recommendations_user_id", "user_id"),
+    )
 
     vote_id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey(
@@ -12,3 +22,13 @@ class Recommendation(db.Model):
 
     # Relationships
     user = db.relationship("User", back_populates="recommendations")
+
+
+@event.listens_for(Recommendation, "after_insert")
+def count_new_vote(mapper, connection, target):
+    update_user_stats(connection, target.user_id, votes_count=1)
+
+
+@event.listens_for(Recommendation, "after_delete")
+def count_deleted_vote(mapper, connection, target):
+    update_user_stats(connection, target.user_id, votes_count=-1)
@@ -0,0 +1,10 @@
+from app import db
+
+
+class ReferenceVersion(db.Model):
+    """ A version token for reference data cached by each worker, changed
+    whenever that data is reloaded into the database """
+    __tablename__ = "reference_versions"
+
+    name = db.Column(db.String(), primary_key=True)
+    version = db.Column(db.String(), nullable=False)
@@ -1,3 +1,6 @@
+from datetime import datetime, timezone
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
 from app import db
 
 
@@ -8,6 +11,19 @@ class User(db.Model):
     username = db.Column(db.String(), nullable=False, unique=True)
     email = db.Column(db.String(), nullable=False, unique=True)
     password = db.Column(db.String(), nullable=False)
+    # Stat counters, kept up to date as posts and votes are added or removed
+    questions_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0")
+    answers_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0")
+    votes_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0")
+    # Version stamp for conditional GETs, bumped whenever the account
+    # details or stat counters change
+    revision = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0")
+    updated_at = db.Column(
+        db.DateTime, default=lambda: datetime.now(timezone.utc))
 
     # Relationships
     questions = db.relationship(
@@ -16,3 +32,28 @@ class User(db.Model):
         "Answer", back_populates="author", cascade="all, delete")
     recommendations = db.relationship(
         "Recommendation", back_populates="user", cascade="all, delete")
+
+
+def update_user_stats(connection, user_id: int, **changes) -> None:
+    """ Add the given amounts to a user's stat counters and bump their
+    revision, using the connection of the flush so it happens in the same
+    transaction """
+    users_table = User.__table__
+    connection.execute(
+        users_table.update().where(
+            users_table.c.user_id == user_id
+        ).values({
+            counter: users_table.c[counter] + amount
+            for counter, amount in changes.items()
+        } | {
+            "revision": users_table.c.revision + 1,
+            "updated_at": datetime.now(timezone.utc),
+        }))
+
+
+@event.listens_for(User, "before_update")
+def bump_user_revision(mapper, connection, target):
+    if object_session(target).is_modified(
+            target, include_collections=False):
+        target.revision = User.revision + 1
+        target.updated_at = datetime.now(timezone.utc)
@@ -0,0 +1,35 @@
+from sqlalchemy import func, select
+from app import db
+
+
+class VoteEvent(db.Model):
+    """ A recommendation or its removal recorded by the write-behind vote
+    path, waiting to be applied to the recommendations table by the next
+    batch (see app/votes.py). Rows are only ever inserted and deleted. """
+    __tablename__ = "vote_events"
+    __table_args__ = (
+        # Pending votes are merged into answer counts by (answer_id,
+        # user_id), and into question versions by question_id
+        db.Index("ix_vote_events_answer_id_user_id_event_id",
+                 "answer_id", "user_id", "event_id"),
+        db.Index("ix_vote_events_question_id_event_id",
+                 "question_id", "event_id"),
+    )
+
+    # Events are applied in event_id order, the last one for a user and
+    # answer deciding whether the user recommends it
+    event_id = db.Column(db.Integer, primary_key=True)
+    answer_id = db.Column(db.Integer, nullable=False)
+    question_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    # True for a recommendation, False for removing one
+    voted = db.Column(db.Boolean, nullable=False)
+
+
+def pending_votes(question_id):
+    """ Return a column of the id of the last vote event waiting to be
+    applied to a question's answers (or NULL), which question and answer
+    versions include so each pending vote changes their ETags """
+    return select(func.max(VoteEvent.event_id)).where(
+        VoteEvent.question_id == question_id
+    ).scalar_subquery().label("pending_votes")
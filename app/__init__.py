@@ -1,20 +1,34 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_marshmallow import Marshmallow
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
+from app.cache import ResponseCache
+from app.database import ReplicaRouter, RoutingSQLAlchemy
+from app.instrumentation import RequestInstrumentation
+from app.json_provider import FastJSONProvider
+from app.metrics import RequestMetrics
+from app.passwords import PasswordHasher
+from app.votes import VoteAggregator
 
 # Instantiate extensions used by the app
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 ma = Marshmallow()
 bcrypt = Bcrypt()
 jwt = JWTManager()
+cache = ResponseCache()
+passwords = PasswordHasher(bcrypt)
+instrumentation = RequestInstrumentation()
+metrics = RequestMetrics()
+replicas = ReplicaRouter()
+votes = VoteAggregator()
 
 
 def create_app():
     """ Create the Flask application object """
     # Create a Flask app object and pass it this package
     app = Flask(__name__)
+    # Encode JSON responses with orjson where its output is the same
+    app.json = FastJSONProvider(app)
 
     # Set the default configuration settings as defined in config.py
     app.config.from_object("config.app_config")
@@ -24,10 +38,19 @@ def create_app():
     ma.init_app(app)
     bcrypt.init_app(app)
     jwt.init_app(app)
+    cache.init_app(app)
+    passwords.init_app(app)
+    instrumentation.init_app(app)
+    metrics.init_app(app)
+    replicas.init_app(app)
+    votes.init_app(app)
 
     # Register CLI commands for database
     from app.commands import db_commands
     app.register_blueprint(db_commands)
+    # Register CLI commands for benchmarking
+    from app.benchmark import bench_commands
+    app.register_blueprint(bench_commands)
 
     # Import controllers
     from app.controllers import registerable_controllers
@@ -0,0 +1,3 @@
+from app.benchmark.common import bench_commands
+# Importing the module of each command registers it with bench_commands
+from app.benchmark import compare, generate, run, votes
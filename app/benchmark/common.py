@@ -0,0 +1,34 @@
+from flask import Blueprint
+from sqlalchemy import func, select
+from app import db
+
+
+# Instantiate a blueprint for CLI benchmark commands
+bench_commands = Blueprint("bench", __name__)
+
+# Generated users are named bench_<user_id> and share this password
+BENCH_USERNAME_PREFIX = "bench_"
+BENCH_PASSWORD = "benchmark"
+# Words generated post bodies are made of
+WORDS = (
+    "where", "what", "best", "good", "cheap", "closest", "open", "late",
+    "hotel", "hostel", "apartment", "rent", "room", "house", "coffee",
+    "cafe", "bakery", "restaurant", "bar", "pub", "market", "grocery",
+    "supermarket", "shop", "mall", "train", "bus", "tram", "ferry", "taxi",
+    "parking", "bike", "airport", "station", "bank", "atm", "doctor",
+    "dentist", "pharmacy", "hospital", "gym", "park", "beach", "museum",
+    "library", "cinema", "theatre", "stadium", "plumber", "electrician",
+    "mechanic", "laundromat", "post", "office", "school", "weekend",
+    "night", "morning", "family", "friends", "visiting", "moving", "local",
+    "suburb", "city", "recommend", "anyone", "know", "near", "around")
+
+
+def post_body(rng, prefix: str) -> str:
+    """ Return a random post body that's long enough to be valid """
+    words = " ".join(rng.choices(WORDS, k=rng.randint(6, 30)))
+    return f"{prefix} {words}?"
+
+
+def next_id(id_column) -> int:
+    """ Return the id after the largest id in a table """
+    return db.session.scalar(select(func.coalesce(func.max(id_column), 0))) + 1
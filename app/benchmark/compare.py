@@ -0,0 +1,50 @@
+import json
+import click
+from app.benchmark.common import bench_commands
+
+
+@bench_commands.cli.command("compare")
+@click.argument("baseline", type=click.File(encoding="utf-8"))
+@click.argument("results", type=click.File(encoding="utf-8"))
+@click.option("--threshold", default=10.0, show_default=True,
+              help="Percent p95 latency increase reported as a regression.")
+def compare_benchmarks(baseline, results, threshold):
+    """ Compare two benchmark result files endpoint by endpoint, and exit
+    with status 1 if any endpoint got slower than the threshold or made
+    more queries """
+    baseline, results = json.load(baseline), json.load(results)
+    for label, run in [("Baseline", baseline), ("Results", results)]:
+        meta = run["meta"]
+        print(f"{label}: {meta['commit']} {meta['database']} "
+              f"{meta['rows']} ({meta['created_at']})")
+
+    regressions = 0
+    for name, result in results["endpoints"].items():
+        base = baseline["endpoints"].get(name)
+        if base is None:
+            print(f"{name:22} new endpoint")
+            continue
+        changes = []
+        regressed = False
+        for percent in ["p50", "p95"]:
+            before = base["latency_ms"][percent]
+            after = result["latency_ms"][percent]
+            change = (after - before) / before * 100 if before else 0
+            changes.append(
+                f"{percent} {before:8.2f} -> {after:8.2f}ms ({change:+6.1f}%)")
+            if percent == "p95" and change > threshold:
+                regressed = True
+        before = base["queries_per_request"]["mean"]
+        after = result["queries_per_request"]["mean"]
+        changes.append(f"queries {before:6.1f} -> {after:6.1f}")
+        if after > before:
+            regressed = True
+        changes.append(f"memory {base['peak_memory_kb']:9.1f} -> "
+                       f"{result['peak_memory_kb']:9.1f} KB")
+        regressions += regressed
+        print(f"{name:22} " + "  ".join(changes)
+              + ("  REGRESSED" if regressed else ""))
+
+    print(f"Benchmark: {regressions} endpoints regressed")
+    if regressions:
+        raise SystemExit(1)
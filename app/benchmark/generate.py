@@ -0,0 +1,165 @@
+from datetime import datetime, timedelta, timezone
+import random
+import time
+import click
+from sqlalchemy import select, update
+from app import db, passwords
+from app.benchmark.common import (
+    BENCH_PASSWORD, BENCH_USERNAME_PREFIX, bench_commands, next_id, post_body)
+from app.commands import user_stat_counts
+from app.models.answer import Answer
+from app.models.category import Category
+from app.models.location import Location
+from app.models.question import Question
+from app.models.recommendation import Recommendation
+from app.models.user import User
+from app.utils import content_hash
+
+# Rows inserted per executemany when generating data
+GENERATE_BATCH_SIZE = 5000
+
+
+def parse_scale(scale: str) -> int:
+    """ Return the number of questions given as e.g. 10k, 100k or 1m """
+    multipliers = {"k": 1000, "m": 1000000}
+    scale = scale.strip().lower()
+    try:
+        if scale[-1:] in multipliers:
+            return int(float(scale[:-1]) * multipliers[scale[-1]])
+        return int(scale)
+    except ValueError:
+        raise click.BadParameter(
+            f"'{scale}' isn't a number of questions like 10k, 100k or 1m.")
+
+
+class BatchInserter:
+    """ Insert generated rows into several tables with one executemany per
+    batch, always flushing the tables in the order they were given, so rows
+    are inserted after the rows they reference """
+
+    def __init__(self, *models):
+        self.rows = {model.__table__: [] for model in models}
+        self.counts = {model.__table__.name: 0 for model in models}
+
+    def add(self, model, row: dict) -> None:
+        rows = self.rows[model.__table__]
+        rows.append(row)
+        if len(rows) >= GENERATE_BATCH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        for table, rows in self.rows.items():
+            if rows:
+                db.session.execute(table.insert(), rows)
+                self.counts[table.name] += len(rows)
+                rows.clear()
+        db.session.commit()
+
+
+@bench_commands.cli.command("generate")
+@click.option("--scale", default="10k", show_default=True,
+              help="Number of questions, e.g. 10k, 100k or 1m.")
+@click.option("--users", "user_count", type=int,
+              help="Number of users.  [default: questions / 20]")
+@click.option("--answers-per-question", default=3.0, show_default=True)
+@click.option("--reply-ratio", default=0.5, show_default=True,
+              help="Share of answers that reply to another answer.")
+@click.option("--votes-per-answer", default=2.0, show_default=True)
+@click.option("--seed", default=0, show_default=True,
+              help="Random seed, so runs generate the same data.")
+def generate_data(scale, user_count, answers_per_question, reply_ratio,
+                  votes_per_answer, seed):
+    """ Add synthetic users, questions, answer trees and votes to a created
+    and seeded database, for benchmarking """
+    rng = random.Random(seed)
+    question_count = parse_scale(scale)
+    user_count = user_count or max(10, question_count // 20)
+
+    # Posts are made in the seeded locations and categories
+    location_ids = db.session.scalars(select(Location.location_id)).all()
+    category_ids = db.session.scalars(select(Category.category_id)).all()
+    if not location_ids or not category_ids:
+        raise click.ClickException(
+            "Run flask db create and flask db seed first.")
+    start = time.perf_counter()
+
+    # Add users, all with the same password hash
+    password = passwords.generate(BENCH_PASSWORD)
+    first_user_id = next_id(User.user_id)
+    user_ids = range(first_user_id, first_user_id + user_count)
+    inserter = BatchInserter(User)
+    for user_id in user_ids:
+        inserter.add(User, {
+            "user_id": user_id,
+            "username": f"{BENCH_USERNAME_PREFIX}{user_id}",
+            "email": f"{BENCH_USERNAME_PREFIX}{user_id}@example.com",
+            "password": password,
+        })
+    inserter.flush()
+
+    # Spread the questions over the past year, oldest first, each with a
+    # random number of answers that reply to earlier answers in the thread
+    inserter = BatchInserter(Question, Answer, Recommendation)
+    question_id = next_id(Question.question_id)
+    answer_id = next_id(Answer.answer_id)
+    first_date = datetime.now(timezone.utc) - timedelta(days=365)
+    interval = timedelta(days=365) / question_count
+    for number in range(question_count):
+        date_time = first_date + interval * number
+        body = post_body(rng, f"Question {question_id}:")
+        inserter.add(Question, {
+            "question_id": question_id,
+            "user_id": rng.choice(user_ids),
+            "location_id": rng.choice(location_ids),
+            "category_id": rng.choice(category_ids),
+            "date_time": date_time,
+            "body": body,
+            "content_hash": content_hash(body),
+            "updated_at": date_time,
+        })
+
+        thread = []
+        for reply in range(round(rng.uniform(0, 2 * answers_per_question))):
+            body = post_body(rng, f"Answer {answer_id}:")
+            inserter.add(Answer, {
+                "answer_id": answer_id,
+                "user_id": rng.choice(user_ids),
+                "question_id": question_id,
+                "parent_id": (rng.choice(thread) if thread
+                              and rng.random() < reply_ratio else None),
+                "date_time": date_time + timedelta(minutes=reply + 1),
+                "body": body,
+                "content_hash": content_hash(body),
+            })
+            # Each voter recommends an answer at most once
+            vote_count = min(
+                round(rng.uniform(0, 2 * votes_per_answer)), user_count)
+            for user_id in rng.sample(user_ids, vote_count):
+                inserter.add(Recommendation, {
+                    "answer_id": answer_id, "user_id": user_id})
+            thread.append(answer_id)
+            answer_id += 1
+        question_id += 1
+    inserter.flush()
+
+    # Move PostgreSQL id sequences past the ids given explicitly
+    if db.engine.dialect.name == "postgresql":
+        for model in [User, Question, Answer]:
+            table = model.__table__
+            (id_column,) = table.primary_key.columns
+            db.session.execute(db.text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', "
+                f"'{id_column.name}'), (SELECT max({id_column.name}) "
+                f"FROM {table.name}))"))
+
+    # Count the new users' posts and votes, and refresh planner statistics
+    db.session.execute(update(User).where(
+        User.user_id >= first_user_id).values(user_stat_counts()))
+    db.session.commit()
+    db.session.execute(db.text("ANALYZE"))
+    db.session.commit()
+
+    counts = {"users": user_count, **inserter.counts}
+    print("Database: Generated " + ", ".join(
+        f"{count} {table}" for table, count in counts.items())
+        + f" ({time.perf_counter() - start:.1f}s)")
@@ -0,0 +1,366 @@
+from datetime import datetime, timezone
+import json
+import random
+import subprocess
+import time
+import tracemalloc
+from urllib.parse import quote
+import click
+from flask import current_app as app
+from sqlalchemy import event, func, select
+from app import db, cache
+from app.benchmark.common import (
+    BENCH_PASSWORD, BENCH_USERNAME_PREFIX, WORDS, bench_commands, next_id,
+    post_body)
+from app.models.answer import Answer
+from app.models.category import Category
+from app.models.location import Location
+from app.models.question import Question
+from app.models.recommendation import Recommendation
+from app.models.user import User
+
+# Number of records of each kind sampled to pick request paths from
+SAMPLE_SIZE = 1000
+# Questions sent in each request to /questions/batch
+BENCH_BATCH_SIZE = 100
+# Ids asked for in each request to get records by id
+BENCH_MULTI_GET_IDS = 20
+# Latency percentiles reported for each endpoint
+PERCENTILES = [50, 90, 95, 99]
+
+
+def percentile(sorted_values: list, percent: int) -> float:
+    """ Return the nearest-rank percentile of a sorted list """
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+    return sorted_values[rank - 1]
+
+
+class BenchmarkRun:
+    """ Drive every endpoint through the Flask test client with request
+    paths picked from the database, recording latency, queries per request
+    and peak memory """
+
+    def __init__(self, request_count: int, auth_request_count: int,
+                 streams: bool, seed: int):
+        self.request_count = request_count
+        self.auth_request_count = auth_request_count
+        self.streams = streams
+        self.rng = random.Random(seed)
+        self.client = app.test_client()
+        # A token distinguishes the posts and accounts made by this run
+        self.token = f"{int(time.time())}"
+        self.query_count = 0
+
+        # Sample existing records to request
+        def sample(column, *conditions):
+            return db.session.scalars(select(column).where(
+                *conditions).order_by(func.random()).limit(SAMPLE_SIZE)).all()
+        self.question_ids = sample(Question.question_id)
+        self.answer_ids = sample(Answer.answer_id)
+        self.usernames = sample(User.username)
+        self.user_ids = sample(User.user_id)
+        self.category_names = sample(Category.category_name)
+        self.category_ids = sample(Category.category_id)
+        self.location_ids = sample(Location.location_id)
+        self.suburbs = sample(Location.suburb)
+        self.points = db.session.execute(select(
+            Location.latitude, Location.longitude).where(
+            Location.latitude.isnot(None)).order_by(func.random()).limit(
+            SAMPLE_SIZE)).all()
+        if not (self.question_ids and self.answer_ids):
+            raise click.ClickException(
+                "There are no posts to benchmark. Run flask bench generate "
+                "first.")
+
+        # Log in as a generated user to make authenticated requests
+        self.user = db.session.scalars(select(User).where(
+            User.username.startswith(BENCH_USERNAME_PREFIX)
+        ).order_by(User.user_id)).first()
+        if not self.user:
+            raise click.ClickException(
+                "There are no benchmark users. Run flask bench generate "
+                "first.")
+        response = self.client.post("/auth/login", json={
+            "username": self.user.username, "password": BENCH_PASSWORD})
+        self.headers = {
+            "Authorization": f"Bearer {response.json['token']}"}
+        # Posts made by this run, to edit and delete
+        self.first_question_id = next_id(Question.question_id)
+        self.first_answer_id = next_id(Answer.answer_id)
+        self.own_question_ids, self.own_answer_ids = [], []
+
+    def pick(self, values: list):
+        return self.rng.choice(values)
+
+    def pick_ids(self, values: list) -> str:
+        """ Return an ids query string value of several picked ids """
+        return ",".join(map(str, self.rng.sample(
+            values, min(BENCH_MULTI_GET_IDS, len(values)))))
+
+    def own_posts(self, model, id_column, first_id: int) -> list:
+        """ Return the ids of the posts of a type made by this run """
+        return db.session.scalars(select(id_column).where(
+            model.user_id == self.user.user_id, id_column >= first_id
+        ).order_by(id_column)).all()
+
+    def endpoints(self):
+        """ Yield the name, method, authentication and password hashing of
+        each endpoint, with a function returning the path and JSON body of
+        its nth request """
+        pick = self.pick
+        token = self.token
+
+        # Reads
+        yield "index", "GET", False, False, lambda n: ("/", None)
+        yield "help", "GET", False, False, lambda n: ("/help", None)
+        yield "cache stats", "GET", False, False, lambda n: (
+            "/cache/stats", None)
+        yield "metrics", "GET", False, False, lambda n: ("/metrics", None)
+        yield "categories", "GET", False, False, lambda n: (
+            "/categories/", None)
+        yield "category questions", "GET", False, False, lambda n: (
+            f"/categories/{pick(self.category_names)}", None)
+        yield "questions", "GET", False, False, lambda n: (
+            "/questions/", None)
+        yield "questions max page", "GET", False, False, lambda n: (
+            f"/questions/?limit={app.config['PAGE_LIMIT_MAX']}", None)
+        yield "questions filtered", "GET", False, False, lambda n: (
+            f"/questions/?category_id={pick(self.category_ids)}", None)
+        yield "question", "GET", False, False, lambda n: (
+            f"/questions/{pick(self.question_ids)}", None)
+        if self.points:
+            yield "questions nearby", "GET", False, False, lambda n: (
+                "/questions/nearby?lat={}&lon={}&radius_km=50".format(
+                    *pick(self.points)), None)
+        # Suggestions for the first letters of a suburb, as typed
+        yield "location suggest", "GET", False, False, lambda n: (
+            "/locations/suggest?q={}".format(
+                quote(pick(self.suburbs)[:self.rng.randint(1, 4)])), None)
+        yield "answers", "GET", False, False, lambda n: ("/answers/", None)
+        yield "answer", "GET", False, False, lambda n: (
+            f"/answers/{pick(self.answer_ids)}", None)
+        yield "questions by ids", "GET", False, False, lambda n: (
+            f"/questions/?ids={self.pick_ids(self.question_ids)}", None)
+        yield "answers by ids", "GET", False, False, lambda n: (
+            f"/answers/?ids={self.pick_ids(self.answer_ids)}", None)
+        yield "search", "GET", False, False, lambda n: (
+            f"/search/?q={pick(WORDS)}+{pick(WORDS)}", None)
+        yield "users", "GET", True, False, lambda n: ("/users/", None)
+        yield "user", "GET", True, False, lambda n: (
+            f"/users/{pick(self.usernames)}", None)
+        yield "users by ids", "GET", True, False, lambda n: (
+            f"/users/?ids={self.pick_ids(self.user_ids)}", None)
+        for post_type in ["questions", "answers", "recommendations", "q&a"]:
+            yield f"user {post_type}", "GET", False, False, (
+                lambda n, post_type=post_type: (
+                    f"/users/{pick(self.usernames)}/{post_type}", None))
+        if self.streams:
+            yield "questions stream", "GET", False, False, lambda n: (
+                "/questions/?stream=1", None)
+            yield "answers stream", "GET", False, False, lambda n: (
+                "/answers/?stream=1", None)
+
+        # Writes, making the posts that are then edited and deleted
+        yield "post question", "POST", True, False, lambda n: (
+            "/questions/", {
+                "question": post_body(self.rng, f"Benchmark {token} {n}:"),
+                "category_id": pick(self.category_ids),
+                "location_id": pick(self.location_ids)})
+        yield "post question batch", "POST", True, False, lambda n: (
+            "/questions/batch", [{
+                "question": post_body(
+                    self.rng, f"Benchmark batch {token} {n} {number}:"),
+                "category_id": pick(self.category_ids),
+                "location_id": pick(self.location_ids)}
+                for number in range(BENCH_BATCH_SIZE)])
+        yield "post answer", "POST", True, False, lambda n: (
+            f"/questions/{pick(self.question_ids)}/answer", {
+                "answer": post_body(self.rng, f"Benchmark {token} {n}:")})
+        yield "edit question", "PUT", True, False, lambda n: (
+            f"/questions/{self.own_question(n)}/edit", {
+                "question": post_body(self.rng, f"Edited {token} {n}:")})
+        yield "edit answer", "PUT", True, False, lambda n: (
+            f"/answers/{self.own_answer(n)}/edit", {
+                "answer": post_body(self.rng, f"Edited {token} {n}:")})
+        yield "vote", "POST", True, False, lambda n: (
+            f"/answers/{self.answer_ids[n % len(self.answer_ids)]}/vote",
+            None)
+        yield "remove vote", "POST", True, False, lambda n: (
+            f"/answers/{self.answer_ids[n % len(self.answer_ids)]}"
+            "/remove-vote", None)
+        yield "delete answer", "DELETE", True, False, lambda n: (
+            f"/answers/{self.own_answer(n)}/delete", None)
+        yield "delete question", "DELETE", True, False, lambda n: (
+            f"/questions/{self.own_question(n)}/delete", None)
+
+        # Endpoints that hash a password
+        yield "register", "POST", False, True, lambda n: (
+            "/auth/register", {
+                "username": f"bench_register_{token}_{n}",
+                "email": f"bench_register_{token}_{n}@example.com",
+                "password": BENCH_PASSWORD})
+        yield "login", "POST", False, True, lambda n: (
+            "/auth/login", {
+                "username": self.user.username, "password": BENCH_PASSWORD})
+        yield "update account", "PUT", True, True, lambda n: (
+            f"/users/{self.user.user_id}/account", {
+                "email": f"bench_{token}_{n}@example.com",
+                "password": BENCH_PASSWORD})
+
+    def own_question(self, n: int) -> int:
+        if not self.own_question_ids:
+            self.own_question_ids = self.own_posts(
+                Question, Question.question_id, self.first_question_id)
+        return self.own_question_ids[n % len(self.own_question_ids)]
+
+    def own_answer(self, n: int) -> int:
+        if not self.own_answer_ids:
+            self.own_answer_ids = self.own_posts(
+                Answer, Answer.answer_id, self.first_answer_id)
+        return self.own_answer_ids[n % len(self.own_answer_ids)]
+
+    def count_query(self, *args) -> None:
+        self.query_count += 1
+
+    def send(self, method: str, authenticated: bool, path: str, body):
+        """ Send a request and read its whole response, then end the
+        database session as the end of a real request would """
+        response = self.client.open(
+            path, method=method, json=body,
+            headers=self.headers if authenticated else None)
+        response.get_data()
+        response.close()
+        db.session.remove()
+        return response
+
+    def measure(self, method: str, authenticated: bool, make_request,
+                request_count: int) -> dict:
+        """ Send one untimed request, then time request_count requests,
+        then measure the peak memory allocated by one more """
+        self.send(method, authenticated, *make_request(0))
+
+        latencies, query_counts, statuses = [], [], {}
+        for n in range(1, request_count + 1):
+            path, body = make_request(n)
+            self.query_count = 0
+            start = time.perf_counter()
+            response = self.send(method, authenticated, path, body)
+            latencies.append((time.perf_counter() - start) * 1000)
+            query_counts.append(self.query_count)
+            status = str(response.status_code)
+            statuses[status] = statuses.get(status, 0) + 1
+
+        path, body = make_request(request_count + 1)
+        tracemalloc.start()
+        self.send(method, authenticated, path, body)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        latencies.sort()
+        return {
+            "method": method,
+            "requests": request_count,
+            "statuses": statuses,
+            "latency_ms": {
+                "mean": round(sum(latencies) / len(latencies), 3),
+                **{f"p{percent}": round(percentile(latencies, percent), 3)
+                   for percent in PERCENTILES},
+                "max": round(latencies[-1], 3),
+            },
+            "queries_per_request": {
+                "mean": round(sum(query_counts) / len(query_counts), 2),
+                "max": max(query_counts),
+            },
+            "peak_memory_kb": round(peak_memory / 1024, 1),
+        }
+
+    def run(self, only: tuple) -> dict:
+        """ Benchmark every endpoint (or those whose names contain any of
+        the only filters) and return the results by endpoint name """
+        results = {}
+        event.listen(db.engine, "before_cursor_execute", self.count_query)
+        try:
+            for name, method, authenticated, hashes_password, make_request \
+                    in self.endpoints():
+                if only and not any(text in name for text in only):
+                    continue
+                results[name] = self.measure(
+                    method, authenticated, make_request,
+                    self.auth_request_count if hashes_password
+                    else self.request_count)
+                print_result(name, results[name])
+        finally:
+            event.remove(db.engine, "before_cursor_execute", self.count_query)
+        return results
+
+
+def print_result(name: str, result: dict) -> None:
+    """ Print one line of latency, query and memory results """
+    latency = result["latency_ms"]
+    statuses = ",".join(result["statuses"])
+    print(f"{name:22} {result['method']:6} {statuses:8} "
+          f"p50 {latency['p50']:8.2f}ms  p95 {latency['p95']:8.2f}ms  "
+          f"p99 {latency['p99']:8.2f}ms  "
+          f"{result['queries_per_request']['mean']:6.1f} queries  "
+          f"{result['peak_memory_kb']:9.1f} KB")
+
+
+def current_commit() -> str | None:
+    """ Return the git commit of the working tree, if there is one """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@bench_commands.cli.command("run")
+@click.option("--requests", "request_count", default=100, show_default=True,
+              help="Timed requests per endpoint.")
+@click.option("--auth-requests", "auth_request_count", default=5,
+              show_default=True,
+              help="Timed requests per endpoint that hashes a password.")
+@click.option("--output", default="benchmark.json", show_default=True,
+              help="File the results are written to as JSON.")
+@click.option("--cache/--no-cache", "cache_on", default=False,
+              show_default=True, help="Keep the response cache on.")
+@click.option("--streams/--no-streams", default=False, show_default=True,
+              help="Include streams of whole question and answer lists.")
+@click.option("--only", multiple=True,
+              help="Only run endpoints whose name contains this text.")
+@click.option("--seed", default=0, show_default=True,
+              help="Random seed, so runs request the same paths.")
+def run_benchmarks(request_count, auth_request_count, output, cache_on,
+                   streams, only, seed):
+    """ Benchmark every endpoint against the connected database and write
+    latency percentiles, queries per request and peak memory to a JSON
+    file. Posts and accounts made by the run are left in the database. """
+    if not cache_on:
+        app.config["CACHE_TYPE"] = "null"
+        cache.init_app(app)
+    benchmark = BenchmarkRun(
+        request_count, auth_request_count, streams, seed)
+    row_counts = {
+        model.__tablename__: db.session.scalar(
+            select(func.count()).select_from(model))
+        for model in [User, Question, Answer, Recommendation]}
+    print("Benchmarking against " + ", ".join(
+        f"{count} {table}" for table, count in row_counts.items()))
+
+    results = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "commit": current_commit(),
+            "database": db.engine.dialect.name,
+            "rows": row_counts,
+            "requests": request_count,
+            "auth_requests": auth_request_count,
+            "cache": cache_on,
+            "seed": seed,
+        },
+        "endpoints": benchmark.run(only),
+    }
+    with open(output, "w", encoding="utf-8") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Benchmark: Results written to {output}")
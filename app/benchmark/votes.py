@@ -0,0 +1,144 @@
+import random
+from threading import Event, Thread
+import time
+import click
+from flask import current_app as app
+from flask_jwt_extended import create_access_token
+from sqlalchemy import func, select
+from app import db, votes
+from app.benchmark.common import BENCH_USERNAME_PREFIX, bench_commands
+from app.commands import user_stat_counts
+from app.models.answer import Answer
+from app.models.recommendation import Recommendation
+from app.models.user import User
+
+
+@bench_commands.cli.command("votes")
+@click.option("--voters", "voter_count", default=40, show_default=True)
+@click.option("--answers", "answer_count", default=4, show_default=True)
+@click.option("--votes", "vote_count", default=2000, show_default=True,
+              help="Votes and removals sent in total.")
+@click.option("--threads", "thread_count", default=8, show_default=True)
+@click.option("--seed", default=0, show_default=True)
+def stress_votes(voter_count, answer_count, vote_count, thread_count, seed):
+    """ Send votes and removals for a few answers from many generated users
+    on concurrent threads, reading the answers' counts meanwhile, then
+    check every count is exact. With VOTE_WRITE_BEHIND on, another thread
+    applies pending votes throughout, competing with the worker's own
+    flushes, and counts are checked before and after the last batch. """
+    rng = random.Random(seed)
+    voter_ids = db.session.scalars(select(User.user_id).where(
+        User.username.startswith(BENCH_USERNAME_PREFIX)
+    ).order_by(User.user_id).limit(voter_count)).all()
+    answer_ids = db.session.scalars(select(Answer.answer_id).order_by(
+        func.random()).limit(answer_count)).all()
+    if len(voter_ids) < voter_count or len(answer_ids) < answer_count:
+        raise click.ClickException(
+            "There aren't enough users and answers. Run flask bench generate "
+            "first.")
+    headers = {
+        user_id: {"Authorization":
+                  f"Bearer {create_access_token(identity=str(user_id))}"}
+        for user_id in voter_ids}
+
+    # Each thread votes for a share of the users, so each user's votes are
+    # sent in order and their last vote for each answer decides the result
+    expected = {
+        (row.answer_id, row.user_id): True
+        for row in db.session.execute(select(
+            Recommendation.answer_id, Recommendation.user_id).where(
+            Recommendation.answer_id.in_(answer_ids)))}
+    plans = [[] for thread in range(thread_count)]
+    for number in range(vote_count):
+        user_id = rng.choice(voter_ids)
+        answer_id = rng.choice(answer_ids)
+        voted = rng.random() < 0.6
+        plans[voter_ids.index(user_id) % thread_count].append(
+            (user_id, answer_id, voted))
+        expected[(answer_id, user_id)] = voted
+    db.session.remove()
+
+    # The threads have no app context, so they use the app object itself
+    flask_app = app._get_current_object()
+    statuses = {}
+    finished = Event()
+
+    def send_votes(plan):
+        client = flask_app.test_client()
+        for user_id, answer_id, voted in plan:
+            response = client.post(
+                f"/answers/{answer_id}/{'vote' if voted else 'remove-vote'}",
+                headers=headers[user_id])
+            statuses[response.status_code] = (
+                statuses.get(response.status_code, 0) + 1)
+
+    def read_counts():
+        client = flask_app.test_client()
+        while not finished.is_set():
+            response = client.get(f"/answers/{rng.choice(answer_ids)}")
+            statuses[response.status_code] = (
+                statuses.get(response.status_code, 0) + 1)
+
+    def apply_votes():
+        while not finished.is_set():
+            with flask_app.app_context():
+                votes.flush()
+            time.sleep(0.01)
+
+    helpers = [Thread(target=read_counts)]
+    if votes.enabled:
+        helpers.append(Thread(target=apply_votes))
+    voters = [Thread(target=send_votes, args=[plan]) for plan in plans]
+    start = time.perf_counter()
+    for thread in helpers + voters:
+        thread.start()
+    for thread in voters:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    finished.set()
+    for thread in helpers:
+        thread.join()
+    print(f"Votes: {vote_count} votes on {thread_count} threads in "
+          f"{elapsed:.2f}s ({vote_count / elapsed:.0f} votes/s), "
+          f"responses by status: {statuses}")
+
+    def check_counts(stage: str) -> int:
+        """ Compare each answer's count in the API with the expected votes,
+        and return the number of mismatches """
+        client = app.test_client()
+        mismatches = 0
+        for answer_id in answer_ids:
+            expected_count = sum(
+                voted for (voted_answer_id, user_id), voted
+                in expected.items() if voted_answer_id == answer_id)
+            count = client.get(f"/answers/{answer_id}").json[
+                "recommendations"]
+            if count != expected_count:
+                mismatches += 1
+                print(f"Mismatch ({stage}): answer {answer_id} has {count} "
+                      f"recommendations, expected {expected_count}")
+        return mismatches
+
+    mismatches = check_counts("before applying") if votes.enabled else 0
+    while votes.flush():
+        pass
+    mismatches += check_counts("applied")
+
+    # Every user's vote and votes_count must match the votes they sent
+    recommended = {tuple(row) for row in db.session.execute(select(
+        Recommendation.answer_id, Recommendation.user_id).where(
+        Recommendation.answer_id.in_(answer_ids)))}
+    for pair, voted in expected.items():
+        if (pair in recommended) != voted:
+            mismatches += 1
+            print(f"Mismatch: answer {pair[0]} recommended by user "
+                  f"{pair[1]} is {pair in recommended}, expected {voted}")
+    drifted = db.session.scalar(select(func.count()).where(
+        User.user_id.in_(voter_ids),
+        User.votes_count != user_stat_counts()["votes_count"]))
+    if drifted:
+        mismatches += drifted
+        print(f"Mismatch: {drifted} users' votes_count has drifted")
+    print(f"Votes: {mismatches} mismatches")
+    if mismatches:
+        raise SystemExit(1)
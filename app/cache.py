@@ -0,0 +1,213 @@
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+import time
+from flask import Response, current_app as app, g, make_response, request
+
+
+class MemoryCacheBackend:
+    """ Keep cached responses in the memory of the current process, with a
+    time to live and least recently used eviction """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        # Entries by key, least recently used first
+        self.entries = OrderedDict()
+        # Keys of the entries that depend on each tag
+        self.tag_index = {}
+        # Incremented on every invalidation (see ResponseCache.cached)
+        self.generation = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def get(self, key: str) -> tuple | None:
+        """ Return the value stored for a key, if it hasn't expired """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, tags, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: tuple, tags: set, ttl: int,
+            generation: int) -> bool:
+        """ Store a value under a key unless an invalidation has happened
+        since the given generation, when the value may already be stale """
+        with self.lock:
+            if generation != self.generation:
+                return False
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, tags, time.monotonic() + ttl)
+            for tag in tags:
+                self.tag_index.setdefault(tag, set()).add(key)
+            # Evict the least recently used entries over the limit
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+            return True
+
+    def invalidate(self, tags: set) -> int:
+        """ Remove every entry that depends on any of the given tags and
+        return how many were removed """
+        with self.lock:
+            self.generation += 1
+            keys = set()
+            for tag in tags:
+                keys.update(self.tag_index.get(tag, ()))
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self) -> None:
+        """ Remove every entry """
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.tag_index.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _remove(self, key: str) -> None:
+        """ Remove an entry and its tag index references (lock held) """
+        value, tags, expires_at = self.entries.pop(key)
+        for tag in tags:
+            keys = self.tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tag_index[tag]
+
+
+class NullCacheBackend:
+    """ Don't cache anything (every request is a miss) """
+    generation = 0
+    evictions = 0
+
+    def get(self, key: str) -> None:
+        return None
+
+    def set(self, key: str, value: tuple, tags: set, ttl: int,
+            generation: int) -> bool:
+        return False
+
+    def invalidate(self, tags: set) -> int:
+        return 0
+
+    def clear(self) -> None:
+        pass
+
+    def __len__(self) -> int:
+        return 0
+
+
+# Backends selectable with the CACHE_TYPE config setting
+cache_backends = {
+    "memory": MemoryCacheBackend,
+    "null": NullCacheBackend,
+}
+
+
+class ResponseCache:
+    """ Cache the responses of read endpoints until they expire or a write
+    invalidates one of the tags the response was built from """
+
+    def __init__(self, app=None):
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        """ Create the backend set by the app configuration """
+        cache_type = app.config.get("CACHE_TYPE", "memory")
+        if cache_type not in cache_backends:
+            raise ValueError(f"Unknown cache type '{cache_type}'. Use one of "
+                             f"{list(cache_backends)}.")
+        # The null backend doesn't store anything
+        self.stores_responses = cache_type != "null"
+        if cache_type == "memory":
+            self.backend = MemoryCacheBackend(
+                app.config.get("CACHE_MAX_ENTRIES", 1000))
+        else:
+            self.backend = cache_backends[cache_type]()
+        app.extensions["response_cache"] = self
+
+    def cached(self, ttl: int | None = None, vary=None):
+        """ Decorate a GET view so its successful responses are cached by
+        path, query string and preferred content type, and by the value
+        vary returns, if given (e.g. the version of data changed by other
+        processes, whose writes can't invalidate this process's cache) """
+        def decorator(view):
+            @wraps(view)
+            def cached_view(*args, **kwargs):
+                # Responses vary by the content type the client prefers, and
+                # by the resource version under conditional views, so a
+                # response cached before a write is never sent with the
+                # ETag of a newer version
+                key = (f"{request.full_path} {request.accept_mimetypes.best} "
+                       f"{g.get('etag', '')}")
+                if vary is not None:
+                    key += f" {vary()}"
+                value = self.backend.get(key)
+                if value is not None:
+                    self.hits += 1
+                    body, mimetype = value
+                    response = Response(body, 200, mimetype=mimetype)
+                    response.headers["X-Cache"] = "HIT"
+                    return response
+
+                # Note the generation before reading from the database, so
+                # a write committed meanwhile stops the response being stored
+                self.misses += 1
+                generation = self.backend.generation
+                g.cache_tags = set()
+                # Responses to be stored are read from the primary, as a
+                # replica may not have a write made by any server process
+                # yet (see ReplicaRouter)
+                if self.stores_responses:
+                    g.read_replica = False
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed:
+                    self.backend.set(
+                        key, (response.get_data(), response.mimetype),
+                        g.cache_tags,
+                        ttl or app.config.get("CACHE_DEFAULT_TTL", 300),
+                        generation)
+                response.headers["X-Cache"] = "MISS"
+                return response
+            return cached_view
+        return decorator
+
+    def tag(self, *tags: str) -> None:
+        """ Record what the response of the current cached view was built
+        from, so writes to it can invalidate the response """
+        if "cache_tags" in g:
+            g.cache_tags.update(tags)
+
+    def invalidate(self, *tags: str) -> None:
+        """ Remove the cached responses built from any of the given tags """
+        self.invalidations += 1
+        self.backend.invalidate(set(tags))
+
+    def clear(self) -> None:
+        """ Remove every cached response """
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        """ Return the cache hit and miss counts and current size """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "entries": len(self.backend),
+            "evictions": self.backend.evictions,
+            "invalidations": self.invalidations,
+        }
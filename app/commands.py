@@ -1,7 +1,13 @@
 from flask import Blueprint
-from app import db, bcrypt
+import click
+from sqlalchemy import bindparam, func, inspect, or_, select, tuple_, update
+from sqlalchemy.schema import CreateIndex, UniqueConstraint
+from app import db, bcrypt, votes
 from datetime import datetime, timezone, timedelta
 import csv
+import io
+import re
+import time
 
 # Import models
 from app.models.answer import Answer
@@ -11,55 +17,474 @@ from app.models.location import Location
 from app.models.question import Question
 from app.models.recommendation import Recommendation
 from app.models.user import User
+from app.geo import grid_cell
+from app.search import create_search_index, drop_search_index
+from app.reference_data import bump_reference_version
+from app.utils import content_hash, insert_unless_exists
 
 
 # Instantiate a blueprint for CLI database commands
 db_commands = Blueprint("db", __name__)
 
+# Number of data file rows checked and inserted at a time when bulk loading
+LOAD_CHUNK_SIZE = 2000
+# Columns that identify a location when loading GeoNames postal code files
+LOCATION_KEY = ["country_code", "state", "postcode", "suburb"]
+# Number of posts hashed per batch by flask db hash-content
+HASH_BATCH_SIZE = 1000
+# Indexes replaced by unique constraints over the same columns
+SUPERSEDED_INDEXES = {
+    "locations": ["ix_locations_country_code_state_postcode_suburb"],
+    "recommendations": ["ix_recommendations_answer_id_user_id"],
+}
+
+
+def read_chunks(path: str, parse_row, chunk_size: int = LOAD_CHUNK_SIZE):
+    """ Stream a tab-separated GeoNames file as chunks of column dicts """
+    with open(path, newline="", encoding="utf-8") as data_file:
+        reader = csv.reader(
+            data_file, delimiter="\t", quoting=csv.QUOTE_NONE)
+        chunk = []
+        for row in reader:
+            # Skip blank lines and comments
+            if not row or row[0].startswith("#"):
+                continue
+            chunk.append(parse_row(row))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def parse_country(row: list) -> dict:
+    """ Map a countryInfo.txt row to Country columns """
+    return {"country_code": row[0], "country": row[4]}
+
+
+def parse_location(row: list) -> dict:
+    """ Map a GeoNames postal code row (e.g. from AU.txt) to
+    Location columns """
+    latitude = float(row[9]) if row[9] else None
+    longitude = float(row[10]) if row[10] else None
+    return {
+        "country_code": row[0],
+        "state": row[3],
+        "postcode": row[1],
+        "suburb": row[2],
+        "latitude": latitude,
+        "longitude": longitude,
+        "grid_cell": grid_cell(latitude, longitude)
+    }
+
+
+def unique_rows(rows: list, key_columns: list) -> dict:
+    """ Key rows by their key columns, keeping the first of any repeats """
+    rows_by_key = {}
+    for row in rows:
+        rows_by_key.setdefault(
+            tuple(row[column] for column in key_columns), row)
+    return rows_by_key
+
+
+def insert_new_rows(model, rows: list, key_columns: list) -> int:
+    """ Insert the rows whose keys aren't in the table yet with a single
+    executemany, and return how many were inserted """
+    rows_by_key = unique_rows(rows, key_columns)
+
+    # Look up which keys already exist with one query for the whole chunk
+    key_attributes = [getattr(model, column) for column in key_columns]
+    existing_keys = {
+        tuple(existing_key) for existing_key in db.session.execute(
+            select(*key_attributes).where(
+                tuple_(*key_attributes).in_(list(rows_by_key))))}
+    new_rows = [row for row_key, row in rows_by_key.items()
+                if row_key not in existing_keys]
+
+    if new_rows:
+        db.session.execute(model.__table__.insert(), new_rows)
+    return len(new_rows)
+
+
+def copy_new_rows(model, rows: list, key_columns: list) -> int:
+    """ COPY rows into a PostgreSQL staging table, then insert the rows
+    whose keys aren't in the table yet, and return how many were inserted """
+    table = model.__table__.name
+    staging_table = f"{table}_staging"
+    rows = list(unique_rows(rows, key_columns).values())
+    columns = ", ".join(rows[0])
+    # Empty text stays an empty string, while other empty values are NULL
+    text_columns = ", ".join(
+        column for column, value in rows[0].items()
+        if isinstance(value, str))
+
+    # Write the rows in the CSV format understood by COPY
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter="\t", lineterminator="\n")
+    writer.writerows(row.values() for row in rows)
+    buffer.seek(0)
+
+    cursor = db.session.connection().connection.cursor()
+    cursor.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS {staging_table} "
+        f"ON COMMIT DELETE ROWS AS SELECT {columns} FROM {table} "
+        "WITH NO DATA")
+    cursor.copy_expert(
+        f"COPY {staging_table} ({columns}) FROM STDIN WITH (FORMAT csv, "
+        f"DELIMITER E'\\t', FORCE_NOT_NULL ({text_columns}))", buffer)
+    # Keep file order so new rows get their ids in the same order
+    key_matches = " AND ".join(
+        f"{table}.{column} = staged.{column}" for column in key_columns)
+    cursor.execute(
+        f"INSERT INTO {table} ({columns}) SELECT {columns} "
+        f"FROM {staging_table} AS staged WHERE NOT EXISTS ("
+        f"SELECT 1 FROM {table} WHERE {key_matches}) ORDER BY staged.ctid")
+    return cursor.rowcount
+
+
+def bulk_load(model, chunks, key_columns: list) -> None:
+    """ Insert chunks of rows into the table of a model, skipping rows
+    that already exist, and report how fast they were loaded """
+    # Use COPY on PostgreSQL, and a single executemany per chunk elsewhere
+    if db.engine.dialect.name == "postgresql":
+        insert_chunk = copy_new_rows
+    else:
+        insert_chunk = insert_new_rows
+    loaded, total = 0, 0
+    start = time.perf_counter()
+
+    for chunk in chunks:
+        loaded += insert_chunk(model, chunk, key_columns)
+        total += len(chunk)
+        db.session.commit()
+
+    elapsed = time.perf_counter() - start
+    print(f"Database: {loaded} {model.__tablename__} rows loaded, "
+          f"{total - loaded} skipped ({total / elapsed:.0f} rows/s)")
+
+
+def add_unique_constraint(
+        connection, constraint, concurrently: bool) -> bool:
+    """ Add a unique constraint to an existing table through a unique
+    index, unless rows already break it, and return whether it was added """
+    table = constraint.table.name
+    columns = ", ".join(column.name for column in constraint.columns)
+    duplicates = connection.execute(db.text(
+        f"SELECT count(*) FROM (SELECT 1 FROM {table} GROUP BY {columns} "
+        "HAVING count(*) > 1) AS duplicate_keys")).scalar()
+    if duplicates:
+        print(f"Database: Skipped {constraint.name}: {duplicates} "
+              f"({columns}) values are repeated in {table}")
+        return False
+
+    start = time.perf_counter()
+    connection.execute(db.text(
+        f"CREATE UNIQUE INDEX {'CONCURRENTLY ' if concurrently else ''}"
+        f"IF NOT EXISTS {constraint.name} ON {table} ({columns})"))
+    # Attach the index as the constraint (PostgreSQL), so ON CONFLICT and
+    # the model agree; SQLite treats a unique index as the constraint
+    if concurrently:
+        connection.execute(db.text(
+            f"ALTER TABLE {table} ADD CONSTRAINT {constraint.name} "
+            f"UNIQUE USING INDEX {constraint.name}"))
+    print(f"Database: Created unique constraint {constraint.name} "
+          f"({time.perf_counter() - start:.1f}s)")
+    return True
+
 
 @db_commands.cli.command("create")
 def create_tables():
     """ Create all tables in the connected database using models """
     db.create_all()
+    # Add the full-text search index, which isn't part of the models
+    with db.engine.begin() as connection:
+        create_search_index(connection)
     print("Database: Tables created")
 
 
 @db_commands.cli.command("drop")
 def create_tables():
     """ Drop all tables in the connected database """
+    with db.engine.begin() as connection:
+        drop_search_index(connection)
     db.drop_all()
     print("Database: Tables dropped")
 
 
+@db_commands.cli.command("index")
+def create_indexes():
+    """ Create any indexes declared on the models that are missing from an
+    existing database, without locking tables for writes on PostgreSQL """
+    concurrently = db.engine.dialect.name == "postgresql"
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    with db.engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT") as connection:
+        inspector = inspect(connection)
+        if concurrently:
+            # Drop indexes left invalid by an interrupted concurrent build
+            invalid_indexes = connection.execute(db.text(
+                "SELECT c.relname FROM pg_index i JOIN pg_class c "
+                "ON c.oid = i.indexrelid WHERE NOT i.indisvalid")).scalars()
+            for index_name in invalid_indexes:
+                connection.execute(db.text(
+                    f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+                print(f"Database: Dropped invalid index {index_name}")
+
+        for table in db.metadata.sorted_tables:
+            existing_indexes = {
+                index["name"] for index in inspector.get_indexes(table.name)}
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                if index.name in existing_indexes:
+                    continue
+                statement = str(CreateIndex(index, if_not_exists=True).compile(
+                    dialect=db.engine.dialect))
+                if concurrently:
+                    statement = re.sub(
+                        r"^CREATE (UNIQUE )?INDEX",
+                        r"CREATE \1INDEX CONCURRENTLY", statement)
+                start = time.perf_counter()
+                connection.execute(db.text(statement))
+                print(f"Database: Created index {index.name} "
+                      f"({time.perf_counter() - start:.1f}s)")
+
+            # Add unique constraints declared since the table was created
+            existing_indexes.update(
+                constraint["name"] for constraint in
+                inspector.get_unique_constraints(table.name))
+            unique_constraints = [
+                constraint for constraint in table.constraints
+                if isinstance(constraint, UniqueConstraint)
+                and constraint.name]
+            for constraint in unique_constraints:
+                if (constraint.name not in existing_indexes
+                        and add_unique_constraint(
+                            connection, constraint, concurrently)):
+                    existing_indexes.add(constraint.name)
+
+            # Drop indexes made redundant by the unique constraints
+            if not all(constraint.name in existing_indexes
+                       for constraint in unique_constraints):
+                continue
+            for index_name in SUPERSEDED_INDEXES.get(table.name, []):
+                if index_name in existing_indexes:
+                    connection.execute(db.text(
+                        f"DROP INDEX {'CONCURRENTLY ' if concurrently else ''}"
+                        f"IF EXISTS {index_name}"))
+                    print(f"Database: Dropped index {index_name}")
+    print("Database: Indexes are up to date")
+
+
+@db_commands.cli.command("search-index")
+def rebuild_search_index():
+    """ Create the full-text search index on an existing database and
+    fill it from the posts already there """
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    with db.engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT") as connection:
+        create_search_index(connection, rebuild=True)
+    print("Database: Search index rebuilt")
+
+
+def user_stat_counts() -> dict:
+    """ Return correlated subqueries counting each user's posts and votes,
+    by stat counter column """
+    return {
+        "questions_count": select(func.count(Question.question_id)).where(
+            Question.user_id == User.user_id).scalar_subquery(),
+        "answers_count": select(func.count(Answer.answer_id)).where(
+            Answer.user_id == User.user_id).scalar_subquery(),
+        "votes_count": select(func.count(Recommendation.vote_id)).where(
+            Recommendation.user_id == User.user_id).scalar_subquery(),
+    }
+
+
+@db_commands.cli.command("recount")
+def recount_user_stats():
+    """ Rebuild the user stat counters from the posts and votes tables
+    and report any counters that had drifted """
+    actual_counts = user_stat_counts()
+
+    # Report the users whose stored counters don't match
+    drifted_users = db.session.execute(
+        select(
+            User.username,
+            *[getattr(User, counter) for counter in actual_counts],
+            *actual_counts.values()
+        ).where(or_(*[
+            getattr(User, counter) != count
+            for counter, count in actual_counts.items()]))
+    ).all()
+    for username, *counts in drifted_users:
+        stored, actual = counts[:3], counts[3:]
+        changes = ", ".join(
+            f"{counter} {stored_count} -> {actual_count}"
+            for counter, stored_count, actual_count
+            in zip(actual_counts, stored, actual)
+            if stored_count != actual_count)
+        print(f"Drift: {username}: {changes}")
+
+    # Rebuild every user's counters in a single bulk update
+    db.session.execute(update(User).values(actual_counts))
+    db.session.commit()
+    print(f"Database: User stats recounted ({len(drifted_users)} "
+          "users had drifted)")
+
+
+@db_commands.cli.command("flush-votes")
+def flush_votes():
+    """ Apply every vote waiting in vote_events (from write-behind votes),
+    e.g. before turning VOTE_WRITE_BEHIND off """
+    start = time.perf_counter()
+    applied = 0
+    while flushed := votes.flush():
+        applied += flushed
+    print(f"Database: {applied} pending votes applied "
+          f"({time.perf_counter() - start:.1f}s)")
+
+
+@db_commands.cli.command("hash-content")
+@click.option("--batch-size", default=HASH_BATCH_SIZE, show_default=True)
+def hash_content(batch_size):
+    """ Add the content_hash column to existing question and answer tables
+    if needed and hash the bodies of posts that have no hash yet. Run
+    flask db index afterwards to index the hashes. """
+    for model in [Question, Answer]:
+        table = model.__table__
+        (id_column,) = table.primary_key.columns
+        columns = {
+            column["name"] for column in inspect(db.engine).get_columns(
+                table.name)}
+        if "content_hash" not in columns:
+            db.session.execute(db.text(
+                f"ALTER TABLE {table.name} "
+                "ADD COLUMN content_hash VARCHAR(64)"))
+            db.session.commit()
+
+        # Page through unhashed rows by id, committing each batch
+        hashed, last_id = 0, 0
+        start = time.perf_counter()
+        while True:
+            rows = db.session.execute(
+                select(id_column, table.c.body).where(
+                    table.c.content_hash.is_(None), id_column > last_id
+                ).order_by(id_column).limit(batch_size)).all()
+            if not rows:
+                break
+            db.session.execute(
+                update(table).where(id_column == bindparam("row_id")).values(
+                    content_hash=bindparam("row_hash")),
+                [{"row_id": row_id, "row_hash": content_hash(body)}
+                 for row_id, body in rows])
+            db.session.commit()
+            hashed += len(rows)
+            last_id = rows[-1][0]
+        print(f"Database: {hashed} {table.name} hashed "
+              f"({time.perf_counter() - start:.1f}s)")
+
+
+@db_commands.cli.command("add-revisions")
+def add_revisions():
+    """ Add the revision and updated_at columns used for conditional GETs
+    to existing question and user tables if needed, starting questions
+    from the time they were posted """
+    for model in [Question, User]:
+        table = model.__table__
+        columns = {
+            column["name"] for column in inspect(db.engine).get_columns(
+                table.name)}
+        if "revision" not in columns:
+            db.session.execute(db.text(
+                f"ALTER TABLE {table.name} "
+                "ADD COLUMN revision INTEGER NOT NULL DEFAULT 0"))
+        if "updated_at" not in columns:
+            db.session.execute(db.text(
+                f"ALTER TABLE {table.name} ADD COLUMN updated_at TIMESTAMP"))
+        db.session.commit()
+
+    # Users have no creation time, so they start without one
+    db.session.execute(update(Question).where(
+        Question.updated_at.is_(None)).values(updated_at=Question.date_time))
+    db.session.commit()
+    print("Database: Revision columns are up to date")
+
+
+@db_commands.cli.command("add-coordinates")
+@click.argument("path", default="./app/data/AU.txt")
+def add_coordinates(path):
+    """ Add the latitude, longitude and grid_cell columns used for nearby
+    questions to an existing locations table if needed, and fill them in
+    from a GeoNames postal code file. Run flask db index afterwards to
+    index the grid cells. """
+    table = Location.__table__
+    columns = {
+        column["name"] for column in inspect(db.engine).get_columns(
+            table.name)}
+    for column, column_type in [("latitude", "FLOAT"),
+                                ("longitude", "FLOAT"),
+                                ("grid_cell", "INTEGER")]:
+        if column not in columns:
+            db.session.execute(db.text(
+                f"ALTER TABLE {table.name} ADD COLUMN {column} {column_type}"))
+    db.session.commit()
+
+    # Update the locations without coordinates a chunk at a time, matching
+    # them by their key
+    start = time.perf_counter()
+    statement = update(table).where(
+        *[table.c[column] == bindparam(f"key_{column}")
+          for column in LOCATION_KEY],
+        table.c.latitude.is_(None)
+    ).values(latitude=bindparam("new_latitude"),
+             longitude=bindparam("new_longitude"),
+             grid_cell=bindparam("new_grid_cell"))
+    for chunk in read_chunks(path, parse_location):
+        rows = [{
+            **{f"key_{column}": row[column] for column in LOCATION_KEY},
+            "new_latitude": row["latitude"],
+            "new_longitude": row["longitude"],
+            "new_grid_cell": row["grid_cell"],
+        } for row in unique_rows(chunk, LOCATION_KEY).values()
+            if row["latitude"] is not None]
+        if rows:
+            db.session.execute(statement, rows)
+        db.session.commit()
+    # Count afterwards, as drivers don't all report executemany row counts
+    located, total = db.session.execute(select(
+        func.count(table.c.latitude), func.count())).one()
+    print(f"Database: {located} of {total} locations have coordinates "
+          f"({time.perf_counter() - start:.1f}s)")
+
+
+@db_commands.cli.command("load-locations")
+@click.argument("path")
+def load_locations(path):
+    """ Bulk load locations from a GeoNames postal code file """
+    bulk_load(Location, read_chunks(path, parse_location), LOCATION_KEY)
+
+
+@db_commands.cli.command("reload-reference-data")
+def reload_reference_data():
+    """ Make running workers reload categories and countries after they
+    were changed in the database directly """
+    bump_reference_version()
+    print("Database: Reference data version bumped")
+
+
 @db_commands.cli.command("seed")
 def seed_tables():
     """ Seed all tables in the connected database """
 
-    # Seed countries from txt file
-    with open("./app/data/countryInfo.txt", "r") as country_info:
-        countries_reader = csv.reader(country_info, delimiter="\t")
-        for country in countries_reader:
-            new_country = Country(
-                country_code=country[0],
-                country=country[4]
-            )
-            db.session.add(new_country)
-            db.session.commit()
-    country_info.close()
-
-    # Seed Australian locations from txt file
-    with open("./app/data/AU.txt") as locations_AU:
-        locations_reader = csv.reader(locations_AU, delimiter="\t")
-        for location in locations_reader:
-            new_location = Location(
-                country_code=location[0],
-                state=location[3],
-                postcode=location[1],
-                suburb=location[2]
-            )
-            db.session.add(new_location)
-            db.session.commit()
-    locations_AU.close()
+    # Bulk load countries from txt file
+    bulk_load(
+        Country,
+        read_chunks("./app/data/countryInfo.txt", parse_country),
+        ["country_code"])
+
+    # Bulk load Australian locations from txt file
+    bulk_load(
+        Location,
+        read_chunks("./app/data/AU.txt", parse_location),
+        LOCATION_KEY)
 
     # Add question categories
     categories = {
@@ -78,29 +503,33 @@ def seed_tables():
         "Miscellaneous": "miscellaneous topics"
     }
 
+    # Categories and users that already exist are skipped, so seeding
+    # again doesn't fail on their unique names
     for cat_name, cat_description in categories.items():
-        category = Category(
-            category_name=cat_name,
-            description=f"Questions about {cat_description}"
-        )
-        db.session.add(category)
+        insert_unless_exists(Category, {
+            "category_name": cat_name,
+            "description": f"Questions about {cat_description}"
+        }, ["category_name"])
 
     # Add users
-    user1 = User(
-        username="user1",
-        email="user1@emailprovider.com",
-        password=bcrypt.generate_password_hash("12345678").decode("utf-8")
-    )
-    db.session.add(user1)
-
-    user2 = User(
-        username="user2",
-        email="user2@emailprovider.com",
-        password=bcrypt.generate_password_hash("12345678").decode("utf-8")
-    )
-    db.session.add(user2)
+    new_users = [
+        insert_unless_exists(User, {
+            "username": username,
+            "email": f"{username}@emailprovider.com",
+            "password": bcrypt.generate_password_hash(
+                "12345678").decode("utf-8")
+        }, ["username"])
+        for username in ["user1", "user2"]]
     db.session.commit()
 
+    # The sample posts are only added with the users who post them, so
+    # they aren't added again
+    if not all(new_users):
+        # Make running workers reload the categories and countries
+        bump_reference_version()
+        print("Database: Tables seeded (the sample posts already exist)")
+        return
+
     # Add a question
     question1 = Question(
         user_id=1,
@@ -175,4 +604,6 @@ def seed_tables():
     db.session.add(recommendation1)
 
     db.session.commit()
+    # Make running workers reload the categories and countries
+    bump_reference_version()
     print("Database: Tables seeded")
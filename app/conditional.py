@@ -0,0 +1,51 @@
+from datetime import timezone
+from functools import wraps
+from flask import Response, g, make_response, request
+
+
+def conditional(get_version, private: bool = False):
+    """ Decorate a GET view of a single resource so its responses carry a
+    weak ETag and Last-Modified from the resource's version stamp, and
+    requests whose validators still match get 304 Not Modified without
+    running the view. get_version is called with the view arguments and
+    returns (etag, last_modified), or None if the resource wasn't found. """
+    def decorator(view):
+        @wraps(view)
+        def conditional_view(*args, **kwargs):
+            version = get_version(*args, **kwargs)
+            if version is None:
+                return view(*args, **kwargs)
+            etag, last_modified = version
+            # Stored datetimes are UTC, and HTTP dates have no fractions
+            if last_modified is not None:
+                last_modified = last_modified.replace(
+                    tzinfo=timezone.utc, microsecond=0)
+
+            # If-None-Match takes precedence over If-Modified-Since
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = (
+                    last_modified is not None
+                    and request.if_modified_since is not None
+                    and last_modified <= request.if_modified_since)
+
+            if not_modified:
+                response = Response(status=304)
+            else:
+                # Responses cached by ResponseCache are kept per version
+                g.etag = etag
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            # Caches may store the response but must revalidate it
+            response.cache_control.no_cache = True
+            if private:
+                response.cache_control.private = True
+            return response
+        return conditional_view
+    return decorator
@@ -0,0 +1,153 @@
+import math
+import time
+from flask import current_app as app, g, has_app_context, request
+from flask_jwt_extended import decode_token
+from flask_jwt_extended.exceptions import JWTExtendedException
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from itsdangerous import BadSignature, URLSafeSerializer
+from jwt.exceptions import PyJWTError
+from sqlalchemy import orm
+
+# Name of the bind of the read replica database
+REPLICA_BIND = "replica"
+# Users whose last write is remembered before expired ones are dropped
+MAX_TRACKED_WRITERS = 10000
+# Cookie and header carrying the signed time of a client's last write
+LAST_WRITE_COOKIE = "last_write"
+LAST_WRITE_HEADER = "X-Last-Write"
+
+
+class RoutingSession(SignallingSession):
+    """ Run the reads of requests routed to the replica (see ReplicaRouter)
+    on the replica database, and everything else on the primary """
+
+    def get_bind(self, mapper=None, clause=None):
+        # Flushes and INSERT, UPDATE and DELETE statements always write to
+        # the primary
+        if (has_app_context() and g.get("read_replica")
+                and not self._flushing
+                and not getattr(clause, "is_dml", False)):
+            return get_state(self.app).db.get_engine(
+                self.app, bind=REPLICA_BIND)
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """ Flask-SQLAlchemy with engine options from the DB_* settings and
+    sessions that can read from a replica """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        """ Add the connection pool and statement timeout settings that
+        apply to the engine's database """
+        config = app.config
+        options["pool_pre_ping"] = config.get("DB_POOL_PRE_PING", False)
+        options["pool_recycle"] = config.get("DB_POOL_RECYCLE", -1)
+        # SQLite connections are opened per checkout, so there's no pool
+        # to size (Flask-SQLAlchemy also takes a pool size as a request
+        # to keep SQLite connections open)
+        if sa_url.get_backend_name() != "sqlite":
+            options["pool_size"] = config.get("DB_POOL_SIZE", 5)
+            options["max_overflow"] = config.get("DB_MAX_OVERFLOW", 10)
+            options["pool_timeout"] = config.get("DB_POOL_TIMEOUT", 30)
+        statement_timeout = config.get("DB_STATEMENT_TIMEOUT", 0)
+        if statement_timeout and sa_url.get_backend_name() == "postgresql":
+            options.setdefault("connect_args", {})["options"] = (
+                f"-c statement_timeout={statement_timeout}")
+        return super().apply_driver_hacks(app, sa_url, options)
+
+
+class ReplicaRouter:
+    """ Route the database reads of GET requests to the read replica when
+    one is configured, except for clients who wrote to the primary in the
+    last REPLICA_STICKY_SECONDS, who keep reading from the primary so they
+    see their own changes before the replica catches up. The time of a
+    write is sent back to the client in a signed cookie and header, so any
+    server process can tell the client wrote recently, and also kept in
+    this process by user, for clients that send neither back. """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        # Time of each user's last write by user identity
+        self.last_writes = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        """ Hook into request handling if a replica is configured """
+        self.enabled = REPLICA_BIND in (app.config.get("SQLALCHEMY_BINDS")
+                                        or {})
+        self.sticky_seconds = app.config.get("REPLICA_STICKY_SECONDS", 5)
+        app.extensions["replica_router"] = self
+        if self.enabled:
+            # Last write times are signed so they can't be made up
+            self.serializer = URLSafeSerializer(
+                app.config["JWT_SECRET_KEY"], salt="last-write")
+            app.before_request(self.route_request)
+            app.after_request(self.record_write)
+
+    def route_request(self) -> None:
+        """ Send a GET request's reads to the replica unless its client or
+        user wrote recently """
+        if request.method not in ["GET", "HEAD"]:
+            return
+        identity = self.request_identity()
+        if identity is not None and (
+                time.monotonic() - self.last_writes.get(
+                    identity, float("-inf")) < self.sticky_seconds):
+            return
+        if self.client_wrote_recently():
+            return
+        g.read_replica = True
+
+    def client_wrote_recently(self) -> bool:
+        """ Return whether the request carries the signed time of a write
+        made in the last REPLICA_STICKY_SECONDS """
+        signed_time = (request.headers.get(LAST_WRITE_HEADER)
+                       or request.cookies.get(LAST_WRITE_COOKIE))
+        if not signed_time:
+            return False
+        try:
+            written_at = self.serializer.loads(signed_time)
+        except BadSignature:
+            return False
+        return (isinstance(written_at, (int, float))
+                and time.time() - written_at < self.sticky_seconds)
+
+    def record_write(self, response):
+        """ Remember when the client and user of a successful write request
+        wrote """
+        if (request.method in ["GET", "HEAD", "OPTIONS"]
+                or response.status_code >= 400):
+            return response
+        signed_time = self.serializer.dumps(time.time())
+        response.set_cookie(
+            LAST_WRITE_COOKIE, signed_time,
+            max_age=math.ceil(self.sticky_seconds), httponly=True,
+            samesite="Lax")
+        response.headers[LAST_WRITE_HEADER] = signed_time
+        now = time.monotonic()
+        identity = self.request_identity()
+        if identity is not None:
+            if len(self.last_writes) >= MAX_TRACKED_WRITERS:
+                # Forget the writes that no longer keep users on the primary
+                self.last_writes = {
+                    writer: written_at for writer, written_at
+                    in list(self.last_writes.items())
+                    if now - written_at < self.sticky_seconds}
+            self.last_writes[identity] = now
+        return response
+
+    def request_identity(self):
+        """ Return the identity in the request's access token, or None if
+        it has no valid token (endpoints check tokens themselves) """
+        authorization = request.headers.get("Authorization", "")
+        if not authorization.startswith("Bearer "):
+            return None
+        try:
+            token = decode_token(authorization.removeprefix("Bearer "))
+        except (JWTExtendedException, PyJWTError):
+            return None
+        return token.get(app.config["JWT_IDENTITY_CLAIM"])
@@ -0,0 +1,147 @@
+from math import asin, cos, floor, radians, sin, sqrt
+from sqlalchemy import or_, select
+from app import db
+from app.models.location import Location
+from app.models.question import Question
+
+
+# Mean radius of the Earth used for distances
+EARTH_RADIUS_KM = 6371.0088
+# Kilometres per degree of latitude
+KM_PER_DEGREE = 111.195
+# Size in degrees of the latitude/longitude grid cells locations are
+# bucketed into. Cells are numbered row by row from (-90, -180), so each
+# row of cells is one contiguous range of the indexed grid_cell column.
+GRID_DEGREES = 0.1
+GRID_ROWS = round(180 / GRID_DEGREES)
+GRID_COLUMNS = round(360 / GRID_DEGREES)
+# Locations whose questions are looked up per statement
+NEARBY_LOCATION_BATCH_SIZE = 500
+# Radius in km beyond the start of a page searched first for its nearby
+# questions, doubled until the page is full or the radius is reached
+NEARBY_FIRST_SEARCH_KM = 5
+
+
+def grid_cell(latitude: float | None, longitude: float | None) -> int | None:
+    """ Return the number of the grid cell containing a point """
+    if latitude is None or longitude is None:
+        return None
+    # The north pole belongs to the last row
+    row = min(floor((latitude + 90) / GRID_DEGREES), GRID_ROWS - 1)
+    column = floor((longitude + 180) / GRID_DEGREES) % GRID_COLUMNS
+    return row * GRID_COLUMNS + column
+
+
+def distance_km(latitude1: float, longitude1: float,
+                latitude2: float, longitude2: float) -> float:
+    """ Return the great-circle (haversine) distance between two points """
+    latitude1, longitude1, latitude2, longitude2 = map(
+        radians, [latitude1, longitude1, latitude2, longitude2])
+    a = (sin((latitude2 - latitude1) / 2) ** 2 + cos(latitude1)
+         * cos(latitude2) * sin((longitude2 - longitude1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * asin(min(1.0, sqrt(a)))
+
+
+def grid_cell_ranges(latitude: float, longitude: float,
+                     radius_km: float) -> list:
+    """ Return the (first, last) grid cell ranges covering every point
+    within a radius, one or two per row of cells """
+    latitude_span = radius_km / KM_PER_DEGREE
+    south = max(latitude - latitude_span, -90.0)
+    north = min(latitude + latitude_span, 90.0)
+    # Longitude degrees shrink towards the poles, so the box is widest at
+    # the edge nearest a pole
+    widest = max(abs(south), abs(north))
+    if widest >= 89.9:
+        longitude_span = 180.0
+    else:
+        longitude_span = min(
+            radius_km / (KM_PER_DEGREE * cos(radians(widest))), 180.0)
+
+    first_row = grid_cell(south, 0) // GRID_COLUMNS
+    last_row = grid_cell(north, 0) // GRID_COLUMNS
+    if longitude_span >= 180.0:
+        column_ranges = [(0, GRID_COLUMNS - 1)]
+    else:
+        first_column = grid_cell(0, longitude - longitude_span) % GRID_COLUMNS
+        last_column = grid_cell(0, longitude + longitude_span) % GRID_COLUMNS
+        # Split the columns in two where the box crosses the antimeridian
+        if first_column <= last_column:
+            column_ranges = [(first_column, last_column)]
+        else:
+            column_ranges = [(first_column, GRID_COLUMNS - 1),
+                             (0, last_column)]
+    return [(row * GRID_COLUMNS + first, row * GRID_COLUMNS + last)
+            for row in range(first_row, last_row + 1)
+            for first, last in column_ranges]
+
+
+def nearby_locations(latitude: float, longitude: float,
+                     radius_km: float) -> list:
+    """ Return the (distance, location_id) of every location within a
+    radius of a point, nearest first. Only the locations in the grid cells
+    around the point are read, through the grid_cell index. """
+    candidates = db.session.execute(select(
+        Location.location_id, Location.latitude, Location.longitude
+    ).where(or_(*[
+        Location.grid_cell.between(first, last)
+        for first, last in grid_cell_ranges(latitude, longitude, radius_km)
+    ])))
+    locations = []
+    for location_id, location_latitude, location_longitude in candidates:
+        distance = distance_km(
+            latitude, longitude, location_latitude, location_longitude)
+        if distance <= radius_km:
+            locations.append((distance, location_id))
+    locations.sort()
+    return locations
+
+
+def nearby_questions(latitude: float, longitude: float, radius_km: float,
+                     limit: int, after: tuple | None = None) -> list:
+    """ Return up to limit (distance, location_id, question_id) keys of the
+    questions within a radius of a point, ordered by the distance to their
+    location, then location and question id, starting after the given key.
+    The search starts close to the start of the page and widens until it
+    finds a full page, so a page near the point doesn't read every location
+    in the radius. """
+    start_distance = after[0] if after is not None else 0.0
+    search_radius = min(radius_km, start_distance + NEARBY_FIRST_SEARCH_KM)
+    while True:
+        keys = questions_within(latitude, longitude, search_radius, limit,
+                                after)
+        # Every question further away is beyond the search radius, so a
+        # full page is already the nearest one
+        if len(keys) >= limit or search_radius >= radius_km:
+            return keys[:limit]
+        search_radius = min(radius_km, search_radius * 2)
+
+
+def questions_within(latitude: float, longitude: float, radius_km: float,
+                     limit: int, after: tuple | None) -> list:
+    """ Return at least limit (or all) question keys within a radius, in
+    order, looking up questions for a batch of the nearest locations at a
+    time until there are enough """
+    locations = nearby_locations(latitude, longitude, radius_km)
+    if after is not None:
+        # Skip the locations before the cursor, keeping the location it
+        # stopped at for its remaining questions
+        locations = [(distance, location_id) for distance, location_id
+                     in locations if (distance, location_id) >= after[:2]]
+
+    keys = []
+    for start in range(0, len(locations), NEARBY_LOCATION_BATCH_SIZE):
+        batch = {location_id: distance for distance, location_id
+                 in locations[start:start + NEARBY_LOCATION_BATCH_SIZE]}
+        query = select(Question.location_id, Question.question_id).where(
+            Question.location_id.in_(batch))
+        if after is not None and after[1] in batch:
+            query = query.where(or_(
+                Question.location_id != after[1],
+                Question.question_id > after[2]))
+        keys.extend(sorted(
+            (batch[location_id], location_id, question_id)
+            for location_id, question_id in db.session.execute(query)))
+        if len(keys) >= limit:
+            break
+    return keys
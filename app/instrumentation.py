@@ -0,0 +1,157 @@
+from functools import wraps
+import json
+import logging
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.schemas.compiled_schema import dump_wrappers
+
+
+class RequestStats:
+    """ Database and serialisation measurements of one request """
+    __slots__ = ["started_at", "queries", "db_time", "rows",
+                 "serialise_time", "serialising", "statement_started_at"]
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.serialise_time = 0.0
+        self.serialising = False
+        self.statement_started_at = None
+
+    def as_dict(self) -> dict:
+        """ Return the measurements, with times in milliseconds """
+        return {
+            "queries": self.queries,
+            "db_ms": round(self.db_time * 1000, 3),
+            "rows": self.rows,
+            "serialize_ms": round(self.serialise_time * 1000, 3),
+            "total_ms": round(
+                (time.perf_counter() - self.started_at) * 1000, 3),
+        }
+
+
+def current_stats() -> RequestStats | None:
+    """ Return the measurements of the current request, if it has any """
+    return g.get("request_stats") if has_request_context() else None
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    stats = current_stats()
+    if stats is not None:
+        stats.statement_started_at = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    stats = current_stats()
+    if stats is not None and stats.statement_started_at is not None:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - stats.statement_started_at
+        stats.statement_started_at = None
+        # Drivers report -1 when they don't know the row count (SQLite
+        # only counts the rows a write changed, psycopg2 also counts the
+        # rows a SELECT returned)
+        if cursor.rowcount > 0:
+            stats.rows += cursor.rowcount
+
+
+def timed_serialisation(function):
+    """ Decorate a function that serialises responses so the time it takes
+    is added to the current request's measurements, counting calls made
+    from within another timed call only once """
+    @wraps(function)
+    def timed(*args, **kwargs):
+        stats = current_stats()
+        if stats is None or stats.serialising:
+            return function(*args, **kwargs)
+        stats.serialising = True
+        started_at = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stats.serialise_time += time.perf_counter() - started_at
+            stats.serialising = False
+    return timed
+
+
+@timed_serialisation
+def timed_dump(dump, obj, many: bool):
+    """ Call a schema's dump function, timing it """
+    return dump(obj, many)
+
+
+class RequestInstrumentation:
+    """ Measure the SQL statements, database time, rows and serialisation
+    time of each request, and report them in Server-Timing and
+    X-Query-Count response headers and a JSON log line. Nothing is hooked
+    in unless the INSTRUMENTATION setting is on, so it costs nothing when
+    it's off. """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        """ Hook into the engine events, request handling and serialisation
+        if instrumentation is turned on in the app configuration """
+        self.enabled = app.config.get("INSTRUMENTATION", False)
+        app.extensions["instrumentation"] = self
+        if not self.enabled:
+            return
+
+        # Listen to every engine, only recording statements in requests
+        if not event.contains(
+                Engine, "before_cursor_execute", before_cursor_execute):
+            event.listen(
+                Engine, "before_cursor_execute", before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+
+        # Time this app's schema dumps and JSON encoding, leaving other
+        # apps' as they are
+        dump_wrappers[app] = timed_dump
+        app.json.dumps = timed_serialisation(app.json.dumps)
+
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        # Log lines are written at INFO level
+        if app.logger.level == logging.NOTSET:
+            app.logger.setLevel(logging.INFO)
+        self.logger = app.logger
+
+    def start_request(self) -> None:
+        g.request_stats = RequestStats()
+
+    def finish_request(self, response):
+        """ Add the measurements so far to the response headers, and log
+        them all once the response has been sent (streamed responses keep
+        querying and serialising while they're sent) """
+        stats = g.get("request_stats")
+        if stats is None:
+            return response
+        measurements = stats.as_dict()
+        response.headers["X-Query-Count"] = str(measurements["queries"])
+        response.headers["Server-Timing"] = (
+            f"db;dur={measurements['db_ms']};"
+            f"desc=\"{measurements['queries']} queries, "
+            f"{measurements['rows']} rows\", "
+            f"serialize;dur={measurements['serialize_ms']}, "
+            f"total;dur={measurements['total_ms']}")
+
+        log_fields = {
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+        }
+
+        def log_request():
+            line = log_fields | stats.as_dict()
+            self.logger.info(json.dumps(line), extra={"request_stats": line})
+        response.call_on_close(log_request)
+        return response
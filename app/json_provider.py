@@ -0,0 +1,62 @@
+import codecs
+from flask.json.provider import DefaultJSONProvider
+import orjson
+
+COMPACT_SEPARATORS = (",", ":")
+# Digits mapped to 0 and the characters that can start a value mapped to
+# a comma, to look for floats orjson formats differently
+NUMBER_PATTERNS = bytes.maketrans(b"123456789:[-", b"000000000,,,")
+
+
+def escape_non_ascii(error):
+    """ Encoding error handler returning the \\u escapes the json module
+    writes for characters outside ASCII, as surrogate pairs outside the
+    Basic Multilingual Plane """
+    escapes = []
+    for character in error.object[error.start:error.end]:
+        code = ord(character)
+        if code < 0x10000:
+            escapes.append(f"\\u{code:04x}")
+        else:
+            code -= 0x10000
+            escapes.append(
+                f"\\u{0xd800 | code >> 10:04x}\\u{0xdc00 | code & 0x3ff:04x}")
+    return "".join(escapes), error.end
+
+
+codecs.register_error("json_escape", escape_non_ascii)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """ Encode compact JSON responses with orjson, falling back to the json
+    module whenever orjson's output could differ from it, so responses are
+    the same bytes either way (except NaN and infinity, which aren't valid
+    JSON and are written as null) """
+
+    def dumps(self, obj, **kwargs) -> str:
+        # Only compact output (as in responses outside debug mode) matches
+        if (kwargs == {"separators": COMPACT_SEPARATORS}
+                and self.ensure_ascii and self.sort_keys):
+            try:
+                # Types orjson doesn't handle the way the json module does
+                # are passed through to the default function
+                encoded = orjson.dumps(
+                    obj, default=self.default, option=orjson.OPT_SORT_KEYS
+                    | orjson.OPT_PASSTHROUGH_DATETIME
+                    | orjson.OPT_PASSTHROUGH_DATACLASS)
+            except (orjson.JSONEncodeError, TypeError):
+                # e.g. integers over 64 bits or keys that aren't strings
+                encoded = None
+
+            # Leave floats with exponents (1e-7 rather than 1e-07) and
+            # small floats (0.00001 rather than 1e-05) to the json module.
+            # Strings that look like them only cost the fallback.
+            if encoded is not None:
+                numbers = encoded.translate(NUMBER_PATTERNS)
+                if not (b"0e" in numbers or b",0.0000" in numbers
+                        or numbers.startswith(b"0.0000")):
+                    # Escape characters outside ASCII like the json module
+                    return encoded.decode("utf-8").encode(
+                        "ascii", "json_escape").decode("ascii").replace(
+                            "\x7f", "\\u007f")
+        return super().dumps(obj, **kwargs)
@@ -0,0 +1,150 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from threading import Lock
+import time
+from flask import current_app as app
+from sqlalchemy import select
+from app import db
+from app.models.location import Location
+from app.reference_data import normalise_name
+
+
+# Read-only copy of a location row, safe to share between requests
+LocationRecord = namedtuple(
+    "LocationRecord",
+    ["location_id", "country_code", "state", "postcode", "suburb"])
+
+
+class LocationIndex:
+    """ A sorted array of the normalised suburb names and postcodes of every
+    location, with the location_id of each in a parallel array, so a
+    prefix lookup is a binary search followed by a short scan. Indexes are
+    never changed once built: new locations are added to a copy. """
+
+    def __init__(self, keys: list, location_ids: array, records_by_id: dict,
+                 scanned_up_to: int):
+        self.keys = keys
+        self.location_ids = location_ids
+        self.records_by_id = records_by_id
+        # Every location up to this id has been read from the database
+        self.scanned_up_to = scanned_up_to
+
+    @classmethod
+    def build(cls, records: list) -> "LocationIndex":
+        """ Return an index of every location """
+        entries = sorted(
+            entry for record in records for entry in index_entries(record))
+        return cls(
+            [key for key, _ in entries],
+            array("l", [location_id for _, location_id in entries]),
+            {record.location_id: record for record in records},
+            max((record.location_id for record in records), default=0))
+
+    def with_locations(self, records: list,
+                       scanned_up_to: int = None) -> "LocationIndex":
+        """ Return a copy of the index with more locations added """
+        records = [record for record in records
+                   if record.location_id not in self.records_by_id]
+        scanned_up_to = max(self.scanned_up_to, scanned_up_to or 0)
+        # Indexes share their arrays until they have something to add
+        if not records:
+            return LocationIndex(self.keys, self.location_ids,
+                                 self.records_by_id, scanned_up_to)
+        keys, location_ids = list(self.keys), array("l", self.location_ids)
+        records_by_id = dict(self.records_by_id)
+        for record in records:
+            records_by_id[record.location_id] = record
+            for key, location_id in index_entries(record):
+                position = bisect_right(keys, key)
+                keys.insert(position, key)
+                location_ids.insert(position, location_id)
+        return LocationIndex(keys, location_ids, records_by_id, scanned_up_to)
+
+    def suggest(self, prefix: str, limit: int) -> list:
+        """ Return up to limit locations whose suburb name or postcode
+        starts with the prefix, in alphabetical order """
+        prefix = normalise_name(prefix)
+        if not prefix:
+            return []
+        location_ids = []
+        seen = set()
+        position = bisect_left(self.keys, prefix)
+        while (position < len(self.keys) and len(location_ids) < limit
+               and self.keys[position].startswith(prefix)):
+            location_id = self.location_ids[position]
+            # A location can match by both its name and its postcode
+            if location_id not in seen:
+                seen.add(location_id)
+                location_ids.append(location_id)
+            position += 1
+        return [self.records_by_id[location_id]
+                for location_id in location_ids]
+
+
+def index_entries(record: LocationRecord) -> list:
+    """ Return the (key, location_id) entries of a location in the index """
+    return [(normalise_name(record.suburb), record.location_id),
+            (normalise_name(record.postcode), record.location_id)]
+
+
+class LocationIndexCache:
+    """ Keep one location index per worker, built on its first use and
+    extended with the locations added since, which are checked for at most
+    every LOCATION_INDEX_CHECK_INTERVAL seconds """
+
+    def __init__(self):
+        self.index = None
+        self.checked_at = 0.0
+        self.lock = Lock()
+
+    def get(self) -> LocationIndex:
+        """ Return the current index, loading it or new locations if
+        needed """
+        interval = app.config.get("LOCATION_INDEX_CHECK_INTERVAL", 30)
+        if (self.index is not None
+                and time.monotonic() - self.checked_at < interval):
+            return self.index
+
+        with self.lock:
+            # Another thread may have checked while this one waited
+            if (self.index is not None
+                    and time.monotonic() - self.checked_at < interval):
+                return self.index
+            if self.index is None:
+                self.index = LocationIndex.build(load_locations())
+            else:
+                # Add the locations other workers have created since
+                records = load_locations(after_id=self.index.scanned_up_to)
+                self.index = self.index.with_locations(records, max(
+                    (record.location_id for record in records), default=0))
+            self.checked_at = time.monotonic()
+            return self.index
+
+    def add(self, *records: LocationRecord) -> None:
+        """ Add locations this worker has just created (or found) to its
+        index straight away, if the index has been built """
+        with self.lock:
+            if self.index is not None and records:
+                self.index = self.index.with_locations(list(records))
+
+    def clear(self) -> None:
+        """ Rebuild the index on its next use in this worker """
+        with self.lock:
+            self.index = None
+
+
+def load_locations(after_id: int = None) -> list:
+    """ Read every location from the database, or those added after a
+    location_id """
+    # Select the table's columns, which skips the ORM's row processing
+    locations = Location.__table__
+    query = select(
+        locations.c.location_id, locations.c.country_code, locations.c.state,
+        locations.c.postcode, locations.c.suburb)
+    if after_id is not None:
+        query = query.where(locations.c.location_id > after_id)
+    return [LocationRecord(*row) for row in db.session.execute(query)]
+
+
+location_index = LocationIndexCache()
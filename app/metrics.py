@@ -0,0 +1,288 @@
+import atexit
+from bisect import bisect_left
+from functools import wraps
+import json
+import os
+from threading import Lock, local
+import time
+from uuid import uuid4
+from flask import g, request
+from sqlalchemy import event
+
+# Upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75,
+                   1.0, 2.5, 5.0, 7.5, 10.0)
+# Upper bounds in seconds of the pool checkout wait histogram buckets
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1,
+                     0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Metrics by name: type, help text and histogram buckets
+METRICS = {
+    "http_requests_total": (
+        "counter", "Requests handled, by endpoint, method and status.", None),
+    "http_request_duration_seconds": (
+        "histogram", "Time taken to handle requests, by endpoint and method.",
+        LATENCY_BUCKETS),
+    "http_requests_in_flight": (
+        "gauge", "Requests being handled.", None),
+    "db_pool_checkout_wait_seconds": (
+        "histogram", "Time taken to get a database connection from the "
+        "pool, including opening one, by database.", POOL_WAIT_BUCKETS),
+}
+
+
+class MetricShard:
+    """ The metric values recorded by one thread. Only the owning thread
+    writes to a shard, so recording takes no lock. """
+    __slots__ = ["values", "histograms"]
+
+    def __init__(self):
+        # Counter and gauge values by (name, labels)
+        self.values = {}
+        # Histogram bucket counts (not cumulative), then the count above
+        # the last bucket, then the sum of observations, by (name, labels)
+        self.histograms = {}
+
+
+class RequestMetrics:
+    """ Count requests by endpoint, method and status, and record request
+    latency and database pool checkout wait histograms, reported at
+    /metrics in the Prometheus text format. With METRICS_MULTIPROCESS_DIR
+    set, each worker process writes its metrics to that directory every
+    METRICS_FLUSH_INTERVAL seconds, and /metrics reports them all. """
+
+    def __init__(self, app=None):
+        self.local = local()
+        # Every thread's shard, added to under the lock once per thread
+        self.shards = []
+        self.shards_lock = Lock()
+        self.flush_lock = Lock()
+        self.last_flush = 0.0
+        self.multiprocess_dir = None
+        self.file_pid = None
+        self.file_name = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        """ Hook into request handling and the database pool, and set up
+        multi-process mode if it's configured """
+        self.multiprocess_dir = app.config.get("METRICS_MULTIPROCESS_DIR")
+        self.flush_interval = app.config.get("METRICS_FLUSH_INTERVAL", 5)
+        if self.multiprocess_dir:
+            os.makedirs(self.multiprocess_dir, exist_ok=True)
+            # Workers leave their final counts when they exit
+            atexit.register(self.flush, exiting=True)
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.extensions["metrics"] = self
+
+        # Time the pool checkouts of the app's engines (the primary and
+        # any binds, like the read replica), again whenever one is disposed
+        # and gets a new pool
+        from app import db
+        with app.app_context():
+            for bind in [None, *(app.config.get("SQLALCHEMY_BINDS") or {})]:
+                engine = db.get_engine(bind=bind)
+                database = bind or "primary"
+                self.time_pool_checkouts(engine, database)
+                event.listen(
+                    engine, "engine_disposed",
+                    lambda engine, database=database:
+                        self.time_pool_checkouts(engine, database))
+
+    def shard(self) -> MetricShard:
+        """ Return the current thread's shard, creating it on first use """
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            shard = self.local.shard = MetricShard()
+            with self.shards_lock:
+                self.shards.append(shard)
+        return shard
+
+    def inc(self, name: str, labels: tuple = (), amount: float = 1) -> None:
+        """ Add to a counter or gauge """
+        values = self.shard().values
+        key = (name, labels)
+        values[key] = values.get(key, 0) + amount
+
+    def observe(self, name: str, labels: tuple, value: float) -> None:
+        """ Record an observation in a histogram """
+        histograms = self.shard().histograms
+        key = (name, labels)
+        counts = histograms.get(key)
+        buckets = METRICS[name][2]
+        if counts is None:
+            counts = histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+        counts[bisect_left(buckets, value)] += 1
+        counts[-1] += value
+
+    def time_pool_checkouts(self, engine, database: str) -> None:
+        """ Wrap the connect method of an engine's pool to record how long
+        each checkout waits """
+        pool = engine.pool
+        connect = pool.connect
+
+        @wraps(connect)
+        def timed_connect():
+            started_at = time.perf_counter()
+            try:
+                return connect()
+            finally:
+                self.observe("db_pool_checkout_wait_seconds",
+                             (("database", database),),
+                             time.perf_counter() - started_at)
+        pool.connect = timed_connect
+
+    def start_request(self) -> None:
+        g.metrics_started_at = time.perf_counter()
+        self.inc("http_requests_in_flight")
+
+    def finish_request(self, response):
+        """ Record the request's status and latency """
+        started_at = g.pop("metrics_started_at", None)
+        if started_at is None:
+            return response
+        endpoint = request.endpoint or "none"
+        self.inc("http_requests_in_flight", amount=-1)
+        self.inc("http_requests_total", (
+            ("endpoint", endpoint), ("method", request.method),
+            ("status", str(response.status_code))))
+        self.observe("http_request_duration_seconds", (
+            ("endpoint", endpoint), ("method", request.method)),
+            time.perf_counter() - started_at)
+        if (self.multiprocess_dir and time.monotonic() - self.last_flush
+                >= self.flush_interval):
+            self.flush()
+        return response
+
+    def snapshot(self) -> dict:
+        """ Return the values of every thread's shard added together """
+        with self.shards_lock:
+            shards = list(self.shards)
+        values, histograms = {}, {}
+        for shard in shards:
+            # Copying a dict or list is atomic, so the owning thread can
+            # keep recording while shards are read
+            for key, value in dict(shard.values).items():
+                values[key] = values.get(key, 0) + value
+            for key, counts in dict(shard.histograms).items():
+                merge_counts(histograms, key, list(counts))
+        return {"values": values, "histograms": histograms}
+
+    def own_file(self) -> str:
+        """ Return the name of the file this process writes its metrics
+        to, made unique so a later process given the same pid doesn't
+        replace an exited worker's counts, and chosen again in a process
+        forked after init_app """
+        if self.file_pid != os.getpid():
+            self.file_pid = os.getpid()
+            self.file_name = f"metrics_{self.file_pid}_{uuid4().hex}.json"
+        return self.file_name
+
+    def flush(self, exiting: bool = False) -> None:
+        """ Write this process's metrics to the multi-process directory,
+        unless another thread is already writing them """
+        if not self.flush_lock.acquire(blocking=False):
+            return
+        try:
+            self.last_flush = time.monotonic()
+            snapshot = self.snapshot()
+            if exiting:
+                # An exited worker has no requests in flight
+                snapshot["values"].pop(("http_requests_in_flight", ()), None)
+            path = os.path.join(self.multiprocess_dir, self.own_file())
+            # Replace the file in one step so readers never see half of it
+            with open(path + ".tmp", "w", encoding="utf-8") as file:
+                json.dump({
+                    "values": [[name, labels, value] for (name, labels), value
+                               in snapshot["values"].items()],
+                    "histograms": [[name, labels, counts] for (name, labels),
+                                   counts in snapshot["histograms"].items()],
+                }, file)
+            os.replace(path + ".tmp", path)
+        finally:
+            self.flush_lock.release()
+
+    def collect(self) -> dict:
+        """ Return this process's metrics, with those written by the other
+        worker processes added in multi-process mode """
+        snapshot = self.snapshot()
+        if not self.multiprocess_dir:
+            return snapshot
+        own_file = self.own_file()
+        for file_name in os.listdir(self.multiprocess_dir):
+            if file_name == own_file or not file_name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.multiprocess_dir, file_name),
+                          encoding="utf-8") as file:
+                    written = json.load(file)
+            except (OSError, ValueError):
+                continue
+            values = snapshot["values"]
+            for name, labels, value in written["values"]:
+                key = (name, tuple(map(tuple, labels)))
+                values[key] = values.get(key, 0) + value
+            for name, labels, counts in written["histograms"]:
+                merge_counts(snapshot["histograms"],
+                             (name, tuple(map(tuple, labels))), counts)
+        return snapshot
+
+    def render(self) -> str:
+        """ Return every metric in the Prometheus text exposition format """
+        snapshot = self.collect()
+        lines = []
+        for name, (metric_type, help_text, buckets) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if metric_type == "histogram":
+                for (metric_name, labels), counts in sorted(
+                        snapshot["histograms"].items()):
+                    if metric_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(
+                            [*map(str, buckets), "+Inf"], counts):
+                        cumulative += count
+                        lines.append(
+                            f"{name}_bucket"
+                            f"{format_labels(labels + (('le', bound),))} "
+                            f"{cumulative}")
+                    lines.append(
+                        f"{name}_sum{format_labels(labels)} {counts[-1]}")
+                    lines.append(
+                        f"{name}_count{format_labels(labels)} {cumulative}")
+            else:
+                values = {labels: value for (metric_name, labels), value
+                          in snapshot["values"].items() if metric_name == name}
+                # Gauges without labels are reported even when unset
+                if metric_type == "gauge" and not values:
+                    values[()] = 0
+                for labels, value in sorted(values.items()):
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def merge_counts(histograms: dict, key: tuple, counts: list) -> None:
+    """ Add histogram counts to those already merged under a key """
+    merged = histograms.get(key)
+    if merged is None:
+        histograms[key] = counts
+    else:
+        for index, count in enumerate(counts):
+            merged[index] += count
+
+
+def format_labels(labels: tuple) -> str:
+    """ Return labels as {name="value",...}, escaping the values """
+    if not labels:
+        return ""
+    return "{" + ",".join(
+        f"{name}=\"{escape_label_value(value)}\"" for name, value in labels
+    ) + "}"
+
+
+def escape_label_value(value: str) -> str:
+    return (value.replace("\\", "\\\\").replace("\"", "\\\"")
+            .replace("\n", "\\n"))
@@ -0,0 +1,58 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
+
+
+class PasswordHasherBusy(Exception):
+    """ Raised when too many password hashes are already running or
+    waiting, so the request should be retried later """
+
+
+class PasswordHasher:
+    """ Run bcrypt hashing and checking on a small dedicated thread pool,
+    so a burst of logins can only occupy PASSWORD_HASH_WORKERS threads and
+    requests beyond the queue limit fail fast instead of piling up """
+
+    def __init__(self, bcrypt, app=None):
+        self.bcrypt = bcrypt
+        self.executor = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        """ Create the thread pool and queue limit from the app config """
+        workers = app.config.get("PASSWORD_HASH_WORKERS", 2)
+        max_queue = app.config.get("PASSWORD_HASH_MAX_QUEUE", 16)
+        self.log_rounds = app.config.get("BCRYPT_LOG_ROUNDS", 12)
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="password-hash")
+        # One slot for each running or waiting hash
+        self.slots = BoundedSemaphore(workers + max_queue)
+        app.extensions["password_hasher"] = self
+
+    def run(self, function, *args):
+        """ Run a hashing function on the pool and wait for its result,
+        or raise PasswordHasherBusy if the queue is full """
+        if not self.slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        try:
+            return self.executor.submit(function, *args).result()
+        finally:
+            self.slots.release()
+
+    def generate(self, password: str) -> str:
+        """ Return the bcrypt hash of a password at the configured cost """
+        return self.run(
+            self.bcrypt.generate_password_hash, password).decode("utf-8")
+
+    def check(self, password_hash: str, password: str) -> bool:
+        """ Return whether a password matches a stored bcrypt hash """
+        return self.run(self.bcrypt.check_password_hash, password_hash,
+                        password)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """ Return whether a stored hash ($2b$<cost>$...) was made with a
+        different cost than the configured BCRYPT_LOG_ROUNDS """
+        try:
+            return int(password_hash.split("$")[2]) != self.log_rounds
+        except (IndexError, ValueError):
+            return True
@@ -0,0 +1,127 @@
+from collections import namedtuple
+from threading import Lock
+from types import MappingProxyType
+import time
+import uuid
+from flask import current_app as app
+from sqlalchemy import insert, select, update
+from app import db, cache
+from app.models.category import Category
+from app.models.country import Country
+from app.models.reference_version import ReferenceVersion
+
+
+# Name of the reference_versions row shared by categories and countries
+REFERENCE_DATA_VERSION = "reference_data"
+
+# Read-only copies of reference rows, safe to share between requests
+CategoryRecord = namedtuple(
+    "CategoryRecord", ["category_id", "category_name", "description"])
+CountryRecord = namedtuple("CountryRecord", ["country_code", "country"])
+
+
+def normalise_name(name: str) -> str:
+    """ Return a name in the form used as a lookup key, ignoring case and
+    repeated whitespace """
+    return " ".join(name.split()).casefold()
+
+
+class ReferenceData:
+    """ Immutable lookup maps of the categories and countries loaded at a
+    given reference data version """
+
+    def __init__(self, version: str | None, categories: list,
+                 countries: list):
+        self.version = version
+        self.categories = tuple(categories)
+        self.categories_by_id = MappingProxyType(
+            {category.category_id: category for category in categories})
+        self.categories_by_name = MappingProxyType(
+            {normalise_name(category.category_name): category
+             for category in categories})
+        self.countries_by_code = MappingProxyType(
+            {country.country_code: country for country in countries})
+
+    def category(self, category_id: int = None,
+                 category_name: str = None) -> CategoryRecord | None:
+        """ Return a category by id or name, or None if there isn't one """
+        if category_id is not None:
+            return self.categories_by_id.get(category_id)
+        return self.categories_by_name.get(normalise_name(category_name))
+
+    def country(self, country_code: str) -> CountryRecord | None:
+        """ Return a country by its ISO 3166-1 alpha-2 code, or None """
+        return self.countries_by_code.get(country_code.upper())
+
+
+class ReferenceDataCache:
+    """ Keep one copy of the reference data per worker, reloading it when
+    the version in the database has changed. The version is checked at
+    most every REFERENCE_DATA_CHECK_INTERVAL seconds. """
+
+    def __init__(self):
+        self.data = None
+        self.checked_at = 0.0
+        self.lock = Lock()
+
+    def get(self) -> ReferenceData:
+        """ Return the current reference data, loading it if needed """
+        interval = app.config.get("REFERENCE_DATA_CHECK_INTERVAL", 30)
+        if (self.data is not None
+                and time.monotonic() - self.checked_at < interval):
+            return self.data
+
+        with self.lock:
+            # Another thread may have checked while this one waited
+            if (self.data is not None
+                    and time.monotonic() - self.checked_at < interval):
+                return self.data
+            version = db.session.scalar(
+                select(ReferenceVersion.version).where(
+                    ReferenceVersion.name == REFERENCE_DATA_VERSION))
+            if self.data is None or self.data.version != version:
+                self.data = load_reference_data(version)
+            self.checked_at = time.monotonic()
+            return self.data
+
+    def clear(self) -> None:
+        """ Reload the reference data on its next use in this worker """
+        with self.lock:
+            self.data = None
+
+
+def load_reference_data(version: str | None) -> ReferenceData:
+    """ Read all categories and countries from the database """
+    categories = [
+        CategoryRecord(*row) for row in db.session.execute(select(
+            Category.category_id, Category.category_name,
+            Category.description).order_by(Category.category_id))]
+    countries = [
+        CountryRecord(*row) for row in db.session.execute(select(
+            Country.country_code, Country.country))]
+    return ReferenceData(version, categories, countries)
+
+
+def bump_reference_version() -> None:
+    """ Give the reference data a new version, so every worker reloads it
+    (and stops using the responses it cached with the old version, see
+    reference_version) the next time it checks """
+    version = uuid.uuid4().hex
+    updated = db.session.execute(update(ReferenceVersion).where(
+        ReferenceVersion.name == REFERENCE_DATA_VERSION
+    ).values(version=version))
+    if not updated.rowcount:
+        db.session.execute(insert(ReferenceVersion).values(
+            name=REFERENCE_DATA_VERSION, version=version))
+    db.session.commit()
+    reference_data.clear()
+    cache.invalidate("categories")
+
+
+def reference_version() -> str:
+    """ Return the version of the reference data this worker is using, to
+    cache the responses built from it under """
+    return str(reference_data.get().version)
+
+
+reference_data = ReferenceDataCache()
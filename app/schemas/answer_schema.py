@@ -1,24 +1,27 @@
 from app import ma
 from marshmallow import fields, validate
+from sqlalchemy.orm import joinedload
 from app.models.answer import Answer
 from app.models.recommendation import Recommendation
+from app.schemas.compiled_schema import CompiledDumpMixin
 from app.schemas.user_schema import UserSchema
 from app.schemas.category_schema import CategorySchema
 
 
-class AnswerSchema(ma.SQLAlchemyAutoSchema):
+class AnswerSchema(CompiledDumpMixin, ma.SQLAlchemyAutoSchema):
     class Meta:
         model = Answer
         include_fk = True
         dump_only = ["question_id", "date_time"]
         load_only = ["user_id", "username"]
+        exclude = ["recommendation_count", "content_hash"]
     answer = fields.String(required=True, validate=validate.Length(min=20))
     recommendations = fields.Method("get_recommendation_count")
     author = fields.Nested(UserSchema(only=["user_id", "username"]))
 
     def get_recommendation_count(self, obj):
         """ Return the number of recommendations an answer has received """
-        return len(obj.recommendations)
+        return obj.recommendation_count
 
 
 class AnswerRepliesSchema(AnswerSchema):
@@ -37,3 +40,9 @@ answer_schema = AnswerSchema()
 answer_details_schema = AnswerDetailsSchema()
 answers_details_schema = AnswerDetailsSchema(many=True)
 answers_schema = AnswerSchema(many=True)
+
+# Eager load the relationships AnswerSchema serialises, so dumping a list
+# of answers takes the same number of queries whatever its length
+answers_schema_options = [
+    joinedload(Answer.author),
+]
@@ -1,9 +1,10 @@
 from app import ma
 from marshmallow import fields
 from app.models.category import Category
+from app.schemas.compiled_schema import CompiledDumpMixin
 
 
-class CategorySchema(ma.SQLAlchemyAutoSchema):
+class CategorySchema(CompiledDumpMixin, ma.SQLAlchemyAutoSchema):
     class Meta:
         model = Category
         include_fk = True
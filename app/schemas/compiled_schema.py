@@ -0,0 +1,184 @@
+from functools import partial
+from operator import attrgetter, itemgetter, methodcaller
+from weakref import WeakKeyDictionary
+from flask import current_app, has_app_context
+from marshmallow import Schema, fields, missing
+from marshmallow.decorators import POST_DUMP, PRE_DUMP
+from marshmallow.utils import ensure_text_type
+from sqlalchemy import inspect
+from sqlalchemy.orm import QueryableAttribute
+
+# Dumps a datetime in ISO 8601 format, as fields.DateTime does by default
+isoformat = methodcaller("isoformat")
+# Functions apps call each schema dump through, by app, e.g. to time them
+# (see RequestInstrumentation). Dumps only look up the current app while
+# an app has one.
+dump_wrappers = WeakKeyDictionary()
+
+
+class CompiledDumpMixin:
+    """ Dump objects with a function built from the schema's fields for each
+    object class, giving the same output as Schema.dump without its
+    per-field dispatch. Fields without a fast path are still serialised by
+    the field itself. """
+
+    def _init_fields(self) -> None:
+        super()._init_fields()
+        # Dump functions by object class, built again whenever the
+        # fields change (nested schemas are copies with their own fields)
+        self._dump_functions = {}
+
+    def _compilable(self) -> bool:
+        """ Return whether the schema's output only depends on its fields,
+        so it can be compiled """
+        return not (self._has_processors(PRE_DUMP)
+                    or self._has_processors(POST_DUMP)
+                    or type(self).get_attribute is not Schema.get_attribute)
+
+    def dump(self, obj, *, many: bool | None = None):
+        many = self.many if many is None else bool(many)
+        if dump_wrappers and has_app_context():
+            wrapper = dump_wrappers.get(current_app._get_current_object())
+            if wrapper is not None:
+                return wrapper(self._dump, obj, many)
+        return self._dump(obj, many)
+
+    def _dump(self, obj, many: bool):
+        """ Dump an object, or a list of objects if many is True """
+        if obj is None or not self._compilable():
+            return super().dump(obj, many=many)
+        dump_functions = self._dump_functions
+        if many:
+            return [(dump_functions.get(type(item))
+                     or self._dump_function(type(item)))(item)
+                    for item in obj]
+        return (dump_functions.get(type(obj))
+                or self._dump_function(type(obj)))(obj)
+
+    def _dump_function(self, cls):
+        """ Return the dump function for objects of a class, building it on
+        first use """
+        dump_function = self._dump_functions.get(cls)
+        if dump_function is None:
+            dump_function = self._dump_functions[cls] = self._compile(cls)
+        return dump_function
+
+    def _compile(self, cls):
+        """ Return a function returning the dumped dict of an object of the
+        given class, which reads and converts each field as the field's
+        class would """
+        # Objects read by key rather than attribute take the general path
+        if hasattr(cls, "__getitem__") and not issubclass(cls, tuple):
+            return lambda obj: super(CompiledDumpMixin, self).dump(
+                obj, many=False)
+
+        attributes, converters, methods, serializers = [], [], [], []
+        for field_name, field in self.dump_fields.items():
+            key = field.data_key if field.data_key is not None else field_name
+            attribute = (
+                field.attribute if field.attribute is not None else field_name)
+            convert = None
+            if type(field) is fields.Method and field.serialize_method_name:
+                methods.append(
+                    (key, getattr(self, field.serialize_method_name)))
+                continue
+            # Attributes the class doesn't define may be missing from the
+            # object, which Schema.dump leaves out of the result
+            if (attribute.isidentifier() and field.dump_default is missing
+                    and hasattr(cls, attribute)):
+                convert = field_converter(field)
+            if convert is not None:
+                attributes.append(attribute)
+                converters.append((key, convert))
+            else:
+                # Let the field serialise itself, leaving the key out if
+                # it returns missing
+                serializers.append((key, partial(
+                    field.serialize, field_name,
+                    accessor=self.get_attribute)))
+
+        # Read every attribute with one call. Loaded columns and
+        # relationships of mapped classes are read from the object's
+        # __dict__, skipping the SQLAlchemy attribute lookup, unless one
+        # of them isn't loaded.
+        read_attributes = tuple_getter(attrgetter, attributes)
+        read_loaded = None
+        if inspect(cls, raiseerr=False) is not None and all(
+                isinstance(getattr(cls, attribute), QueryableAttribute)
+                for attribute in attributes):
+            read_loaded = tuple_getter(itemgetter, attributes)
+
+        def dump(obj):
+            if read_loaded is None:
+                values = read_attributes(obj)
+            else:
+                try:
+                    values = read_loaded(obj.__dict__)
+                except KeyError:
+                    # Let SQLAlchemy load the attributes that aren't loaded
+                    values = read_attributes(obj)
+            result = {}
+            for (key, convert), value in zip(converters, values):
+                # Strings are kept as they are without calling text()
+                result[key] = (
+                    None if value is None else value
+                    if convert is text and type(value) is str
+                    else convert(value))
+            for key, method in methods:
+                result[key] = method(obj)
+            for key, serialize in serializers:
+                value = serialize(obj)
+                if value is not missing:
+                    result[key] = value
+            return result
+        return dump
+
+
+def tuple_getter(getter, names: list):
+    """ Return a function reading the named attributes or keys (with
+    attrgetter or itemgetter) of an object as a tuple """
+    if not names:
+        return lambda obj: ()
+    if len(names) == 1:
+        get_one = getter(names[0])
+        return lambda obj: (get_one(obj),)
+    return getter(*names)
+
+
+def text(value) -> str:
+    """ Dump a value as a string, as fields.String does """
+    return value if type(value) is str else ensure_text_type(value)
+
+
+def field_converter(field):
+    """ Return a function dumping a field's value (other than None) as the
+    field would, or None if the field has no fast path """
+    field_type = type(field)
+    if field_type is fields.Integer and not field.as_string:
+        return int
+    if field_type is fields.Float and not field.as_string:
+        return float
+    if field_type is fields.String:
+        return text
+    if field_type is fields.DateTime and field.format in [None, "iso"]:
+        return isoformat
+    if field_type is not fields.Nested:
+        return None
+
+    nested_schema = field.schema
+    many = nested_schema.many or field.many
+    if not (isinstance(nested_schema, CompiledDumpMixin)
+            and nested_schema._compilable()):
+        return partial(nested_schema.dump, many=many)
+    # Call the nested schema's dump functions directly
+    dump_functions = nested_schema._dump_functions
+    dump_function = nested_schema._dump_function
+    if many:
+        def dump(value):
+            return [(dump_functions.get(type(item))
+                     or dump_function(type(item)))(item) for item in value]
+    else:
+        def dump(value):
+            return (dump_functions.get(type(value))
+                    or dump_function(type(value)))(value)
+    return dump
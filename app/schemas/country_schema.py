@@ -1,9 +1,10 @@
 from app import ma
 from marshmallow import fields
 from app.models.country import Country
+from app.schemas.compiled_schema import CompiledDumpMixin
 
 
-class CountrySchema(ma.SQLAlchemyAutoSchema):
+class CountrySchema(CompiledDumpMixin, ma.SQLAlchemyAutoSchema):
     class Meta:
         model = Country
         include_fk = True
\ No newline at end of file
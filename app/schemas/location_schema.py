@@ -1,14 +1,16 @@
 from app import ma
 from marshmallow import fields
 from app.models.location import Location
+from app.schemas.compiled_schema import CompiledDumpMixin
 from app.schemas.country_schema import CountrySchema
 
 
-class LocationSchema(ma.SQLAlchemyAutoSchema):
+class LocationSchema(CompiledDumpMixin, ma.SQLAlchemyAutoSchema):
     class Meta:
         model = Location
         include_fk = True
         load_only = ["country_code"]
+        exclude = ["grid_cell"]
     country = fields.Nested(CountrySchema)
 
 
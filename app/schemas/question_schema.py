@@ -1,18 +1,22 @@
 from app import ma
 from marshmallow import fields, validate
+from sqlalchemy.orm import joinedload, selectinload
 from app.models.question import Question
+from app.models.location import Location
+from app.schemas.compiled_schema import CompiledDumpMixin
 from app.schemas.user_schema import UserSchema
 from app.schemas.category_schema import CategorySchema
 from app.schemas.location_schema import LocationSchema
-from app.schemas.answer_schema import AnswerSchema
+from app.schemas.answer_schema import AnswerSchema, answers_schema_options
 
 
-class QuestionSchema(ma.SQLAlchemyAutoSchema):
+class QuestionSchema(CompiledDumpMixin, ma.SQLAlchemyAutoSchema):
     class Meta:
         model = Question
         include_fk = True
         load_only = ["category_id", "user_id", "location_id"]
         dump_only = ["date_time"]
+        exclude = ["content_hash", "revision", "updated_at"]
     author = fields.Nested(UserSchema())
     category = fields.Nested(CategorySchema(only=["category_id", "category_name"]))
     location = fields.Nested(LocationSchema())
@@ -46,3 +50,15 @@ questions_details_schema = QuestionDetailsSchema(many=True)
 questions_schema = QuestionSchema(many=True)
 question_post_schema = QuestionPostSchema()
 question_update_schema = QuestionUpdateSchema()
+
+# Eager load the relationships QuestionSchema serialises, so dumping a list
+# of questions takes the same number of queries whatever its length
+questions_schema_options = [
+    joinedload(Question.author),
+    joinedload(Question.category),
+    joinedload(Question.location).joinedload(Location.country),
+]
+# QuestionDetailsSchema also serialises each question's answers
+questions_details_schema_options = questions_schema_options + [
+    selectinload(Question.answers).options(*answers_schema_options),
+]
@@ -1,25 +1,34 @@
 from app import ma
 from marshmallow import fields
 from app.models.user import User
+from app.schemas.compiled_schema import CompiledDumpMixin
 
 
-class UserSchema(ma.SQLAlchemyAutoSchema):
+# Stat counter columns are only shown through the stat_ fields, and the
+# version stamp columns only through response headers
+hidden_columns = [
+    "questions_count", "answers_count", "votes_count", "revision",
+    "updated_at"]
+
+
+class UserSchema(CompiledDumpMixin, ma.SQLAlchemyAutoSchema):
     class Meta:
         model = User
         include_fk = True
         load_only = ["email", "password"]
+        exclude = hidden_columns
 
     def get_questions_count(self, obj):
         """ Return the number of questions posted by user """
-        return len(obj.questions)
+        return obj.questions_count
 
     def get_answers_count(self, obj):
         """ Return the number of answers posted by user """
-        return len(obj.answers)
+        return obj.answers_count
 
     def get_votes_count(self, obj):
         """ Return the number of recommendations given by user """
-        return len(obj.recommendations)
+        return obj.votes_count
 
 
 class UserPrivateSchema(UserSchema):
@@ -27,6 +36,7 @@ class UserPrivateSchema(UserSchema):
         model = User
         include_fk = True
         load_only = ["password"]
+        exclude = hidden_columns
     stat_questions_posted = fields.Method("get_questions_count")
     stat_answers_posted = fields.Method("get_answers_count")
     stat_recommendations_given = fields.Method("get_votes_count")
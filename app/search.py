@@ -0,0 +1,200 @@
+from flask import current_app as app
+from sqlalchemy import (
+    case, column, func, literal, literal_column, select, table)
+from app import db
+from app.models.answer import Answer
+from app.models.category import Category
+from app.models.location import Location
+from app.models.question import Question
+
+
+# Text search configuration used to build and query the PostgreSQL index
+SEARCH_CONFIG = "english"
+# Markers placed around matching words in result snippets
+HIGHLIGHT_START, HIGHLIGHT_END = "<b>", "</b>"
+
+# PostgreSQL: a stored tsvector column generated from each post body,
+# kept up to date by the database, and a GIN index over it
+POSTGRESQL_SEARCH_TABLES = ["questions", "answers"]
+
+# SQLite: an FTS5 table stands in for the GIN indexes, kept up to date
+# by triggers. Questions use even rowids (question_id * 2) and answers
+# odd rowids (answer_id * 2 + 1), so both post types share one table.
+SQLITE_SEARCH_TABLE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_search USING fts5("
+    "body, question_id UNINDEXED, tokenize = 'porter unicode61')")
+SQLITE_SEARCH_TRIGGERS = {
+    "questions": ("new.question_id * 2", "old.question_id * 2"),
+    "answers": ("new.answer_id * 2 + 1", "old.answer_id * 2 + 1"),
+}
+SQLITE_SEARCH_BACKFILL = (
+    "INSERT INTO posts_search (rowid, body, question_id) "
+    "SELECT question_id * 2, body, question_id FROM questions "
+    "UNION ALL "
+    "SELECT answer_id * 2 + 1, body, question_id FROM answers")
+
+posts_search = table(
+    "posts_search", column("rowid"), column("body"), column("question_id"))
+
+
+def create_search_index(connection, rebuild: bool = False) -> None:
+    """ Create the full-text index over question and answer bodies for the
+    connected database, and fill it from the existing posts if rebuilding """
+    if connection.dialect.name == "postgresql":
+        # Build concurrently when adding the index to a live database
+        concurrently = "CONCURRENTLY " if rebuild else ""
+        for table_name in POSTGRESQL_SEARCH_TABLES:
+            connection.execute(db.text(
+                f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS "
+                "search_vector tsvector GENERATED ALWAYS AS "
+                f"(to_tsvector('{SEARCH_CONFIG}', body)) STORED"))
+            connection.execute(db.text(
+                f"CREATE INDEX {concurrently}IF NOT EXISTS "
+                f"ix_{table_name}_search_vector "
+                f"ON {table_name} USING gin (search_vector)"))
+
+    elif connection.dialect.name == "sqlite":
+        connection.execute(db.text(SQLITE_SEARCH_TABLE))
+        for table_name, (new_rowid, old_rowid) in (
+                SQLITE_SEARCH_TRIGGERS.items()):
+            connection.execute(db.text(
+                f"CREATE TRIGGER IF NOT EXISTS {table_name}_search_insert "
+                f"AFTER INSERT ON {table_name} BEGIN "
+                "INSERT INTO posts_search (rowid, body, question_id) "
+                f"VALUES ({new_rowid}, new.body, new.question_id); END"))
+            connection.execute(db.text(
+                f"CREATE TRIGGER IF NOT EXISTS {table_name}_search_update "
+                f"AFTER UPDATE OF body ON {table_name} BEGIN "
+                "UPDATE posts_search SET body = new.body "
+                f"WHERE rowid = {old_rowid}; END"))
+            connection.execute(db.text(
+                f"CREATE TRIGGER IF NOT EXISTS {table_name}_search_delete "
+                f"AFTER DELETE ON {table_name} BEGIN "
+                f"DELETE FROM posts_search WHERE rowid = {old_rowid}; END"))
+        if rebuild:
+            connection.execute(db.text("DELETE FROM posts_search"))
+            connection.execute(db.text(SQLITE_SEARCH_BACKFILL))
+
+    else:
+        raise NotImplementedError(
+            f"Full-text search isn't supported on {connection.dialect.name}.")
+
+
+def drop_search_index(connection) -> None:
+    """ Drop the SQLite search table, which isn't part of the models
+    (the PostgreSQL columns are dropped along with their tables) """
+    if connection.dialect.name == "sqlite":
+        connection.execute(db.text("DROP TABLE IF EXISTS posts_search"))
+
+
+def fts5_query(terms: str) -> str:
+    """ Quote each search term so FTS5 matches all of them as plain words """
+    return " ".join(
+        '"' + term.replace('"', '""') + '"' for term in terms.split())
+
+
+def filter_posts(posts, question_id, filters: dict):
+    """ Filter a select of posts on the location and category of the
+    question each post belongs to """
+    if not filters:
+        return posts
+    # Questions are filtered directly, other posts through their question
+    if question_id is not Question.question_id:
+        posts = posts.join(Question, Question.question_id == question_id)
+    posts = posts.join(Question.location).join(Question.category)
+    for key, value in filters.items():
+        if key in ["location_id", "category_id"]:
+            posts = posts.where(getattr(Question, key) == value)
+        elif key == "category_name":
+            posts = posts.where(Category.category_name == value)
+        else:
+            posts = posts.where(getattr(Location, key) == value)
+    return posts
+
+
+def matching_posts(terms: str, filters: dict):
+    """ Return a selectable of the posts matching the search terms and
+    filters, with their post type and id, question_id, and a relevance
+    score """
+    if db.engine.dialect.name == "postgresql":
+        search_query = func.websearch_to_tsquery(
+            literal_column(f"'{SEARCH_CONFIG}'"), terms)
+        # Rank a bounded number of matches per post type, so very common
+        # terms don't make every request rank a large part of the table.
+        # The newest matches are ranked, found by reading the (date_time,
+        # id) indexes backwards, so every page of a search ranks the same
+        # candidates.
+        max_candidates = app.config["SEARCH_MAX_CANDIDATES"]
+
+        def matches(model, post_type, post_id):
+            vector = literal_column(f"{model.__tablename__}.search_vector")
+            return filter_posts(select(
+                literal(post_type).label("post_type"),
+                post_id.label("post_id"),
+                model.question_id.label("question_id"),
+                func.ts_rank(vector, search_query).label("score"),
+                model.body.label("body"),
+            ).where(vector.op("@@")(search_query)),
+                model.question_id, filters
+            ).order_by(model.date_time.desc(), post_id.desc()
+                       ).limit(max_candidates).subquery()
+
+        questions = matches(Question, "question", Question.question_id)
+        answers = matches(Answer, "answer", Answer.answer_id)
+        return select(questions).union_all(select(answers)).subquery("posts")
+
+    # SQLite: bm25 scores are lower for better matches
+    search_table = literal_column("posts_search")
+    return filter_posts(select(
+        case(
+            (posts_search.c.rowid % 2 == 0, "question"), else_="answer"
+        ).label("post_type"),
+        (posts_search.c.rowid / 2).label("post_id"),
+        posts_search.c.question_id.label("question_id"),
+        (-func.bm25(search_table)).label("score"),
+        func.snippet(
+            search_table, 0, HIGHLIGHT_START, HIGHLIGHT_END, "…", 16
+        ).label("snippet"),
+    ).where(search_table.op("MATCH")(fts5_query(terms))),
+        posts_search.c.question_id, filters).subquery("posts")
+
+
+def search_posts(terms: str, filters: dict, limit: int,
+                 offset: int) -> tuple:
+    """ Return a page of the questions and answers matching the search
+    terms and location/category filters, best matches first, and whether
+    there were more matches of a post type than were ranked """
+    posts = matching_posts(terms, filters)
+    # Count the candidates of each post type alongside the page, as only
+    # PostgreSQL bounds them
+    candidate_counts = []
+    if db.engine.dialect.name == "postgresql":
+        candidate_counts = [
+            func.count(case((posts.c.post_type == post_type, 1))).over(
+            ).label(f"{post_type}_candidates")
+            for post_type in ["question", "answer"]]
+    page = select(posts, *candidate_counts).order_by(
+        posts.c.score.desc(), posts.c.post_type, posts.c.post_id
+    ).limit(limit).offset(offset).subquery("page")
+
+    # Only highlight the posts on the page (PostgreSQL)
+    if "snippet" in page.c:
+        snippet = page.c.snippet
+    else:
+        snippet = func.ts_headline(
+            literal_column(f"'{SEARCH_CONFIG}'"), page.c.body,
+            func.websearch_to_tsquery(
+                literal_column(f"'{SEARCH_CONFIG}'"), terms),
+            f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, "
+            "MaxWords=20, MinWords=8")
+    results = db.session.execute(select(
+        page.c.post_type, page.c.post_id, page.c.question_id,
+        snippet.label("snippet"), *[
+            page.c[column.name] for column in candidate_counts]
+    ).order_by(
+        page.c.score.desc(), page.c.post_type, page.c.post_id)).all()
+    max_candidates = app.config["SEARCH_MAX_CANDIDATES"]
+    approximate = bool(results and candidate_counts) and (
+        results[0].question_candidates >= max_candidates
+        or results[0].answer_candidates >= max_candidates)
+    return results, approximate
@@ -0,0 +1,149 @@
+import os
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app import create_app, db, bcrypt
+from app.search import create_search_index, drop_search_index
+from app.models.answer import Answer
+from app.models.category import Category
+from app.models.country import Country
+from app.models.location import Location
+from app.models.question import Question
+from app.models.recommendation import Recommendation
+from app.models.user import User
+
+# Password of the users added by the fixtures
+TEST_PASSWORD = "12345678"
+
+
+def pytest_configure(config):
+    """ Set the environment read when config.py is imported by create_app:
+    turn off the response cache, so every request reaches the database,
+    and hash passwords quickly """
+    os.environ["CACHE_TYPE"] = "null"
+    os.environ["BCRYPT_LOG_ROUNDS"] = "4"
+    os.environ.setdefault("JWT_SECRET_KEY", "test-secret-key-" + "x" * 32)
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    """ Create the app once, using the TEST_DATABASE_URI database if it's
+    set (e.g. to run the tests on PostgreSQL), or a new SQLite file """
+    os.environ["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
+        "TEST_DATABASE_URI",
+        f"sqlite:///{tmp_path_factory.mktemp('db') / 'test.sqlite'}")
+    app = create_app()
+    app.config["TESTING"] = True
+    return app
+
+
+@pytest.fixture
+def database(app):
+    """ Create empty tables for a test, and drop them after it """
+    with app.app_context():
+        # Drop the tables of an earlier run that was interrupted
+        with db.engine.begin() as connection:
+            drop_search_index(connection)
+        db.drop_all()
+        db.create_all()
+        with db.engine.begin() as connection:
+            create_search_index(connection)
+        yield db
+        db.session.remove()
+        with db.engine.begin() as connection:
+            drop_search_index(connection)
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app, database):
+    return app.test_client()
+
+
+def add_user(username: str) -> User:
+    """ Add a user who logs in with TEST_PASSWORD """
+    user = User(username=username, email=f"{username}@emailprovider.com",
+                password=bcrypt.generate_password_hash(
+                    TEST_PASSWORD).decode("utf-8"))
+    db.session.add(user)
+    return user
+
+
+@pytest.fixture
+def reference_rows(database) -> dict:
+    """ Add a country, two categories, and the user posting questions """
+    db.session.add(Country(country_code="AU", country="Australia"))
+    categories = [Category(category_name=name,
+                           description=f"Questions about {name.lower()}")
+                  for name in ["Accommodation", "Transport"]]
+    user = add_user("user1")
+    db.session.add_all(categories)
+    db.session.commit()
+    return {"category_ids": [category.category_id
+                             for category in categories],
+            "user_id": user.user_id,
+            "threads": 0}
+
+
+def add_threads(reference_rows: dict, count: int) -> None:
+    """ Add question threads. Each has a new user and location, so lists
+    that lazy load their authors or locations would need more statements.
+    The new user asks a question in the second category and answers one
+    asked by the first user in the first category, with a reply from the
+    first user, and both users recommend the answer. """
+    user_id = reference_rows["user_id"]
+    first_category_id, second_category_id = reference_rows["category_ids"]
+    date_time = datetime.now(timezone.utc)
+    for number in range(reference_rows["threads"],
+                        reference_rows["threads"] + count):
+        date_time += timedelta(minutes=1)
+        other_user = add_user(f"user{number + 2}")
+        location = Location(country_code="AU", state="Western Australia",
+                            postcode=str(6000 + number),
+                            suburb=f"Suburb {number}")
+        question = Question(
+            user_id=user_id, location=location, date_time=date_time,
+            category_id=first_category_id,
+            body=f"Question {number}: where is a good place to stay?")
+        other_question = Question(
+            author=other_user, location=location, date_time=date_time,
+            category_id=second_category_id,
+            body=f"Question {number}: how often do the buses run?")
+        answer = Answer(author=other_user, question=question,
+                        date_time=date_time,
+                        body=f"Answer {number}: try the hotel in the city.")
+        db.session.add_all([location, question, other_question, answer])
+        db.session.flush()
+        db.session.add_all([
+            Answer(user_id=user_id, question=question, date_time=date_time,
+                   parent_id=answer.answer_id,
+                   body=f"Reply {number}: thanks, I'll have a look."),
+            Recommendation(answer_id=answer.answer_id, user_id=user_id),
+            Recommendation(answer_id=answer.answer_id,
+                           user_id=other_user.user_id)])
+    db.session.commit()
+    reference_rows["threads"] += count
+
+
+def login(client, username: str = "user1") -> dict:
+    """ Return the authorisation header of a logged-in user """
+    token = client.post("/auth/login", json={
+        "username": username, "password": TEST_PASSWORD}).json["token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+@contextmanager
+def count_statements():
+    """ Collect the SQL statements sent to any database while in use """
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", count)
+    try:
+        yield statements
+    finally:
+        event.remove(Engine, "before_cursor_execute", count)
@@ -0,0 +1,54 @@
+import pytest
+from sqlalchemy import update
+from app import cache, db
+from app.cache import MemoryCacheBackend
+from app.models.category import Category
+from app.models.reference_version import ReferenceVersion
+from app.reference_data import (
+    REFERENCE_DATA_VERSION, bump_reference_version, reference_data)
+
+
+@pytest.fixture
+def memory_cache(app, monkeypatch):
+    """ Cache responses in memory, checking the reference data version on
+    every request """
+    monkeypatch.setattr(cache, "backend", MemoryCacheBackend(100))
+    monkeypatch.setattr(cache, "stores_responses", True)
+    monkeypatch.setitem(app.config, "REFERENCE_DATA_CHECK_INTERVAL", 0)
+    reference_data.clear()
+    yield cache
+    reference_data.clear()
+
+
+def category_names(response) -> list:
+    """ Return the names in a response listing categories """
+    return [category["category_name"] for category in response.json]
+
+
+def test_categories_are_cached_until_reference_data_changes(
+        client, reference_rows, memory_cache):
+    bump_reference_version()
+    assert client.get("/categories/").headers["X-Cache"] == "MISS"
+    assert client.get("/categories/").headers["X-Cache"] == "HIT"
+
+    # Bumping the version in this process removes the cached response
+    db.session.add(Category(category_name="Housing",
+                            description="Questions about housing"))
+    db.session.commit()
+    bump_reference_version()
+    response = client.get("/categories/")
+    assert response.headers["X-Cache"] == "MISS"
+    assert "Housing" in category_names(response)
+
+    # Another process bumping the version can't remove it, but responses
+    # cached with the old version aren't used
+    db.session.add(Category(category_name="Venues",
+                            description="Questions about venues"))
+    db.session.execute(update(ReferenceVersion).where(
+        ReferenceVersion.name == REFERENCE_DATA_VERSION).values(
+        version="changed by another process"))
+    db.session.commit()
+    response = client.get("/categories/")
+    assert response.headers["X-Cache"] == "MISS"
+    assert "Venues" in category_names(response)
+    assert client.get("/categories/").headers["X-Cache"] == "HIT"
@@ -0,0 +1,214 @@
+from datetime import datetime, timedelta, timezone
+import json
+import pytest
+from sqlalchemy import select
+from app import db
+from app.models.answer import Answer
+from app.models.location import Location
+from app.models.question import Question
+from app.tests.conftest import add_threads, count_statements, login
+
+
+def question_ids(results: list) -> list:
+    return [result["question_id"] for result in results]
+
+
+def add_reply_chain(answer_id: int, length: int) -> list:
+    """ Add a chain of replies under an answer, each replying to the last,
+    and return their ids """
+    parent = db.session.get(Answer, answer_id)
+    date_time = datetime.now(timezone.utc)
+    reply_ids = []
+    for number in range(length):
+        date_time += timedelta(minutes=1)
+        parent = Answer(user_id=parent.user_id,
+                        question_id=parent.question_id,
+                        parent_id=parent.answer_id, date_time=date_time,
+                        body=f"Reply {number} in a long chain of replies.")
+        db.session.add(parent)
+        db.session.flush()
+        reply_ids.append(parent.answer_id)
+    db.session.commit()
+    return reply_ids
+
+
+def reply_chain_ids(answer: dict) -> list:
+    """ Return the ids of the first reply at each level of a reply tree """
+    ids = []
+    while answer["replies"]:
+        answer = answer["replies"][0]
+        ids.append(answer["answer_id"])
+    return ids
+
+
+def test_pages_follow_the_cursor_without_gaps(client, reference_rows):
+    add_threads(reference_rows, 5)
+    expected_ids = db.session.scalars(select(Question.question_id).order_by(
+        Question.date_time, Question.question_id)).all()
+
+    # Questions posted at the same time are ordered by id across pages
+    seen_ids = []
+    url = "/questions/?limit=3"
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200, response.json
+        assert len(response.json["results"]) <= 3
+        seen_ids += question_ids(response.json["results"])
+        url = response.json["next"]
+    assert seen_ids == expected_ids
+
+    # The last full page has no next page
+    response = client.get("/questions/?limit=10")
+    assert len(response.json["results"]) == 10
+    assert response.json["next"] is None
+
+
+@pytest.mark.parametrize("query_string", [
+    {"cursor": "not a cursor"},
+    {"cursor": "WzEsIDIsIDNd"},
+    {"limit": "0"},
+    {"limit": "201"},
+    {"limit": "ten"},
+])
+def test_invalid_page_arguments_are_rejected(
+        client, reference_rows, query_string):
+    add_threads(reference_rows, 1)
+    for url in ["/questions/", "/answers/"]:
+        response = client.get(url, query_string=query_string)
+        assert response.status_code == 400
+        assert set(response.json) == set(query_string)
+
+
+@pytest.mark.parametrize("stream_args, headers", [
+    ({"stream": "1"}, {}),
+    ({}, {"Accept": "application/x-ndjson"}),
+])
+def test_streams_every_record_as_ndjson(
+        app, client, reference_rows, monkeypatch, stream_args, headers):
+    add_threads(reference_rows, 4)
+    # Small batches, so the stream is sent in several chunks
+    monkeypatch.setitem(app.config, "STREAM_BATCH_SIZE", 3)
+    response = client.get("/questions/", query_string=stream_args,
+                          headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = response.get_data(as_text=True).splitlines()
+    expected_ids = db.session.scalars(select(Question.question_id).order_by(
+        Question.date_time, Question.question_id)).all()
+    assert question_ids(map(json.loads, lines)) == expected_ids
+
+    # A stream can start from a page cursor
+    cursor = client.get("/questions/?limit=5").json["next"].split(
+        "cursor=")[1]
+    response = client.get("/questions/", headers=headers, query_string={
+        **stream_args, "cursor": cursor})
+    assert question_ids(map(json.loads, response.get_data(
+        as_text=True).splitlines())) == expected_ids[5:]
+
+
+def test_batch_reports_each_question(client, reference_rows):
+    add_threads(reference_rows, 1)
+    location_id = db.session.scalar(select(Location.location_id))
+    category_id = reference_rows["category_ids"][0]
+    headers = login(client)
+
+    def post(body: str) -> dict:
+        return {"location_id": location_id, "category_id": category_id,
+                "question": body}
+
+    response = client.post("/questions/batch", headers=headers, json=[
+        post("Question 0: where is a good place to stay?"),
+        post("Which beach is the best for swimming?"),
+        post("Which beach is the best for swimming?"),
+        post("Too short?"),
+        {**post("Where can I hire a bike for the day?"),
+         "location_id": 9999},
+    ])
+    # Only some of the questions could be posted
+    assert response.status_code == 207
+    assert {key: response.json[key] for key in [
+        "created", "duplicates", "failed"]} == {
+        "created": 1, "duplicates": 2, "failed": 2}
+    results = response.json["results"]
+    assert [result["status"] for result in results] == [
+        200, 201, 200, 400, 404]
+    assert [result["index"] for result in results] == list(range(5))
+
+    # Duplicates of a question posted before or earlier in the list link
+    # to the existing question
+    new_id = results[1]["question_id"]
+    assert results[2]["question_id"] == new_id
+    assert results[0]["question_id"] == db.session.scalar(
+        select(Question.question_id).where(
+            Question.category_id == category_id,
+            Question.body.startswith("Question 0:")))
+    assert client.get(f"/questions/{new_id}").status_code == 200
+
+
+@pytest.mark.parametrize("endpoint, id_column", [
+    ("/questions/", Question.question_id),
+    ("/answers/", Answer.answer_id),
+])
+def test_multi_get_keeps_the_order_and_reports_missing_ids(
+        client, reference_rows, endpoint, id_column):
+    add_threads(reference_rows, 3)
+    ids = db.session.scalars(select(id_column).order_by(
+        id_column.desc())).all()[:3]
+    response = client.get(endpoint, query_string={
+        "ids": f"{ids[1]},9999,{ids[0]},{ids[2]},{ids[1]}"})
+    assert response.status_code == 200
+    assert [result[id_column.key] for result in response.json[
+        "results"]] == [ids[1], ids[0], ids[2]]
+    assert response.json["missing"] == [9999]
+
+    # No ids found is a 404, and the ids must be integers
+    assert client.get(endpoint, query_string={
+        "ids": "9998,9999"}).status_code == 404
+    assert client.get(endpoint, query_string={
+        "ids": "1,two"}).status_code == 400
+
+
+def test_users_multi_get(client, reference_rows):
+    add_threads(reference_rows, 1)
+    response = client.get("/users/", headers=login(client),
+                          query_string={"ids": "2,9999,1"})
+    assert response.status_code == 200
+    assert [result["username"] for result in response.json["results"]] == [
+        "user2", "user1"]
+    assert response.json["missing"] == [9999]
+
+
+def test_reply_tree_is_loaded_with_one_query(client, reference_rows):
+    add_threads(reference_rows, 1)
+    answer_id = db.session.scalar(select(Answer.answer_id).where(
+        Answer.parent_id.is_(None)))
+    first_reply_id = db.session.scalar(select(Answer.answer_id).where(
+        Answer.parent_id == answer_id))
+    url = f"/answers/{answer_id}"
+    with count_statements() as statements:
+        response = client.get(url)
+    few_statements = len(statements)
+    assert reply_chain_ids(response.json) == [first_reply_id]
+
+    # A deeper tree takes the same number of statements
+    chain_ids = add_reply_chain(first_reply_id, 20)
+    with count_statements() as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+    assert reply_chain_ids(response.json) == [first_reply_id, *chain_ids]
+    assert len(statements) == few_statements
+
+    # The depth can be limited, and must be a number
+    response = client.get(url, query_string={"max_depth": 3})
+    assert reply_chain_ids(response.json) == [first_reply_id, *chain_ids[:2]]
+    assert response.json["replies"][0]["replies"][0]["replies"][0][
+        "replies"] == []
+    assert client.get(url, query_string={"max_depth": 0}).json[
+        "replies"] == []
+    assert client.get(url, query_string={
+        "max_depth": "deep"}).status_code == 400
+
+    # Answers fetched by id come with their reply trees
+    response = client.get("/answers/", query_string={"ids": answer_id})
+    assert reply_chain_ids(response.json["results"][0]) == [
+        first_reply_id, *chain_ids]
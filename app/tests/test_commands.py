@@ -0,0 +1,32 @@
+from sqlalchemy import func, select
+from app import db
+from app.models.answer import Answer
+from app.models.category import Category
+from app.models.country import Country
+from app.models.location import Location
+from app.models.question import Question
+from app.models.recommendation import Recommendation
+from app.models.user import User
+
+# Tables filled by flask db seed
+SEEDED_MODELS = [
+    Country, Location, Category, User, Question, Answer, Recommendation]
+
+
+def row_counts() -> dict:
+    """ Return the number of rows in each table the seed fills """
+    return {model.__tablename__: db.session.scalar(
+        select(func.count()).select_from(model)) for model in SEEDED_MODELS}
+
+
+def test_seed_can_run_again(app, database):
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["db", "seed"])
+    assert result.exception is None, result.output
+    seeded = row_counts()
+    assert seeded["categories"] == 11 and seeded["users"] == 2
+    assert seeded["questions"] == 3 and seeded["recommendations"] == 1
+
+    result = runner.invoke(args=["db", "seed"])
+    assert result.exception is None, result.output
+    assert row_counts() == seeded
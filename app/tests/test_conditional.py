@@ -0,0 +1,48 @@
+from sqlalchemy import func, select
+from app import db
+from app.models.answer import Answer
+from app.models.question import Question
+from app.tests.conftest import add_threads, login
+
+
+def assert_changed(client, answer_id: int, etag: str) -> str:
+    """ Check an answer isn't reported as not modified since the ETag, and
+    return its new ETag """
+    response = client.get(f"/answers/{answer_id}",
+                          headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    return response.headers["ETag"]
+
+
+def test_answer_etag_covers_replies_to_other_questions(
+        client, reference_rows):
+    add_threads(reference_rows, 1)
+    answer = db.session.scalars(select(Answer).where(
+        Answer.parent_id.is_(None))).one()
+    answer_id = answer.answer_id
+    other_question_id = db.session.scalar(select(Question.question_id).where(
+        Question.question_id != answer.question_id))
+    headers = login(client)
+    response = client.get(f"/answers/{answer_id}")
+    etag = response.headers["ETag"]
+    assert client.get(f"/answers/{answer_id}", headers={
+        "If-None-Match": etag}).status_code == 304
+
+    # Reply to the answer from another question, then to that reply
+    parent_id = answer_id
+    for number in range(2):
+        response = client.post(
+            f"/questions/{other_question_id}/answer", headers=headers,
+            json={"answer": f"Reply {number} posted to the other question.",
+                  "parent_id": parent_id})
+        assert response.status_code < 300, response.json
+        parent_id = db.session.scalar(select(func.max(Answer.answer_id)))
+        etag = assert_changed(client, answer_id, etag)
+
+    # Votes for a reply deep in the tree change the answer's version
+    response = client.post(f"/answers/{parent_id}/vote", headers=headers)
+    assert response.status_code < 300, response.json
+    etag = assert_changed(client, answer_id, etag)
+    assert client.get(f"/answers/{answer_id}").json["replies"][-1][
+        "replies"][0]["recommendations"] == 1
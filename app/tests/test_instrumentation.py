@@ -0,0 +1,51 @@
+import gc
+import re
+from types import SimpleNamespace
+from flask import Flask
+from app.instrumentation import RequestInstrumentation
+from app.schemas.category_schema import categories_schema
+from app.schemas.compiled_schema import CompiledDumpMixin, dump_wrappers
+
+# A list of categories that takes a measurable time to dump
+CATEGORIES = [SimpleNamespace(
+    category_id=number, category_name=f"Category {number}",
+    description="Questions about everything") for number in range(20000)]
+
+
+def categories_app(instrumentation: bool) -> Flask:
+    """ Return an app listing CATEGORIES, with instrumentation on or off """
+    app = Flask(__name__)
+    app.config["INSTRUMENTATION"] = instrumentation
+    RequestInstrumentation(app)
+
+    @app.get("/categories")
+    def get_categories():
+        return {"results": len(categories_schema.dump(CATEGORIES))}
+
+    return app
+
+
+def serialise_time(response) -> float:
+    """ Return the serialisation time in a response's Server-Timing """
+    return float(re.search(r"serialize;dur=([\d.]+)",
+                           response.headers["Server-Timing"]).group(1))
+
+
+def test_dumps_are_only_timed_in_instrumented_apps():
+    dump = CompiledDumpMixin.dump
+    instrumented = categories_app(True)
+    other = categories_app(False)
+
+    # Dumps are timed for the instrumented app only, without changing the
+    # schema class
+    response = instrumented.test_client().get("/categories")
+    assert serialise_time(response) > 0
+    assert "Server-Timing" not in other.test_client().get(
+        "/categories").headers
+    assert CompiledDumpMixin.dump is dump
+    assert instrumented in dump_wrappers and other not in dump_wrappers
+
+    # Nothing is left behind once the app is gone
+    del instrumented, response
+    gc.collect()
+    assert not dump_wrappers
@@ -0,0 +1,37 @@
+import pytest
+from app.tests.conftest import add_threads, count_statements
+
+# List endpoints that serialise related records, each of which must load
+# a page with the same number of statements however many rows it has
+LIST_ENDPOINTS = [
+    "/questions/",
+    "/categories/{category_id}",
+    "/users/{user_id}/questions",
+    "/users/{user_id}/q&a",
+    "/users/{user_id}/answers",
+    "/users/{user_id}/recommendations",
+]
+
+
+def page_statements(client, url: str) -> tuple:
+    """ Return the number of statements a page of 200 took, and its size """
+    # The first request also loads per-worker lookups, like categories
+    client.get(url, query_string={"limit": 200})
+    with count_statements() as statements:
+        response = client.get(url, query_string={"limit": 200})
+    assert response.status_code == 200, response.json
+    return len(statements), len(response.json["results"])
+
+
+@pytest.mark.parametrize("endpoint", LIST_ENDPOINTS)
+def test_statement_count_is_constant(client, reference_rows, endpoint):
+    url = endpoint.format(category_id=reference_rows["category_ids"][0],
+                          user_id=reference_rows["user_id"])
+    add_threads(reference_rows, 2)
+    few_statements, few_rows = page_statements(client, url)
+    add_threads(reference_rows, 198)
+    many_statements, many_rows = page_statements(client, url)
+
+    # Each thread adds one or two rows to each list
+    assert few_rows in [2, 4] and many_rows == 200
+    assert many_statements == few_statements
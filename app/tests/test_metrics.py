@@ -0,0 +1,30 @@
+from app.metrics import RequestMetrics
+
+# The labels of the request counted by each worker
+LABELS = (("endpoint", "questions.get_questions"), ("method", "GET"),
+          ("status", "200"))
+
+
+def worker(directory, requests: int) -> RequestMetrics:
+    """ Return the metrics of a worker writing to the directory, after
+    counting requests and writing them """
+    metrics = RequestMetrics()
+    metrics.multiprocess_dir = str(directory)
+    metrics.inc("http_requests_total", LABELS, requests)
+    metrics.flush(exiting=True)
+    return metrics
+
+
+def test_workers_with_the_same_pid_keep_separate_counts(tmp_path):
+    # Workers in one process stand in for a new worker given the pid of
+    # one that exited
+    exited = worker(tmp_path, 3)
+    restarted = worker(tmp_path, 2)
+    assert exited.own_file() != restarted.own_file()
+    assert len(list(tmp_path.iterdir())) == 2
+
+    # Every worker's counts are added up, whichever worker reports them
+    for metrics in [exited, restarted]:
+        assert metrics.collect()["values"][
+            ("http_requests_total", LABELS)] == 5
+    assert 'status="200"} 5\n' in restarted.render()
@@ -0,0 +1,100 @@
+from flask import Flask, g
+from flask_jwt_extended import JWTManager
+import pytest
+from app.cache import ResponseCache
+from app.database import LAST_WRITE_COOKIE, LAST_WRITE_HEADER, ReplicaRouter
+
+SECRET_KEY = "replica-test-secret-key-" + "x" * 32
+
+
+def server_process(sticky_seconds: float = 5, secret_key: str = SECRET_KEY,
+                   cache_type: str = "memory") -> Flask:
+    """ Return an app standing in for one server process, with a replica,
+    a write endpoint, and endpoints showing where their reads would go """
+    app = Flask(__name__)
+    app.config.update(
+        SQLALCHEMY_BINDS={"replica": "sqlite://"}, JWT_SECRET_KEY=secret_key,
+        REPLICA_STICKY_SECONDS=sticky_seconds, CACHE_TYPE=cache_type)
+    JWTManager(app)
+    ReplicaRouter(app)
+    cache = ResponseCache(app)
+
+    @app.get("/read")
+    def read():
+        return {"replica": g.get("read_replica", False)}
+
+    @app.get("/cached")
+    @cache.cached()
+    def cached_read():
+        return {"replica": g.get("read_replica", False)}
+
+    @app.post("/write")
+    def write():
+        return {}, 201
+
+    @app.post("/invalid-write")
+    def invalid_write():
+        return {"error": "Invalid"}, 400
+
+    return app
+
+
+def reads_replica(client, url: str = "/read", **kwargs) -> bool:
+    """ Return whether a GET request's reads went to the replica """
+    return client.get(url, **kwargs).json["replica"]
+
+
+def test_write_keeps_client_on_primary_in_every_process():
+    writer = server_process().test_client()
+    assert reads_replica(writer)
+    response = writer.post("/write")
+    assert reads_replica(writer) is False
+
+    # Another process reads from the primary for a client sending back the
+    # cookie or the header, but not for other clients
+    other_process = server_process()
+    client = other_process.test_client()
+    client.set_cookie(LAST_WRITE_COOKIE,
+                      writer.get_cookie(LAST_WRITE_COOKIE).value)
+    assert reads_replica(client) is False
+    assert reads_replica(other_process.test_client(), headers={
+        LAST_WRITE_HEADER: response.headers[LAST_WRITE_HEADER]}) is False
+    assert reads_replica(other_process.test_client())
+
+
+@pytest.mark.parametrize("signed_time", [
+    # Changed and made up write times, and times signed with another key
+    lambda response: response.headers[LAST_WRITE_HEADER][:-1] + "A",
+    lambda response: "1e30",
+    lambda response: "",
+    lambda response: server_process(secret_key="other-" + SECRET_KEY)
+    .test_client().post("/write").headers[LAST_WRITE_HEADER],
+])
+def test_invalid_write_times_read_from_replica(signed_time):
+    response = server_process().test_client().post("/write")
+    assert reads_replica(server_process().test_client(), headers={
+        LAST_WRITE_HEADER: signed_time(response)})
+
+
+def test_write_time_expires():
+    response = server_process().test_client().post("/write")
+    assert reads_replica(server_process(sticky_seconds=0).test_client(),
+                         headers={LAST_WRITE_HEADER:
+                                  response.headers[LAST_WRITE_HEADER]})
+
+
+def test_failed_write_does_not_keep_client_on_primary():
+    client = server_process().test_client()
+    response = client.post("/invalid-write")
+    assert LAST_WRITE_HEADER not in response.headers
+    assert client.get_cookie(LAST_WRITE_COOKIE) is None
+    assert reads_replica(client)
+
+
+def test_cached_responses_are_read_from_primary():
+    client = server_process().test_client()
+    assert reads_replica(client, "/cached") is False
+    assert client.get("/cached").headers["X-Cache"] == "HIT"
+    # Without a cache to store them, responses are read from the replica
+    assert reads_replica(
+        server_process(cache_type="null").test_client(), "/cached")
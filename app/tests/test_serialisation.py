@@ -0,0 +1,175 @@
+from datetime import date, datetime, timezone
+from decimal import Decimal
+import importlib
+import json
+import pkgutil
+import random
+from types import SimpleNamespace
+from uuid import UUID
+import pytest
+from flask import current_app
+from app import db, schemas
+from app.json_provider import COMPACT_SEPARATORS
+from app.location_index import LocationRecord
+from app.models.location import Location
+from app.models.question import Question
+from app.schemas.answer_schema import AnswerRepliesSchema
+from app.schemas.category_schema import category_schema
+from app.schemas.compiled_schema import CompiledDumpMixin
+from app.schemas.location_schema import location_schema
+from app.schemas.user_schema import user_details_schema
+from app.tests.conftest import add_threads
+
+
+def schema_instances() -> list:
+    """ Return every compiled schema instance the schema modules define,
+    and the reply schema only used nested """
+    instances = {}
+    for module_info in pkgutil.iter_modules(schemas.__path__):
+        module = importlib.import_module(
+            f"app.schemas.{module_info.name}")
+        for name, value in vars(module).items():
+            if isinstance(value, CompiledDumpMixin):
+                instances[f"{module_info.name}.{name}"] = value
+    instances["AnswerRepliesSchema(many=True)"] = AnswerRepliesSchema(
+        many=True)
+    return sorted(instances.items())
+
+
+def schema_model(schema):
+    """ Return the model a schema, or the schema it extends, is built for """
+    return next(schema_class.opts.model
+                for schema_class in type(schema).__mro__
+                if getattr(getattr(schema_class, "opts", None), "model", None))
+
+
+def schema_dump(schema, obj, many: bool):
+    """ Dump with marshmallow's Schema.dump, skipping the compiled path """
+    return super(CompiledDumpMixin, schema).dump(obj, many=many)
+
+
+def reference_json(value) -> str:
+    """ Encode a value as the json module does in responses """
+    return json.dumps(value, sort_keys=True, separators=COMPACT_SEPARATORS)
+
+
+@pytest.fixture
+def posts(reference_rows):
+    """ Add threads with replies and votes, a post with characters outside
+    ASCII, and a location with coordinates """
+    add_threads(reference_rows, 3)
+    location = db.session.get(Location, 1)
+    location.latitude, location.longitude = -31.9523, 115.8613
+    question = db.session.get(Question, 1)
+    question.body = "Café near the 🏖 beach?\x7f Where's a quiet 咖啡 spot"
+    db.session.commit()
+
+
+@pytest.mark.parametrize("name, schema", schema_instances())
+def test_compiled_dump_matches_schema_dump(posts, name, schema):
+    objects = db.session.query(schema_model(schema)).all()
+    assert objects
+    expected = schema_dump(schema, objects, many=True)
+    assert schema.dump(objects, many=True) == expected
+    assert [schema.dump(obj, many=False) for obj in objects] == expected
+
+    # Attributes that aren't loaded are read through SQLAlchemy
+    db.session.expire_all()
+    assert schema.dump(objects, many=True) == expected
+    # The compiled output encodes to the same bytes
+    assert current_app.json.dumps(
+        schema.dump(objects, many=True), separators=COMPACT_SEPARATORS
+    ) == reference_json(expected)
+
+
+@pytest.mark.parametrize("schema, obj", [
+    # Plain objects are read by attribute, leaving out missing ones
+    (category_schema, SimpleNamespace(
+        category_id=1, category_name="Food & Drink", description=None)),
+    (user_details_schema, SimpleNamespace(
+        user_id=2, username="ünïcode", questions_count=1, answers_count=0,
+        votes_count=3)),
+    (location_schema, LocationRecord(
+        location_id=5, country_code="AU", state="Victoria", postcode="3000",
+        suburb="Melbourne")),
+    # Values of other types are converted as the fields convert them
+    (category_schema, SimpleNamespace(
+        category_id="7", category_name=b"bytes", description=12)),
+])
+def test_compiled_dump_matches_schema_dump_for_other_objects(
+        app, schema, obj):
+    assert schema.dump(obj) == schema_dump(schema, obj, many=False)
+
+
+# Values orjson encodes differently from the json module, or not at all
+ENCODER_CASES = [
+    "plain ascii",
+    "Café ünïcode 咖啡",
+    "emoji outside the BMP 🏖 and 𝄞",
+    "DEL \x7f and control characters \x00\x1f\n\t\"\\",
+    "   line separators",
+    2 ** 63 - 1,
+    2 ** 64,
+    -(2 ** 63) - 1,
+    10 ** 30,
+    0.1,
+    1.5,
+    123456789.123,
+    0.0001,
+    0.00001,
+    1e-05,
+    1.5e-07,
+    5e-324,
+    1e16,
+    1.7976931348623157e308,
+    -0.0,
+    "0.00001 and 1e-07 in a string",
+    {"b": 1, "a": [1, 2.5, None, True, False], "c": {"z": "é", "y": 1e-9}},
+    [{"value": 1e-05}, {"value": 2 ** 70}],
+    {2: "integer keys", 10: [1e-05]},
+    datetime(2026, 10, 18, 9, 30, tzinfo=timezone.utc),
+    date(2026, 10, 18),
+    Decimal("1.10"),
+    UUID("12345678-1234-5678-1234-567812345678"),
+]
+
+
+@pytest.mark.parametrize("value", ENCODER_CASES)
+def test_fast_json_provider_matches_json_module(app, value):
+    expected = json.dumps(value, sort_keys=True,
+                          separators=COMPACT_SEPARATORS,
+                          default=app.json.default)
+    assert app.json.dumps(value, separators=COMPACT_SEPARATORS) == expected
+
+
+def random_value(rng, depth: int = 0):
+    """ Return a random JSON value with strings from across Unicode,
+    floats of any magnitude and integers of any size """
+    kind = rng.randrange(6 if depth < 3 else 4)
+    if kind == 0:
+        return "".join(chr(rng.choice([
+            rng.randrange(0x20, 0x80), rng.randrange(0x80, 0x800),
+            rng.randrange(0x800, 0xd800), rng.randrange(0x10000, 0x110000)
+        ])) for _ in range(rng.randrange(12)))
+    if kind == 1:
+        return rng.uniform(-1, 1) * 10.0 ** rng.randrange(-320, 308)
+    if kind == 2:
+        return rng.randrange(-(2 ** rng.randrange(1, 80)),
+                             2 ** rng.randrange(1, 80))
+    if kind == 3:
+        return rng.choice([None, True, False])
+    if kind == 4:
+        return [random_value(rng, depth + 1)
+                for _ in range(rng.randrange(5))]
+    # Keys of one dictionary are all strings or all integers, to be sorted
+    key = str if rng.random() < 0.8 else int
+    return {key(number * rng.randrange(-9, 9)): random_value(rng, depth + 1)
+            for number in range(rng.randrange(5))}
+
+
+def test_fast_json_provider_matches_json_module_on_random_values(app):
+    rng = random.Random(0)
+    for _ in range(5000):
+        value = random_value(rng)
+        assert app.json.dumps(
+            value, separators=COMPACT_SEPARATORS) == reference_json(value)
@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from sqlalchemy import select
+from app import db, votes
+from app.models.answer import Answer
+from app.models.recommendation import Recommendation
+from app.models.user import User
+from app.models.vote_event import VoteEvent
+from app.tests.conftest import add_threads, add_user, login
+
+# Users voting at the same time, and the times each votes for each answer
+VOTERS = 8
+ROUNDS = 5
+
+
+@pytest.fixture
+def write_behind(monkeypatch):
+    """ Record votes in vote_events, applying them only when the test
+    flushes them """
+    monkeypatch.setattr(votes, "enabled", True)
+    monkeypatch.setattr(votes, "start_flusher", lambda: None)
+    return votes
+
+
+def final_vote(voter: int, answer_number: int) -> bool:
+    """ Return whether a voter's last vote for an answer recommends it """
+    return (voter + answer_number) % 2 == 0
+
+
+def send_votes(client, username: str, voter: int, answer_ids: list) -> None:
+    """ Vote for and unvote each answer, ending with the voter's final
+    vote, checking each vote is accepted """
+    headers = login(client, username)
+    for number in range(ROUNDS):
+        for answer_number, answer_id in enumerate(answer_ids):
+            voted = number % 2 == 0
+            if number == ROUNDS - 1:
+                voted = final_vote(voter, answer_number)
+            action = "vote" if voted else "remove-vote"
+            response = client.post(f"/answers/{answer_id}/{action}",
+                                   headers=headers)
+            assert response.status_code == 202, response.json
+
+
+def recommendation_counts(client, answer_ids: list) -> list:
+    """ Return the recommendation counts the API shows for answers """
+    return [client.get(f"/answers/{answer_id}").json["recommendations"]
+            for answer_id in answer_ids]
+
+
+def test_concurrent_votes_are_counted_exactly(
+        app, client, reference_rows, write_behind):
+    add_threads(reference_rows, 3)
+    answer_ids = db.session.scalars(select(Answer.answer_id).where(
+        Answer.parent_id.is_(None)).order_by(Answer.answer_id)).all()
+    # The first user, who has recommended every answer, votes as well as
+    # new voters without any recommendations
+    voters = {"user1": 0}
+    for voter in range(1, VOTERS):
+        voters[add_user(f"voter{voter}").username] = voter
+    db.session.commit()
+    before = recommendation_counts(client, answer_ids)
+    assert before == [2, 2, 2]
+
+    with ThreadPoolExecutor(max_workers=VOTERS) as executor:
+        for sent in [executor.submit(send_votes, app.test_client(), username,
+                                     voter, answer_ids)
+                     for username, voter in voters.items()]:
+            sent.result()
+
+    # user1 recommended each answer already, so only changes their count
+    # if their final vote removes it
+    expected = [
+        before[answer_number] - (not final_vote(0, answer_number))
+        + sum(final_vote(voter, answer_number)
+              for voter in range(1, VOTERS))
+        for answer_number in range(len(answer_ids))]
+    assert db.session.query(VoteEvent).count() == (
+        VOTERS * ROUNDS * len(answer_ids))
+    # Counts include the pending votes before and after they're applied
+    assert recommendation_counts(client, answer_ids) == expected
+    assert votes.flush() == VOTERS * ROUNDS * len(answer_ids)
+    assert votes.flush() == 0
+    assert recommendation_counts(client, answer_ids) == expected
+
+    # The votes are in the recommendations table and the voters' stats
+    db.session.expire_all()
+    assert [db.session.query(Recommendation).filter_by(
+        answer_id=answer_id).count() for answer_id in answer_ids] == expected
+    for username, voter in voters.items():
+        user = db.session.query(User).filter_by(username=username).one()
+        assert user.votes_count == db.session.query(
+            Recommendation).filter_by(user_id=user.user_id).count()
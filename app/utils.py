@@ -1,25 +1,83 @@
 from datetime import datetime, timezone
-from flask import current_app as app
-from multidict import MultiDict
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+import binascii
+import hashlib
+import json
+from flask import (
+    Response, current_app as app, request, stream_with_context, url_for)
 from flask_jwt_extended import get_jwt_identity
+from marshmallow import ValidationError
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
 import psycopg2
+from app import db
 from app.models.user import User
 
 
-def duplicate_exists(
-        new_record: object, model_name: str, ignore_list: list) -> None | list:
-    """ Check whether a record with identical cell values already exists """
-    with app.app_context():
-        # Store the new record values in MultiDict for easy filtering
-        new_record_values = MultiDict(
-            # For each column in the new record, generate the name=value pair
-            (column.name, getattr(new_record, column.name))
-            for column in new_record.__table__.columns
-            # Ignore column in igonre_list
-            if column.name not in ignore_list)
-        found_record = model_name.query.filter_by(
-            **new_record_values).first()
-        return found_record
+def content_hash(text: str) -> str:
+    """ Return the SHA-256 hex digest of a post body, ignoring case and
+    repeated whitespace, for finding duplicate posts """
+    normalised_text = " ".join(text.split()).casefold()
+    return hashlib.sha256(normalised_text.encode("utf-8")).hexdigest()
+
+
+def dialect_insert(model):
+    """ Return an INSERT statement for a model's table that supports
+    ON CONFLICT clauses in the connected database """
+    if db.engine.dialect.name == "postgresql":
+        return postgresql.insert(model)
+    if db.engine.dialect.name == "sqlite":
+        return sqlite.insert(model)
+    raise NotImplementedError(
+        f"ON CONFLICT isn't supported on {db.engine.dialect.name}.")
+
+
+def insert_unless_exists(model, values: dict, key_columns: list) -> bool:
+    """ Insert a row unless its key columns match a unique constraint on
+    an existing row, in one statement, and return whether it was inserted """
+    result = db.session.execute(dialect_insert(model).values(
+        **values).on_conflict_do_nothing(index_elements=key_columns))
+    return result.rowcount == 1
+
+
+def insert_or_get_id(model, values: dict, key_columns: list) -> int:
+    """ Insert a row unless its key columns match a unique constraint on
+    an existing row, and return the primary key of the new or existing row """
+    (id_column,) = model.__table__.primary_key.columns
+    statement = dialect_insert(model).values(**values)
+    if db.engine.dialect.name == "postgresql":
+        # Updating a key column to its own value makes RETURNING give the
+        # existing row on a conflict, so this takes a single round trip
+        return db.session.execute(statement.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={key_columns[0]: statement.excluded[key_columns[0]]}
+        ).returning(id_column)).scalar_one()
+
+    # SQLite (without RETURNING in SQLAlchemy 1.4): look up the existing
+    # row only when nothing was inserted
+    result = db.session.execute(
+        statement.on_conflict_do_nothing(index_elements=key_columns))
+    if result.rowcount == 1:
+        return result.inserted_primary_key[0]
+    return db.session.execute(select(id_column).filter_by(
+        **{column: values[column] for column in key_columns})).scalar_one()
+
+
+def reserve_ids(model, count: int) -> list:
+    """ Return count unused primary keys of a model's table, so rows can be
+    inserted with one executemany and still have known ids. PostgreSQL
+    takes them from the table's sequence. SQLite lets one transaction write
+    at a time, so once the caller's transaction has written, the ids after
+    the largest one stay free until it commits. """
+    table = model.__table__
+    (id_column,) = table.primary_key.columns
+    if db.engine.dialect.name == "postgresql":
+        return db.session.scalars(select(func.nextval(
+            func.pg_get_serial_sequence(table.name, id_column.name))
+        ).select_from(func.generate_series(1, count))).all()
+    first_id = db.session.scalar(
+        select(func.coalesce(func.max(id_column), 0))) + 1
+    return list(range(first_id, first_id + count))
 
 
 def current_datetime():
@@ -42,3 +100,154 @@ def get_logged_in_user():
     """ Return the id (integer) of the logged in user """
     logged_in_user = int(get_jwt_identity())
     return logged_in_user
+
+
+def encode_cursor(values) -> str:
+    """ Encode the values of a sort key, or another page position, as an
+    opaque page cursor. Datetimes are encoded in ISO 8601 format. """
+    sort_key = json.dumps([
+        value.isoformat() if isinstance(value, datetime) else value
+        for value in values])
+    return urlsafe_b64encode(sort_key.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, *types) -> tuple:
+    """ Decode a page cursor back into its values, converted to the given
+    types (e.g. datetime, int for a (date_time, id) sort key) """
+    try:
+        values = json.loads(urlsafe_b64decode(cursor))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError("The cursor has the wrong number of values.")
+        return tuple(
+            datetime.fromisoformat(value) if value_type is datetime
+            else value_type(value)
+            for value_type, value in zip(types, values))
+    except (binascii.Error, TypeError, ValueError):
+        raise ValidationError({"cursor": ["The page cursor is invalid."]})
+
+
+def get_page_limit() -> int:
+    """ Return the page limit from the query string """
+    limit = request.args.get("limit", app.config["PAGE_LIMIT_DEFAULT"])
+    if not str(limit).isdigit() or not (
+            0 < int(limit) <= app.config["PAGE_LIMIT_MAX"]):
+        raise ValidationError({"limit": [
+            "The limit must be an integer between 1 and "
+            f"{app.config['PAGE_LIMIT_MAX']}."]})
+    return int(limit)
+
+
+def get_page_args() -> tuple:
+    """ Return the page limit and decoded cursor from the query string """
+    cursor = request.args.get("cursor")
+    return get_page_limit(), (
+        decode_cursor(cursor, datetime, int) if cursor else None)
+
+
+def next_page_url(limit: int, cursor: str) -> str:
+    """ Return the url of the next page of the current request, keeping
+    its other query string arguments """
+    page_args = request.args.to_dict()
+    page_args.update(limit=limit, cursor=cursor)
+    return url_for(request.endpoint, **request.view_args, **page_args)
+
+
+def paginate(query, date_column, id_column) -> tuple:
+    """ Return one page of records from a query ordered by (date_time, id),
+    and the url of the next page (or None on the last page) """
+    limit, cursor = get_page_args()
+    query = query.order_by(date_column, id_column)
+    # Seek past the last record of the previous page using the index
+    if cursor:
+        query = query.filter(tuple_(date_column, id_column) > cursor)
+    # Fetch one extra record to find out whether there is a next page
+    records = query.limit(limit + 1).all()
+
+    next_page = None
+    if len(records) > limit:
+        records = records[:limit]
+        last_record = records[-1]
+        next_page = next_page_url(limit, encode_cursor([
+            getattr(last_record, date_column.key),
+            getattr(last_record, id_column.key)]))
+
+    return records, next_page
+
+
+def show_page(records: list, next_page: str | None) -> dict:
+    """ Return a page of serialised records with a link to the next page """
+    return {"results": records, "next": next_page}
+
+
+def get_id_list() -> list | None:
+    """ Return the ids in the ids query string argument (e.g. ?ids=1,2,3)
+    in order without repeats, or None if it isn't given """
+    ids = request.args.get("ids")
+    if ids is None:
+        return None
+    max_ids = app.config["MULTI_GET_MAX_IDS"]
+    id_list = [id.strip() for id in ids.split(",") if id.strip()]
+    if (not id_list or len(id_list) > max_ids
+            or not all(id.isdigit() for id in id_list)):
+        raise ValidationError({"ids": [
+            "The ids must be a comma-separated list of up to "
+            f"{max_ids} integers."]})
+    return list(dict.fromkeys(int(id) for id in id_list))
+
+
+def show_records_by_id(ids: list, records: list, id_column,
+                       dump) -> tuple:
+    """ Return the dumped records in the order their ids were asked for,
+    and the ids that weren't found, or a 404 if none were """
+    records_by_id = {
+        getattr(record, id_column.key): record for record in records}
+    missing = [id for id in ids if id not in records_by_id]
+    results = dump([records_by_id[id] for id in ids if id in records_by_id])
+    return {"results": results, "missing": missing}, 200 if results else 404
+
+
+def wants_stream() -> bool:
+    """ Return whether the client asked for every record as a stream of
+    newline-delimited JSON (?stream=1 or Accept: application/x-ndjson) """
+    return request.args.get("stream") in ["1", "true"] or (
+        request.accept_mimetypes.best_match(
+            ["application/json", "application/x-ndjson"])
+        == "application/x-ndjson")
+
+
+def stream_records(query, date_column, id_column, schema) -> Response:
+    """ Stream every record of a query ordered by (date_time, id), starting
+    after the page cursor if one is given, as newline-delimited JSON """
+    query = query.order_by(date_column, id_column)
+    cursor = request.args.get("cursor")
+    if cursor:
+        query = query.filter(tuple_(date_column, id_column) > decode_cursor(
+            cursor, datetime, int))
+    # Fetch rows in batches through a server-side cursor, so only one
+    # batch of records is held in memory at a time
+    batch_size = app.config["STREAM_BATCH_SIZE"]
+    query = query.execution_options(stream_results=True).yield_per(
+        batch_size)
+
+    def generate_lines():
+        lines = []
+        for record in query:
+            lines.append(app.json.dumps(schema.dump(record, many=False)))
+            if len(lines) == batch_size:
+                yield "\n".join(lines) + "\n"
+                lines = []
+        if lines:
+            yield "\n".join(lines) + "\n"
+
+    return Response(stream_with_context(generate_lines()),
+                    mimetype="application/x-ndjson")
+
+
+def post_cache_tags(questions: list = (), answers: list = ()) -> list:
+    """ Return the response cache tags of the given questions and answers:
+    the question each post belongs to and the user who wrote it """
+    tags = set()
+    for post in list(questions) + list(answers):
+        tags.add(f"question:{post.question_id}")
+        tags.add(f"user:{post.user_id}")
+    return list(tags)
@@ -0,0 +1,162 @@
+from collections import Counter
+from datetime import datetime, timezone
+from threading import Lock, Thread
+import time
+from sqlalchemy import bindparam, delete, insert, literal, select, tuple_
+from sqlalchemy.exc import SQLAlchemyError
+
+# Most (answer_id, user_id) pairs looked up per statement when applying
+VOTE_LOOKUP_CHUNK_SIZE = 500
+
+
+class VoteAggregator:
+    """ The write-behind vote path (VOTE_WRITE_BEHIND). Votes and their
+    removals are appended to vote_events in one statement and applied to
+    the recommendations table, user stats and question versions in
+    batches every VOTE_FLUSH_INTERVAL seconds by a thread in each worker.
+    Answer counts merge in the pending events (see Answer), so they're
+    exact before and after each batch. """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.flusher = None
+        self.flusher_lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        self.app = app
+        self.enabled = app.config.get("VOTE_WRITE_BEHIND", False)
+        self.flush_interval = app.config.get("VOTE_FLUSH_INTERVAL", 1)
+        self.batch_size = app.config.get("VOTE_FLUSH_BATCH_SIZE", 5000)
+        app.extensions["vote_aggregator"] = self
+
+    def record(self, answer_id: int, user_id: int, voted: bool) -> bool:
+        """ Append a vote (or its removal, if voted is False) for an answer
+        and commit it, in one statement that also checks the answer exists,
+        and return whether it does """
+        # Models are imported where they're used, as this module is
+        # imported before the database object they're defined with
+        from app import db
+        from app.models.answer import Answer
+        from app.models.vote_event import VoteEvent
+        result = db.session.execute(insert(VoteEvent).from_select(
+            ["answer_id", "question_id", "user_id", "voted"],
+            select(Answer.answer_id, Answer.question_id, literal(user_id),
+                   literal(voted)).where(Answer.answer_id == answer_id)))
+        db.session.commit()
+        self.start_flusher()
+        return result.rowcount == 1
+
+    def start_flusher(self) -> None:
+        """ Start this process's flushing thread, if it isn't running """
+        if self.flusher is not None:
+            return
+        with self.flusher_lock:
+            if self.flusher is None:
+                self.flusher = Thread(
+                    target=self.run_flusher, name="vote-flusher", daemon=True)
+                self.flusher.start()
+
+    def run_flusher(self) -> None:
+        """ Apply the pending votes every flush interval, forever """
+        from app import db
+        while True:
+            time.sleep(self.flush_interval)
+            with self.app.app_context():
+                try:
+                    # Keep going while there are full batches waiting
+                    while self.flush() == self.batch_size:
+                        pass
+                except SQLAlchemyError:
+                    db.session.rollback()
+                    self.app.logger.exception("Applying votes failed")
+
+    def flush(self) -> int:
+        """ Apply the oldest batch of pending votes in one transaction and
+        return how many events were applied. Concurrent flushes (from other
+        workers) can't apply the same events twice: the events are claimed
+        by deleting them before anything else is written, and a flush that
+        deletes a different number of events than it read rolls back. """
+        from app import db, cache
+        from app.models.answer import Answer
+        from app.models.question import touch_questions
+        from app.models.recommendation import Recommendation
+        from app.models.user import User
+        from app.models.vote_event import VoteEvent
+
+        events = db.session.execute(select(
+            VoteEvent.event_id, VoteEvent.answer_id, VoteEvent.question_id,
+            VoteEvent.user_id, VoteEvent.voted
+        ).order_by(VoteEvent.event_id).limit(self.batch_size)).all()
+        if not events:
+            db.session.rollback()
+            return 0
+        claimed = db.session.execute(delete(VoteEvent).where(
+            VoteEvent.event_id <= events[-1].event_id)).rowcount
+        if claimed != len(events):
+            db.session.rollback()
+            return 0
+
+        # The last event for each user and answer decides their vote
+        final_votes = {}
+        question_ids = {}
+        for event in events:
+            final_votes[(event.answer_id, event.user_id)] = event.voted
+            question_ids[event.answer_id] = event.question_id
+
+        # Find the votes already applied, and skip the answers and users
+        # that have been deleted since
+        pairs = list(final_votes)
+        existing_votes = {}
+        for start in range(0, len(pairs), VOTE_LOOKUP_CHUNK_SIZE):
+            existing_votes.update({
+                (row.answer_id, row.user_id): row.vote_id
+                for row in db.session.execute(select(
+                    Recommendation.vote_id, Recommendation.answer_id,
+                    Recommendation.user_id
+                ).where(tuple_(
+                    Recommendation.answer_id, Recommendation.user_id
+                ).in_(pairs[start:start + VOTE_LOOKUP_CHUNK_SIZE])))})
+        answer_ids = set(db.session.scalars(select(Answer.answer_id).where(
+            Answer.answer_id.in_({answer_id for answer_id, _ in pairs}))))
+        user_ids = set(db.session.scalars(select(User.user_id).where(
+            User.user_id.in_({user_id for _, user_id in pairs}))))
+
+        new_votes, removed_votes = [], []
+        vote_changes = Counter()
+        for (answer_id, user_id), voted in final_votes.items():
+            if voted and (answer_id, user_id) not in existing_votes and (
+                    answer_id in answer_ids and user_id in user_ids):
+                new_votes.append({"answer_id": answer_id, "user_id": user_id})
+                vote_changes[user_id] += 1
+            elif not voted and (answer_id, user_id) in existing_votes:
+                removed_votes.append(existing_votes[(answer_id, user_id)])
+                vote_changes[user_id] -= 1
+
+        # Write the changes in a few statements, counting each user's votes
+        # and bumping each voted question's revision once per batch
+        connection = db.session.connection()
+        if new_votes:
+            connection.execute(insert(Recommendation), new_votes)
+        if removed_votes:
+            connection.execute(delete(Recommendation).where(
+                Recommendation.vote_id.in_(removed_votes)))
+        users_table = User.__table__
+        changed_users = [{"changed_user_id": user_id, "change": change}
+                         for user_id, change in vote_changes.items() if change]
+        if changed_users:
+            connection.execute(users_table.update().where(
+                users_table.c.user_id == bindparam("changed_user_id")
+            ).values(
+                votes_count=users_table.c.votes_count + bindparam("change"),
+                revision=users_table.c.revision + 1,
+                updated_at=datetime.now(timezone.utc)), changed_users)
+        # Versions of questions with pending votes change as events arrive,
+        # and again here as their pending votes become recommendations
+        voted_question_ids = sorted(set(question_ids.values()))
+        touch_questions(connection, voted_question_ids)
+        db.session.commit()
+        cache.invalidate(*(
+            f"question:{question_id}" for question_id in voted_question_ids))
+        return len(events)
@@ -16,9 +16,101 @@ class Config(object):
 
         return URI
 
+    @property
+    def SQLALCHEMY_BINDS(self):
+        """ Get the optional read replica database URI from .env """
+        URI = os.environ.get("SQLALCHEMY_REPLICA_URI")
+        return {"replica": URI} if URI else None
+
+    # Database connections kept open in the pool, extra connections opened
+    # under load, and seconds to wait for a connection before failing
+    # (PostgreSQL; SQLite connections aren't pooled)
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+    # Test connections before using them, and replace connections older
+    # than this many seconds (-1 never replaces them)
+    DB_POOL_PRE_PING = os.environ.get(
+        "DB_POOL_PRE_PING", "").lower() in ["1", "true"]
+    DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", -1))
+    # Milliseconds before a PostgreSQL statement is cancelled (0 for none)
+    DB_STATEMENT_TIMEOUT = int(os.environ.get("DB_STATEMENT_TIMEOUT", 0))
+    # Seconds a user keeps reading from the primary database after writing,
+    # while the read replica catches up
+    REPLICA_STICKY_SECONDS = float(
+        os.environ.get("REPLICA_STICKY_SECONDS", 5))
+
     # Get the JWT secret key for signing access tokens
     JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY")
 
+    # Number of records returned per page of a list endpoint
+    PAGE_LIMIT_DEFAULT = int(os.environ.get("PAGE_LIMIT_DEFAULT", 50))
+    PAGE_LIMIT_MAX = int(os.environ.get("PAGE_LIMIT_MAX", 200))
+
+    # Most records fetched at once by id (e.g. /questions?ids=1,2,3)
+    MULTI_GET_MAX_IDS = int(os.environ.get("MULTI_GET_MAX_IDS", 100))
+
+    # Records fetched and sent per chunk when streaming a whole list
+    STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", 500))
+
+    # Most questions posted at once to /questions/batch
+    QUESTION_BATCH_MAX = int(os.environ.get("QUESTION_BATCH_MAX", 1000))
+
+    # Most matches of each post type ranked per search, the newest first
+    # (PostgreSQL)
+    SEARCH_MAX_CANDIDATES = int(
+        os.environ.get("SEARCH_MAX_CANDIDATES", 10000))
+
+    # Radius in km of /questions/nearby when none is given, and the
+    # largest radius allowed
+    GEO_DEFAULT_RADIUS_KM = float(
+        os.environ.get("GEO_DEFAULT_RADIUS_KM", 10))
+    GEO_MAX_RADIUS_KM = float(os.environ.get("GEO_MAX_RADIUS_KM", 200))
+
+    # Response cache backend ("memory" or "null"), entry lifetime in
+    # seconds and most responses kept before evicting the least recently used
+    CACHE_TYPE = os.environ.get("CACHE_TYPE", "memory")
+    CACHE_DEFAULT_TTL = int(os.environ.get("CACHE_DEFAULT_TTL", 300))
+    CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 1000))
+
+    # bcrypt cost (log2 rounds) for new password hashes; stored hashes
+    # with a different cost are rehashed when their user next logs in
+    BCRYPT_LOG_ROUNDS = int(os.environ.get("BCRYPT_LOG_ROUNDS", 12))
+    # Threads hashing passwords, and hashes allowed to wait for one
+    # before requests are turned away with a 503
+    PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+    PASSWORD_HASH_MAX_QUEUE = int(
+        os.environ.get("PASSWORD_HASH_MAX_QUEUE", 16))
+
+    # Report each request's SQL statements, database time and
+    # serialisation time in response headers and log lines
+    INSTRUMENTATION = os.environ.get(
+        "INSTRUMENTATION", "").lower() in ["1", "true"]
+
+    # Directory shared by worker processes (e.g. gunicorn workers) to
+    # report all their metrics at /metrics, and seconds between each
+    # worker writing its metrics there
+    METRICS_MULTIPROCESS_DIR = os.environ.get("METRICS_MULTIPROCESS_DIR")
+    METRICS_FLUSH_INTERVAL = int(os.environ.get("METRICS_FLUSH_INTERVAL", 5))
+
+    # Record votes to be applied in batches every VOTE_FLUSH_INTERVAL
+    # seconds, at most VOTE_FLUSH_BATCH_SIZE at a time, instead of applying
+    # each one as it's made
+    VOTE_WRITE_BEHIND = os.environ.get(
+        "VOTE_WRITE_BEHIND", "").lower() in ["1", "true"]
+    VOTE_FLUSH_INTERVAL = float(os.environ.get("VOTE_FLUSH_INTERVAL", 1))
+    VOTE_FLUSH_BATCH_SIZE = int(
+        os.environ.get("VOTE_FLUSH_BATCH_SIZE", 5000))
+
+    # Seconds between checks for new category and country data
+    REFERENCE_DATA_CHECK_INTERVAL = int(
+        os.environ.get("REFERENCE_DATA_CHECK_INTERVAL", 30))
+
+    # Seconds between checks for locations added by other workers to the
+    # location suggestion index
+    LOCATION_INDEX_CHECK_INTERVAL = int(
+        os.environ.get("LOCATION_INDEX_CHECK_INTERVAL", 30))
+
 
 # Different configurations using class inheritance
 class TestingConfig(Config):